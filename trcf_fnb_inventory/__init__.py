@@ -1,2 +1,7 @@
 from . import controllers
-from . import models
\ No newline at end of file
+from . import models
+
+
+def post_init_hook(env):
+    """Backfill bảng tổng hợp doanh thu từ lịch sử đơn POS khi cài module"""
+    env['trcf.sales.daily.fact'].rebuild()
@@ -1,13 +1,14 @@
 {
     'name': 'TRCF FNB Inventory',
     "author": "Tuấn Rang Cà Phê",
-    'version': '1.0',
+    'version': '1.1',
     'category': 'Inventory',
     'summary': 'Quản lý tồn kho đơn giản và khoa học cho quán cà phê của bạn từ Tuấn Rang Cà Phê.',
     'depends': ['base', 'web', 'trcf_pos_expenses', 'purchase', 'product', 'stock', 'point_of_sale', 'mrp', 'trcf_inventory_check_template'],
     'data': [
         'security/ir.model.access.csv',
         'data/trcf_scrap_reasons_data.xml',
+        'data/trcf_sales_daily_fact_cron.xml',
         'views/trcf_dashboard_template.xml',
         'views/trcf_stock_scrap_views.xml',
         'views/trcf_sidebar_template.xml',
@@ -35,6 +36,7 @@
             'https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined',
         ],
     },
+    'post_init_hook': 'post_init_hook',
     'installable': True,
     'application': True,
     'license': 'LGPL-3',
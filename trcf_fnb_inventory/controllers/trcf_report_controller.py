@@ -1,4 +1,5 @@
 import pytz
+from bisect import bisect_left, bisect_right
 from datetime import datetime, time, timedelta
 from odoo import http
 from odoo.http import request
@@ -8,11 +9,12 @@ class TrcfReportController(http.Controller):
     @http.route('/trcf_fnb_inventory/daily_report', type='http', auth='user', website=False)
     def daily_report(self, filter_type='today', date_from=None, date_to=None, **kw):
 
-        # --- BƯỚC 1: LẤY TIMEZONE CỦA USER ---
-        user_tz = pytz.timezone(request.env.user.tz or 'UTC')
-        # Lấy thời gian hiện tại theo giờ của User (Ví dụ: GMT+7)
-        now_user_tz = datetime.now(user_tz)
-        today = now_user_tz.date()
+        # --- BƯỚC 1: LẤY TIMEZONE CỦA CỬA HÀNG ---
+        # Cùng timezone với bảng trcf.sales.daily.fact để "hôm nay" khớp với ngày đã tổng hợp
+        store_tz = pytz.timezone(request.env['trcf.sales.daily.fact']._get_store_tz())
+        # Lấy thời gian hiện tại theo giờ cửa hàng (Ví dụ: GMT+7)
+        now_store_tz = datetime.now(store_tz)
+        today = now_store_tz.date()
 
         # --- BƯỚC 2: XÁC ĐỊNH KHOẢNG THỜI GIAN (USER TIME) ---
         if filter_type == 'today':
@@ -32,18 +34,25 @@ class TrcfReportController(http.Controller):
             current_start = today
             current_end = today
 
-        # Lấy dữ liệu kỳ hiện tại
-        total_pos_revenue = self.get_pos_revenue(current_start, current_end)
-        total_orders = self.get_pos_order_count(current_start, current_end)
-        total_qty = self.get_pos_order_qty(current_start, current_end)
-        payment_methods = self.get_payment_method_revenue(current_start, current_end)
-        revenue_by_presets = self.get_revenue_by_preset(current_start, current_end)
-
-        # Lấy dữ liệu kỳ trước để so sánh
+        # Lấy dữ liệu kỳ hiện tại và kỳ trước trong cùng một lượt tổng hợp
         previous_start, previous_end = self.get_previous_period(filter_type, current_start, current_end)
-        previous_revenue = self.get_pos_revenue(previous_start, previous_end)
-        previous_orders = self.get_pos_order_count(previous_start, previous_end)
-        previous_qty = self.get_pos_order_qty(previous_start, previous_end)
+        sales_metrics = self.get_sales_metrics({
+            'current': (current_start, current_end),
+            'previous': (previous_start, previous_end),
+        })
+        current_metrics = sales_metrics['current']
+        previous_metrics = sales_metrics['previous']
+
+        total_pos_revenue = current_metrics['revenue']
+        total_orders = current_metrics['order_count']
+        total_qty = current_metrics['qty']
+        payment_methods = current_metrics['payment_methods']
+        revenue_by_presets = current_metrics['presets']
+
+        # Dữ liệu kỳ trước để so sánh
+        previous_revenue = previous_metrics['revenue']
+        previous_orders = previous_metrics['order_count']
+        previous_qty = previous_metrics['qty']
 
         # Tính % thay đổi
         revenue_comparison = self.calculate_comparison(total_pos_revenue, previous_revenue)
@@ -197,201 +206,89 @@ class TrcfReportController(http.Controller):
             'formatted': f"{'+' if change > 0 else ''}{change:.1f}%"
         }
 
-    def get_pos_revenue(self, start_date, end_date):
-        # 1. Setup Timezone
-        user_tz = pytz.timezone(request.env.user.tz or 'UTC')
-        
-        dt_start = datetime.combine(start_date, time.min)
-        dt_end = datetime.combine(end_date, time.max)
-        
-        # 2. XỬ LÝ LỖI "Use naive datetimes":
-        # Bước 1: Localize (gán múi giờ User) -> Bước 2: Đổi sang UTC -> Bước 3: Xóa info timezone (.replace(tzinfo=None))
-        dt_start_utc = user_tz.localize(dt_start).astimezone(pytz.utc).replace(tzinfo=None)
-        dt_end_utc = user_tz.localize(dt_end).astimezone(pytz.utc).replace(tzinfo=None)
+    def get_sales_metrics(self, periods):
+        """
+        Tính toàn bộ chỉ số bán hàng cho nhiều kỳ từ bảng tổng hợp trcf.sales.daily.fact.
 
-        domain = [
-            ('date_order', '>=', dt_start_utc),
-            ('date_order', '<=', dt_end_utc),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ]
-
-        # 3. XỬ LÝ LỖI "read_group is deprecated":
-        # Sử dụng _read_group (có dấu gạch dưới). Hàm này trả về list các tuple.
-        # aggregates=['amount_total:sum'] -> Tính tổng trường amount_total
-        result = request.env['pos.order']._read_group(
-            domain=domain,
-            aggregates=['amount_total:sum']
-        )
-        
-        # Kết quả trả về dạng: [(Tổng_tiền,)]
-        # result[0] là tuple đầu tiên, result[0][0] là giá trị sum.
-        # Nếu không có đơn hàng nào, nó có thể trả về None, nên dùng (or 0)
-        return result[0][0] or 0
-
-    def get_pos_order_count(self, start_date, end_date):
-        # 1. Setup Timezone
-        user_tz = pytz.timezone(request.env.user.tz or 'UTC')
-        
-        dt_start = datetime.combine(start_date, time.min)
-        dt_end = datetime.combine(end_date, time.max)
-        
-        # 2. XỬ LÝ LỖI "Use naive datetimes":
-        # Bước 1: Localize (gán múi giờ User) -> Bước 2: Đổi sang UTC -> Bước 3: Xóa info timezone (.replace(tzinfo=None))
-        dt_start_utc = user_tz.localize(dt_start).astimezone(pytz.utc).replace(tzinfo=None)
-        dt_end_utc = user_tz.localize(dt_end).astimezone(pytz.utc).replace(tzinfo=None)
+        Args:
+            periods: dict {period_key: (start_date, end_date)}
+                     Ví dụ: {'current': (d1, d2), 'previous': (d3, d4)}
 
-        domain = [
-            ('date_order', '>=', dt_start_utc),
-            ('date_order', '<=', dt_end_utc),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ]
+        Returns:
+            dict {period_key: {'revenue', 'order_count', 'qty', 'payment_methods', 'presets'}}
 
-        # Tính tổng số đơn hàng
-        total_orders = request.env['pos.order'].search_count(domain)
-        
-        return total_orders
+        Chỉ một _read_group trên bảng tổng hợp cho toàn bộ khoảng ngày của các kỳ,
+        sau đó phân bổ từng ngày vào các kỳ tương ứng (các kỳ chồng lấn vẫn đúng).
+        """
+        metrics = {
+            key: {'revenue': 0, 'order_count': 0, 'qty': 0, 'payment_methods': [], 'presets': []}
+            for key in periods
+        }
+        if not periods:
+            return metrics
+
+        # 1. Đọc các dòng tổng hợp theo ngày, preset, phương thức thanh toán
+        date_from = min(start for start, _end in periods.values())
+        date_to = max(end for _start, end in periods.values())
+        result = request.env['trcf.sales.daily.fact'].sudo()._read_group(
+            domain=[
+                ('date', '>=', date_from),
+                ('date', '<=', date_to),
+                ('company_id', 'in', request.env.companies.ids),
+            ],
+            groupby=['date:day', 'preset_id', 'payment_method_id'],
+            aggregates=['order_count:sum', 'amount_total:sum', 'qty:sum', 'payment_amount:sum', 'payment_order_count:sum'],
+        )
 
-    def get_pos_order_qty(self, start_date, end_date):
-        # 1. Setup Timezone
-        user_tz = pytz.timezone(request.env.user.tz or 'UTC')
-        
-        dt_start = datetime.combine(start_date, time.min)
-        dt_end = datetime.combine(end_date, time.max)
-        
-        # 2. XỬ LÝ LỖI "Use naive datetimes":
-        # Bước 1: Localize (gán múi giờ User) -> Bước 2: Đổi sang UTC -> Bước 3: Xóa info timezone (.replace(tzinfo=None))
-        dt_start_utc = user_tz.localize(dt_start).astimezone(pytz.utc).replace(tzinfo=None)
-        dt_end_utc = user_tz.localize(dt_end).astimezone(pytz.utc).replace(tzinfo=None)
+        # 2. Gom kết quả theo kỳ
+        preset_data = {key: {} for key in periods}
+        payment_data = {key: {} for key in periods}
+        for day, preset, payment_method, order_count, revenue, qty, payment_amount, payment_order_count in result:
+            for period_key, (start_date, end_date) in periods.items():
+                if not start_date <= day <= end_date:
+                    continue
+                if payment_method:
+                    amount, count = payment_data[period_key].get(payment_method, (0, 0))
+                    payment_data[period_key][payment_method] = (amount + payment_amount, count + payment_order_count)
+                    continue
+                metrics[period_key]['order_count'] += order_count
+                metrics[period_key]['revenue'] += revenue
+                metrics[period_key]['qty'] += qty
+                if preset:
+                    count, amount = preset_data[period_key].get(preset, (0, 0))
+                    preset_data[period_key][preset] = (count + order_count, amount + revenue)
+
+        # 3. Format kết quả, giữ thứ tự mặc định của model
+        currency = request.env.company.currency_id
 
-        domain = [
-            ('date_order', '>=', dt_start_utc),
-            ('date_order', '<=', dt_end_utc),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ]
-        
-        # Tìm tất cả các order trong domain
-        order_ids = request.env['pos.order'].search(domain).ids
-        
-        if not order_ids:
-            return 0
-            
-        # Tính tổng số lượng sản phẩm bán ra từ pos.order.line
-        domain_lines = [('order_id', 'in', order_ids)]
-        
-        result_lines = request.env['pos.order.line']._read_group(
-            domain=domain_lines,
-            aggregates=['qty:sum']
-        )
-        
-        total_qty = result_lines[0][0] or 0
-        
-        return total_qty
+        # Định nghĩa màu sắc cho các preset và phương thức thanh toán
+        preset_colors = ['green-500', 'blue-500', 'orange-500', 'purple-500', 'pink-500', 'indigo-500', 'red-500', 'yellow-500']
+        payment_colors = ['cyan-500', 'violet-500', 'amber-500', 'green-500', 'blue-500', 'pink-500', 'indigo-500', 'red-500']
 
-    def get_payment_method_revenue(self, start_date, end_date):
-        """Lấy doanh thu theo từng phương thức thanh toán"""
-        # 1. Setup Timezone
-        user_tz = pytz.timezone(request.env.user.tz or 'UTC')
-        
-        dt_start = datetime.combine(start_date, time.min)
-        dt_end = datetime.combine(end_date, time.max)
-        
-        # 2. Convert to UTC
-        dt_start_utc = user_tz.localize(dt_start).astimezone(pytz.utc).replace(tzinfo=None)
-        dt_end_utc = user_tz.localize(dt_end).astimezone(pytz.utc).replace(tzinfo=None)
+        for period_key, period_metrics in metrics.items():
+            presets = request.env['pos.preset'].union(*preset_data[period_key]).sorted()
+            for preset in presets:
+                count, revenue = preset_data[period_key][preset]
+                period_metrics['presets'].append({
+                    'name': preset.name,
+                    'count': count,
+                    'revenue': revenue,
+                    'formatted_revenue': currency.format(revenue),
+                    'color': preset_colors[len(period_metrics['presets']) % len(preset_colors)],
+                })
 
-        # 3. Lấy tất cả các đơn hàng trong khoảng thời gian
-        domain_orders = [
-            ('date_order', '>=', dt_start_utc),
-            ('date_order', '<=', dt_end_utc),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ]
-        
-        order_ids = request.env['pos.order'].search(domain_orders).ids
-        
-        if not order_ids:
-            return []
-        
-        # 4. Lấy tất cả các payment của các đơn hàng này
-        domain_payments = [('pos_order_id', 'in', order_ids)]
-        
-        # 5. Group by payment_method_id và tính tổng amount
-        result = request.env['pos.payment']._read_group(
-            domain=domain_payments,
-            groupby=['payment_method_id'],
-            aggregates=['amount:sum']
-        )
-        
-        
-        # 6. Format kết quả
-        currency = request.env.company.currency_id
-        payment_methods = []
-        
-        # Định nghĩa màu sắc cho các phương thức thanh toán
-        colors = ['cyan-500', 'violet-500', 'amber-500', 'green-500', 'blue-500', 'pink-500', 'indigo-500', 'red-500']
-        
-        for idx, (payment_method, amount_sum) in enumerate(result):
-            if payment_method:  # Bỏ qua nếu payment_method là False/None
-                # Đếm số đơn duy nhất cho payment method này
-                payments = request.env['pos.payment'].sudo().search([
-                    ('pos_order_id', 'in', order_ids),
-                    ('payment_method_id', '=', payment_method.id)
-                ])
-                order_count = len(set(payments.mapped('pos_order_id').ids))
-                
-                payment_methods.append({
+            payment_methods = request.env['pos.payment.method'].union(*payment_data[period_key]).sorted()
+            for payment_method in payment_methods:
+                amount, order_count = payment_data[period_key][payment_method]
+                period_metrics['payment_methods'].append({
                     'name': payment_method.name,
-                    'amount': amount_sum or 0,
-                    'formatted_amount': currency.format(amount_sum or 0),
+                    'amount': amount,
+                    'formatted_amount': currency.format(amount),
                     'count': order_count,
-                    'color': colors[idx % len(colors)]  # Lấy màu theo vòng lặp
+                    'color': payment_colors[len(period_metrics['payment_methods']) % len(payment_colors)],
                 })
-        
-        return payment_methods
-
-    def get_revenue_by_preset(self, start_date, end_date):
-        """Phân loại đơn hàng theo preset (tại chỗ, mang về, delivery platforms)"""
-        # 1. Setup Timezone
-        user_tz = pytz.timezone(request.env.user.tz or 'UTC')
-        
-        dt_start = datetime.combine(start_date, time.min)
-        dt_end = datetime.combine(end_date, time.max)
-        
-        # 2. Convert to UTC
-        dt_start_utc = user_tz.localize(dt_start).astimezone(pytz.utc).replace(tzinfo=None)
-        dt_end_utc = user_tz.localize(dt_end).astimezone(pytz.utc).replace(tzinfo=None)
 
-        # 3. Lấy tất cả các đơn hàng trong khoảng thời gian
-        domain = [
-            ('date_order', '>=', dt_start_utc),
-            ('date_order', '<=', dt_end_utc),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ]
-        
-        # 4. Group by preset_id, đếm số đơn và tính tổng doanh thu
-        result = request.env['pos.order']._read_group(
-            domain=domain,
-            groupby=['preset_id'],
-            aggregates=['__count', 'amount_total:sum']
-        )
-        
-        # 5. Format kết quả
-        currency = request.env.company.currency_id
-        order_presets = []
-        
-        # Định nghĩa màu sắc cho các preset
-        colors = ['green-500', 'blue-500', 'orange-500', 'purple-500', 'pink-500', 'indigo-500', 'red-500', 'yellow-500']
-        
-        for idx, (preset, count, revenue) in enumerate(result):
-            if preset:  # Bỏ qua nếu preset là False/None
-                order_presets.append({
-                    'name': preset.name,
-                    'count': count or 0,
-                    'revenue': revenue or 0,
-                    'formatted_revenue': currency.format(revenue or 0),
-                    'color': colors[idx % len(colors)]  # Lấy màu theo vòng lặp
-                })
-        
-        return order_presets
+        return metrics
 
     def get_expense_stats(self, start_date, end_date):
         """Lấy thống kê chi phí theo phương thức thanh toán"""
@@ -669,6 +566,212 @@ class TrcfReportController(http.Controller):
             'payment_methods': payment_method_data,
         }
 
+    def _build_time_series(self, records, date_field, amount_field, method_field):
+        """
+        Gom các dòng (đã sắp xếp theo ngày) thành chuỗi cộng dồn theo payment method.
+
+        Returns:
+            dict {payment_method_id: (dates, prefix_sums)} với prefix_sums[i] là tổng
+            của i dòng đầu tiên, dùng để tính tổng trong một khoảng bằng bisect.
+        """
+        series = {}
+        for record in records:
+            if not record[method_field] or not record[date_field]:
+                continue
+            dates, prefix_sums = series.setdefault(record[method_field][0], ([], [0]))
+            dates.append(record[date_field])
+            prefix_sums.append(prefix_sums[-1] + record[amount_field])
+        return series
+
+    def _sum_in_window(self, series, payment_method_id, date_from, date_to):
+        """Tổng giá trị của một payment method trong khoảng [date_from, date_to]"""
+        if payment_method_id not in series or not date_from or not date_to:
+            return 0
+        dates, prefix_sums = series[payment_method_id]
+        return prefix_sums[bisect_right(dates, date_to)] - prefix_sums[bisect_left(dates, date_from)]
+
+    def _build_session_ledgers(self, sessions, until=None):
+        """
+        Tổng hợp sổ quỹ cho nhiều phiên cùng lúc: mỗi model chỉ đọc một lần,
+        sau đó phân bổ kết quả về từng phiên / payment method trong bộ nhớ.
+
+        Args:
+            sessions: recordset pos.session
+            until: thời điểm kết thúc (UTC naive) cho chi phí / mua hàng,
+                   mặc định là stop_at của từng phiên
+
+        Returns:
+            dict {session_id: {
+                'total_revenue', 'total_qty', 'order_count',
+                'payment_methods': {payment_method_id: {'sales_income', 'order_count', 'total_qty', 'expenses', 'purchases'}},
+                'split_payment_orders': [...],
+            }}
+        """
+        ledgers = {
+            session.id: {
+                'total_revenue': 0,
+                'total_qty': 0,
+                'order_count': 0,
+                'payment_methods': {},
+                'split_payment_orders': [],
+            }
+            for session in sessions
+        }
+        if not sessions:
+            return ledgers
+
+        # 1. Tất cả đơn đã thanh toán của các phiên (1 query)
+        orders = request.env['pos.order'].sudo().search([
+            ('session_id', 'in', sessions.ids),
+            ('state', 'in', ['paid', 'done', 'invoiced']),
+        ], order='id')
+        order_sessions = {order.id: order.session_id.id for order in orders}
+
+        # 2. Số món theo đơn (1 query)
+        order_qty = {
+            order.id: qty or 0
+            for order, qty in request.env['pos.order.line'].sudo()._read_group(
+                domain=[('order_id', 'in', orders.ids)],
+                groupby=['order_id'],
+                aggregates=['qty:sum'],
+            )
+        }
+
+        for order in orders:
+            ledger = ledgers[order_sessions[order.id]]
+            ledger['total_revenue'] += order.amount_total
+            ledger['total_qty'] += order_qty.get(order.id, 0)
+            ledger['order_count'] += 1
+
+        # 3. Thanh toán theo (đơn, payment method) (1 query)
+        payment_groups = request.env['pos.payment'].sudo()._read_group(
+            domain=[('pos_order_id', 'in', orders.ids)],
+            groupby=['pos_order_id', 'payment_method_id'],
+            aggregates=['__count', 'amount:sum'],
+        )
+        order_payments = {}
+        for order, payment_method, count, amount in payment_groups:
+            if not payment_method:
+                continue
+            order_payments.setdefault(order.id, []).append((payment_method, count))
+            pm_data = ledgers[order_sessions[order.id]]['payment_methods'].setdefault(payment_method.id, {
+                'sales_income': 0,
+                'order_count': 0,
+                'total_qty': 0,
+            })
+            pm_data['sales_income'] += amount or 0
+            pm_data['order_count'] += 1
+            pm_data['total_qty'] += order_qty.get(order.id, 0)
+
+        # 4. Chi phí và mua hàng: đọc một lần cho toàn bộ khoảng thời gian của các phiên
+        windows = {
+            session.id: (session.start_at, until or session.stop_at)
+            for session in sessions
+        }
+        window_start = min((start for start, _end in windows.values() if start), default=None)
+        window_end = max((end for _start, end in windows.values() if end), default=None)
+        expense_series = {}
+        purchase_series = {}
+        if window_start and window_end:
+            expenses = request.env['trcf.expense'].sudo().search_read([
+                ('trcf_payment_date', '>=', window_start),
+                ('trcf_payment_date', '<=', window_end),
+                ('state', '=', 'paid'),
+                ('trcf_payment_method_id', '!=', False),
+            ], ['trcf_payment_date', 'trcf_payment_method_id', 'trcf_amount'], order='trcf_payment_date')
+            expense_series = self._build_time_series(
+                expenses, 'trcf_payment_date', 'trcf_amount', 'trcf_payment_method_id')
+
+            purchases = request.env['purchase.order'].sudo().search_read([
+                ('date_order', '>=', window_start),
+                ('date_order', '<=', window_end),
+                ('trcf_payment_status', '=', 'paid'),
+                ('trcf_payment_method_id', '!=', False),
+            ], ['date_order', 'trcf_payment_method_id', 'amount_total'], order='date_order')
+            purchase_series = self._build_time_series(
+                purchases, 'date_order', 'amount_total', 'trcf_payment_method_id')
+
+        for session in sessions:
+            date_from, date_to = windows[session.id]
+            session_methods = ledgers[session.id]['payment_methods']
+            for pm in session.payment_method_ids:
+                pm_data = session_methods.setdefault(pm.id, {
+                    'sales_income': 0,
+                    'order_count': 0,
+                    'total_qty': 0,
+                })
+                pm_data['expenses'] = self._sum_in_window(expense_series, pm.id, date_from, date_to)
+                pm_data['purchases'] = self._sum_in_window(purchase_series, pm.id, date_from, date_to)
+
+        # 5. Dòng có discount của tất cả đơn (1 query)
+        discount_lines = {}
+        for line in request.env['pos.order.line'].sudo().search([
+            ('order_id', 'in', orders.ids),
+            ('discount', '>', 0),
+        ], order='id'):
+            discount_lines.setdefault(line.order_id.id, []).append(line)
+
+        # 6. Phát hiện đơn có nhiều phương thức thanh toán (split payment) và discount
+        for order in orders:
+            anomalies = ledgers[order_sessions[order.id]]['split_payment_orders']
+            payments = order_payments.get(order.id, [])
+            payment_count = sum(count for _pm, count in payments)
+            if payment_count > 1:
+                anomalies.append({
+                    'name': order.name,
+                    'payment_count': payment_count,
+                    'payment_methods': ', '.join(pm.name for pm, _count in payments),
+                    'amount': order.amount_total,
+                })
+
+            for line in discount_lines.get(order.id, []):
+                anomalies.append({
+                    'type': 'discount',
+                    'order_name': order.name,
+                    'product_name': line.product_id.name if line.product_id else 'Unknown',
+                    'discount_percent': line.discount,
+                    'original_price': line.price_unit,
+                    'final_price': line.price_unit * (1 - line.discount/100),
+                    'qty': line.qty,
+                })
+
+        return ledgers
+
+    def _format_session_payment_methods(self, session, ledger, balance_key):
+        """Dựng danh sách payment method của một phiên từ sổ quỹ đã tổng hợp"""
+        currency = request.env.company.currency_id
+        payment_method_data = []
+
+        for pm in session.payment_method_ids:
+            pm_data = ledger['payment_methods'][pm.id]
+
+            # 1. Số dư đầu ca (chỉ cash có)
+            opening_balance = session.cash_register_balance_start if pm.is_cash_count else 0
+            sales_income = pm_data['sales_income']
+            total_expenses = pm_data['expenses']
+            total_purchases = pm_data['purchases']
+
+            # 2. Số dư = đầu ca + thu - chi phí - mua hàng
+            balance = opening_balance + sales_income - total_expenses - total_purchases
+
+            payment_method_data.append({
+                'name': pm.name,
+                'opening_balance': opening_balance,
+                'opening_balance_formatted': currency.format(opening_balance),
+                'sales_income': sales_income,
+                'sales_income_formatted': currency.format(sales_income),
+                'order_count': pm_data['order_count'],
+                'total_qty': int(pm_data['total_qty']),
+                'expenses': total_expenses,
+                'expenses_formatted': currency.format(total_expenses),
+                'purchases': total_purchases,
+                'purchases_formatted': currency.format(total_purchases),
+                balance_key: balance,
+                f'{balance_key}_formatted': currency.format(balance),
+            })
+
+        return payment_method_data
+
     def get_open_session_summary(self, start_date, end_date):
         """Lấy báo cáo cho các phiên đang mở (opened sessions)"""
         # 1. Setup Timezone
@@ -692,126 +795,33 @@ class TrcfReportController(http.Controller):
         if not sessions:
             return []
         
-        # 3. Format kết quả cho từng phiên
+        # 3. Tổng hợp sổ quỹ cho tất cả phiên (chi phí / mua hàng tính đến hiện tại)
+        ledgers = self._build_session_ledgers(sessions, until=now_utc)
+
+        # 4. Format kết quả cho từng phiên
         currency = request.env.company.currency_id
         session_list = []
+        current_time_local = now_user_tz.strftime('%H:%M')
         
         for session in sessions:
-            # Lấy các đơn hàng của phiên này
-            orders = session.order_ids.filtered(lambda o: o.state in ['paid', 'done', 'invoiced'])
-            
-            # Tính tổng doanh thu và số món
-            total_revenue = sum(orders.mapped('amount_total'))
-            total_qty = sum(orders.mapped('lines').mapped('qty'))
-            total_orders = len(orders)
-            
-            # Lấy tất cả payment methods của phiên
-            payment_method_data = []
-            
-            for pm in session.payment_method_ids:
-                # 1. Số dư đầu ca (chỉ cash có)
-                opening_balance = session.cash_register_balance_start if pm.is_cash_count else 0
-                
-                # 2. Thu từ bán hàng - Dùng _read_group
-                domain_payments = [
-                    ('pos_order_id', 'in', orders.ids),
-                    ('payment_method_id', '=', pm.id)
-                ]
-                
-                # Tính tổng tiền
-                result = request.env['pos.payment']._read_group(
-                    domain=domain_payments,
-                    aggregates=['amount:sum']
-                )
-                sales_income = result[0][0] if result and result[0] else 0
-                
-                # Đếm số đơn duy nhất
-                payments = request.env['pos.payment'].sudo().search(domain_payments)
-                unique_orders = payments.mapped('pos_order_id')
-                order_count = len(unique_orders)
-                
-                # Tính tổng số món
-                total_qty_pm = sum(unique_orders.mapped('lines').mapped('qty'))
-                
-                # 3. Chi phí từ lúc mở phiên đến hiện tại
-                expenses = request.env['trcf.expense'].sudo().search([
-                    ('trcf_payment_date', '>=', session.start_at),
-                    ('trcf_payment_date', '<=', now_utc),
-                    ('state', '=', 'paid'),
-                    ('trcf_payment_method_id', '=', pm.id),
-                ])
-                total_expenses = sum(expenses.mapped('trcf_amount'))
-                
-                # 4. Mua hàng từ lúc mở phiên đến hiện tại
-                purchases = request.env['purchase.order'].sudo().search([
-                    ('date_order', '>=', session.start_at),
-                    ('date_order', '<=', now_utc),
-                    ('trcf_payment_status', '=', 'paid'),
-                    ('trcf_payment_method_id', '=', pm.id),
-                ])
-                total_purchases = sum(purchases.mapped('amount_total'))
-                
-                # 5. Số dư hiện tại
-                current_balance = opening_balance + sales_income - total_expenses - total_purchases
-                
-                payment_method_data.append({
-                    'name': pm.name,
-                    'opening_balance': opening_balance,
-                    'opening_balance_formatted': currency.format(opening_balance),
-                    'sales_income': sales_income,
-                    'sales_income_formatted': currency.format(sales_income),
-                    'order_count': order_count,
-                    'total_qty': int(total_qty_pm),
-                    'expenses': total_expenses,
-                    'expenses_formatted': currency.format(total_expenses),
-                    'purchases': total_purchases,
-                    'purchases_formatted': currency.format(total_purchases),
-                    'current_balance': current_balance,
-                    'current_balance_formatted': currency.format(current_balance),
-                })
+            ledger = ledgers[session.id]
+            payment_method_data = self._format_session_payment_methods(session, ledger, 'current_balance')
             
             # Format thời gian
             start_at_local = pytz.utc.localize(session.start_at).astimezone(user_tz) if session.start_at else None
-            current_time_local = now_user_tz.strftime('%H:%M')
-            
-            # Phát hiện đơn có nhiều phương thức thanh toán (split payment)
-            split_payment_orders = []
-            for order in orders:
-                payment_count = len(order.payment_ids)
-                if payment_count > 1:
-                    payment_methods = ', '.join(order.payment_ids.mapped('payment_method_id.name'))
-                    split_payment_orders.append({
-                        'name': order.name,
-                        'payment_count': payment_count,
-                        'payment_methods': payment_methods,
-                        'amount': order.amount_total,
-                    })
-                
-                # Phát hiện discount trong order lines
-                for line in order.lines:
-                    if line.discount > 0:
-                        split_payment_orders.append({
-                            'type': 'discount',
-                            'order_name': order.name,
-                            'product_name': line.product_id.name if line.product_id else 'Unknown',
-                            'discount_percent': line.discount,
-                            'original_price': line.price_unit,
-                            'final_price': line.price_unit * (1 - line.discount/100),
-                            'qty': line.qty,
-                        })
             
             session_list.append({
                 'name': session.name,
                 'user_name': session.user_id.name,
                 'start_at': start_at_local.strftime('%H:%M') if start_at_local else 'N/A',
                 'current_time': current_time_local,
-                'total_revenue': total_revenue,
-                'total_revenue_formatted': currency.format(total_revenue),
-                'order_count': total_orders,
-                'total_qty': int(total_qty),
+                'total_revenue': ledger['total_revenue'],
+                'total_revenue_formatted': currency.format(ledger['total_revenue']),
+                'order_count': ledger['order_count'],
+                'total_qty': int(ledger['total_qty']),
                 'payment_methods': payment_method_data,
-                'split_payment_count': len(split_payment_orders),
-                'split_payment_orders': split_payment_orders,
+                'split_payment_count': len(ledger['split_payment_orders']),
+                'split_payment_orders': ledger['split_payment_orders'],
             })
 
         
@@ -837,126 +847,34 @@ class TrcfReportController(http.Controller):
         
         sessions = request.env['pos.session'].sudo().search(domain, order='start_at desc')
         
-        # 4. Format kết quả
+        # 4. Tổng hợp sổ quỹ cho tất cả phiên
+        ledgers = self._build_session_ledgers(sessions)
+
+        # 5. Format kết quả
         currency = request.env.company.currency_id
         session_list = []
         
         for session in sessions:
-            # Tính tổng doanh thu
-            total_revenue = sum(session.order_ids.filtered(lambda o: o.state in ['paid', 'done', 'invoiced']).mapped('amount_total'))
-            
-            # Tính số món bán ra
-            total_qty = sum(session.order_ids.filtered(lambda o: o.state in ['paid', 'done', 'invoiced']).mapped('lines').mapped('qty'))
-            
-            # Lấy tất cả payment methods của phiên
-            payment_method_data = []
-            
-            for pm in session.payment_method_ids:
-                # 1. Số dư đầu ca (chỉ cash có)
-                opening_balance = session.cash_register_balance_start if pm.is_cash_count else 0
-                
-                # 2. Thu từ bán hàng - Dùng _read_group
-                paid_orders = session.order_ids.filtered(lambda o: o.state in ['paid', 'done', 'invoiced'])
-                domain_payments = [
-                    ('pos_order_id', 'in', paid_orders.ids),
-                    ('payment_method_id', '=', pm.id)
-                ]
-                
-                # Tính tổng tiền
-                result = request.env['pos.payment']._read_group(
-                    domain=domain_payments,
-                    aggregates=['amount:sum']
-                )
-                sales_income = result[0][0] if result and result[0] else 0
-                
-                # Đếm số đơn duy nhất
-                payments = request.env['pos.payment'].sudo().search(domain_payments)
-                unique_orders = payments.mapped('pos_order_id')
-                order_count = len(unique_orders)
-                
-                # Tính tổng số món
-                total_qty_pm = sum(unique_orders.mapped('lines').mapped('qty'))
-                
-                # 3. Chi phí trong thời gian phiên với payment method này
-                expenses = request.env['trcf.expense'].sudo().search([
-                    ('trcf_payment_date', '>=', session.start_at),
-                    ('trcf_payment_date', '<=', session.stop_at),
-                    ('state', '=', 'paid'),
-                    ('trcf_payment_method_id', '=', pm.id),
-                ])
-                total_expenses = sum(expenses.mapped('trcf_amount'))
-                
-                # 4. Mua hàng trong thời gian phiên với payment method này
-                purchases = request.env['purchase.order'].sudo().search([
-                    ('date_order', '>=', session.start_at),
-                    ('date_order', '<=', session.stop_at),
-                    ('trcf_payment_status', '=', 'paid'),
-                    ('trcf_payment_method_id', '=', pm.id),
-                ])
-                total_purchases = sum(purchases.mapped('amount_total'))
-                
-                # 5. Số dư cuối ca
-                closing_balance = opening_balance + sales_income - total_expenses - total_purchases
-                
-                payment_method_data.append({
-                    'name': pm.name,
-                    'opening_balance': opening_balance,
-                    'opening_balance_formatted': currency.format(opening_balance),
-                    'sales_income': sales_income,
-                    'sales_income_formatted': currency.format(sales_income),
-                    'order_count': order_count,
-                    'total_qty': int(total_qty_pm),
-                    'expenses': total_expenses,
-                    'expenses_formatted': currency.format(total_expenses),
-                    'purchases': total_purchases,
-                    'purchases_formatted': currency.format(total_purchases),
-                    'closing_balance': closing_balance,
-                    'closing_balance_formatted': currency.format(closing_balance),
-                })
+            ledger = ledgers[session.id]
+            payment_method_data = self._format_session_payment_methods(session, ledger, 'closing_balance')
             
             # Format thời gian
             start_at_local = pytz.utc.localize(session.start_at).astimezone(user_tz) if session.start_at else None
             stop_at_local = pytz.utc.localize(session.stop_at).astimezone(user_tz) if session.stop_at else None
             
-            # Phát hiện đơn có nhiều phương thức thanh toán (split payment)
-            split_payment_orders = []
-            for order in paid_orders:
-                payment_count = len(order.payment_ids)
-                if payment_count > 1:
-                    payment_methods = ', '.join(order.payment_ids.mapped('payment_method_id.name'))
-                    split_payment_orders.append({
-                        'name': order.name,
-                        'payment_count': payment_count,
-                        'payment_methods': payment_methods,
-                        'amount': order.amount_total,
-                    })
-                
-                # Phát hiện discount trong order lines
-                for line in order.lines:
-                    if line.discount > 0:
-                        split_payment_orders.append({
-                            'type': 'discount',
-                            'order_name': order.name,
-                            'product_name': line.product_id.name if line.product_id else 'Unknown',
-                            'discount_percent': line.discount,
-                            'original_price': line.price_unit,
-                            'final_price': line.price_unit * (1 - line.discount/100),
-                            'qty': line.qty,
-                        })
-            
             session_list.append({
                 'name': session.name,
                 'user_name': session.user_id.name,
                 'start_at': start_at_local.strftime('%H:%M') if start_at_local else 'N/A',
                 'stop_at': stop_at_local.strftime('%H:%M') if stop_at_local else 'N/A',
-                'total_revenue': total_revenue,
-                'total_revenue_formatted': currency.format(total_revenue),
+                'total_revenue': ledger['total_revenue'],
+                'total_revenue_formatted': currency.format(ledger['total_revenue']),
                 'order_count': session.order_count,
-                'total_qty': int(total_qty),
+                'total_qty': int(ledger['total_qty']),
                 'payment_methods': payment_method_data,
-                'split_payment_count': len(split_payment_orders),
-                'split_payment_orders': split_payment_orders,
+                'split_payment_count': len(ledger['split_payment_orders']),
+                'split_payment_orders': ledger['split_payment_orders'],
             })
 
         
-        return session_list
\ No newline at end of file
+        return session_list
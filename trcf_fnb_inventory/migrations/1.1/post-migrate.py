@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Migration script: Backfill trcf.sales.daily.fact on existing databases
+
+post_init_hook only runs on a fresh install. Databases upgraded to 1.1 have
+their whole POS history rebuilt here, otherwise the daily report and the P&L
+dashboard (which read only this table) show zero revenue before the upgrade.
+"""
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Migration function called by Odoo during module upgrade
+    """
+    if not version:
+        return
+    _logger.info("Starting migration: rebuild trcf.sales.daily.fact")
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['trcf.sales.daily.fact'].rebuild()
+    _logger.info("Migration completed successfully")
@@ -1,3 +1,5 @@
 from . import trcf_purchase_order
 from . import trcf_stock_scrap
 from . import trcf_inventory_config_settings
+from . import trcf_sales_daily_fact
+from . import trcf_pos_order
\ No newline at end of file
@@ -0,0 +1,35 @@
+from odoo import models, api
+
+
+class TrcfPosOrder(models.Model):
+    _inherit = 'pos.order'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        orders._trcf_mark_sales_fact_dirty()
+        return orders
+
+    def write(self, vals):
+        # Đổi ngày / phiên thì lát cũ cũng phải tính lại, đọc lát cũ trước khi ghi
+        old_slices = set()
+        if {'date_order', 'session_id'} & vals.keys():
+            self.env.flush_all()
+            old_slices = self.env['trcf.sales.daily.fact']._get_order_slices(self.ids)
+        res = super().write(vals)
+        # Chỉ các thay đổi ảnh hưởng tới doanh thu mới cần cập nhật bảng tổng hợp
+        if {'state', 'amount_total', 'preset_id', 'date_order', 'session_id'} & vals.keys():
+            self._trcf_mark_sales_fact_dirty(old_slices)
+        return res
+
+    @api.model
+    def sync_from_ui(self, orders):
+        result = super().sync_from_ui(orders)
+        if result and 'pos.order' in result:
+            # Dòng hàng / thanh toán được đồng bộ cùng đơn nên cần tính lại cả lát
+            self.browse([order_data['id'] for order_data in result['pos.order']])._trcf_mark_sales_fact_dirty()
+        return result
+
+    def _trcf_mark_sales_fact_dirty(self, old_slices=()):
+        """Đánh dấu các đơn (và lát cũ của chúng) cần cập nhật vào trcf.sales.daily.fact trước khi commit"""
+        self.env['trcf.sales.daily.fact']._mark_orders_dirty(self.ids, old_slices)
@@ -0,0 +1,236 @@
+from datetime import timedelta
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Trạng thái đơn POS được tính vào doanh thu
+SALES_ORDER_STATES = ('paid', 'done', 'invoiced')
+# Khoá advisory (key1) của các lát (ngày, POS config) khi tính lại
+SLICE_LOCK_NAMESPACE = 0x7F5A1E
+# Giờ cửa hàng khi công ty chưa khai báo timezone
+DEFAULT_STORE_TZ = 'Asia/Ho_Chi_Minh'
+
+
+class TrcfSalesDailyFact(models.Model):
+    """
+    Bảng tổng hợp doanh thu POS theo ngày (giờ cửa hàng), POS config, preset và
+    phương thức thanh toán. Các dashboard đọc bảng này thay vì quét pos.order.
+
+    Bảng có hai loại dòng:
+    - payment_method_id trống: chỉ số theo đơn (order_count, amount_total, qty)
+    - payment_method_id có giá trị: chỉ số theo thanh toán (payment_amount, payment_order_count)
+    Nhờ vậy đơn thanh toán bằng nhiều phương thức không bị tính trùng doanh thu.
+    """
+    _name = 'trcf.sales.daily.fact'
+    _description = 'Tổng hợp doanh thu POS theo ngày'
+    _order = 'date desc, config_id, preset_id, payment_method_id'
+    _log_access = False
+
+    date = fields.Date(string='Ngày', required=True, index=True, readonly=True)
+    config_id = fields.Many2one('pos.config', string='Điểm bán hàng', index=True, readonly=True)
+    company_id = fields.Many2one('res.company', string='Công ty', index=True, readonly=True)
+    preset_id = fields.Many2one('pos.preset', string='Preset', readonly=True)
+    payment_method_id = fields.Many2one('pos.payment.method', string='Phương thức thanh toán', readonly=True)
+
+    order_count = fields.Integer(string='Số đơn', readonly=True)
+    amount_total = fields.Float(string='Doanh thu', readonly=True)
+    qty = fields.Float(string='Số món', readonly=True)
+    payment_amount = fields.Float(string='Số tiền thanh toán', readonly=True)
+    payment_order_count = fields.Integer(string='Số đơn thanh toán', readonly=True)
+
+    # Mỗi lát chỉ có một dòng cho mỗi (preset, phương thức thanh toán)
+    _slice_uniq = models.UniqueIndex(
+        '(date, COALESCE(config_id, 0), COALESCE(preset_id, 0), COALESCE(payment_method_id, 0))'
+    )
+
+    def _get_refresh_query(self, order_filter, slice_filter):
+        """
+        Câu lệnh tính lại các dòng fact từ pos_order / pos_order_line / pos_payment.
+
+        order_filter: điều kiện trên pos_order (o) để giới hạn vùng quét theo index date_order
+        slice_filter: điều kiện trên (date, config_id) đã quy đổi sang giờ cửa hàng
+        """
+        return f"""
+            WITH scoped AS (
+                SELECT *
+                  FROM (
+                    SELECT o.id, o.preset_id, o.amount_total, o.company_id, s.config_id,
+                           (o.date_order AT TIME ZONE 'UTC' AT TIME ZONE COALESCE(NULLIF(rp.tz, ''), %s))::date AS date
+                      FROM pos_order o
+                      JOIN pos_session s ON s.id = o.session_id
+                      JOIN res_company rc ON rc.id = o.company_id
+                      JOIN res_partner rp ON rp.id = rc.partner_id
+                     WHERE o.state IN %s
+                       AND {order_filter}
+                  ) AS orders
+                 WHERE {slice_filter}
+            ),
+            line_qty AS (
+                SELECT l.order_id, SUM(l.qty) AS qty
+                  FROM pos_order_line l
+                 WHERE l.order_id IN (SELECT id FROM scoped)
+              GROUP BY l.order_id
+            )
+            INSERT INTO trcf_sales_daily_fact (
+                date, config_id, company_id, preset_id, payment_method_id,
+                order_count, amount_total, qty, payment_amount, payment_order_count
+            )
+            SELECT sc.date, sc.config_id, sc.company_id, sc.preset_id, NULL,
+                   COUNT(*), SUM(sc.amount_total), COALESCE(SUM(lq.qty), 0), 0, 0
+              FROM scoped sc
+         LEFT JOIN line_qty lq ON lq.order_id = sc.id
+          GROUP BY sc.date, sc.config_id, sc.company_id, sc.preset_id
+         UNION ALL
+            SELECT sc.date, sc.config_id, sc.company_id, sc.preset_id, p.payment_method_id,
+                   0, 0, 0, SUM(p.amount), COUNT(DISTINCT p.pos_order_id)
+              FROM scoped sc
+              JOIN pos_payment p ON p.pos_order_id = sc.id
+             WHERE p.payment_method_id IS NOT NULL
+          GROUP BY sc.date, sc.config_id, sc.company_id, sc.preset_id, p.payment_method_id
+            ON CONFLICT (date, COALESCE(config_id, 0), COALESCE(preset_id, 0), COALESCE(payment_method_id, 0))
+            DO UPDATE SET company_id = EXCLUDED.company_id,
+                          order_count = EXCLUDED.order_count,
+                          amount_total = EXCLUDED.amount_total,
+                          qty = EXCLUDED.qty,
+                          payment_amount = EXCLUDED.payment_amount,
+                          payment_order_count = EXCLUDED.payment_order_count
+        """
+
+    @api.model
+    def _get_store_tz(self, company=None):
+        """
+        Timezone dùng để chia doanh thu theo ngày: timezone của công ty, mặc định DEFAULT_STORE_TZ.
+        Báo cáo đọc bảng fact phải tính khoảng ngày theo cùng timezone này.
+        """
+        return (company or self.env.company).partner_id.tz or DEFAULT_STORE_TZ
+
+    @api.model
+    def _get_order_slices(self, order_ids):
+        """Các lát (ngày giờ cửa hàng, POS config) chứa các đơn hàng, đọc trực tiếp từ pos_order"""
+        if not order_ids:
+            return set()
+        cr = self.env.cr
+        cr.execute("""
+            SELECT DISTINCT (o.date_order AT TIME ZONE 'UTC' AT TIME ZONE COALESCE(NULLIF(rp.tz, ''), %s))::date,
+                   s.config_id
+              FROM pos_order o
+              JOIN pos_session s ON s.id = o.session_id
+              JOIN res_company rc ON rc.id = o.company_id
+              JOIN res_partner rp ON rp.id = rc.partner_id
+             WHERE o.id = ANY(%s)
+        """, [DEFAULT_STORE_TZ, list(order_ids)])
+        return set(cr.fetchall())
+
+    @api.model
+    def _refresh_orders(self, order_ids, extra_slices=()):
+        """
+        Tính lại các lát (ngày, POS config) chứa các đơn hàng đã thay đổi.
+
+        extra_slices: các lát cũ của đơn đã đổi ngày / phiên, cần tính lại để bỏ doanh thu của đơn
+        """
+        self.env.flush_all()
+        cr = self.env.cr
+
+        # 1. Xác định các lát (ngày giờ cửa hàng, config) bị ảnh hưởng
+        keys = sorted(self._get_order_slices(order_ids) | set(extra_slices))
+        if not keys:
+            return
+        dates = [key[0] for key in keys]
+        config_ids = [key[1] for key in keys]
+
+        # 2. Khoá từng lát (theo thứ tự để tránh deadlock) để hai transaction không tính lại cùng lúc
+        cr.execute("""
+            SELECT pg_advisory_xact_lock(%s, hashtext(k.date::text || '/' || k.config_id::text))
+              FROM unnest(%s::date[], %s::int[]) WITH ORDINALITY AS k(date, config_id, n)
+          ORDER BY k.n
+        """, [SLICE_LOCK_NAMESPACE, dates, config_ids])
+
+        # 3. Xóa và tính lại đúng các lát đó
+        cr.execute("""
+            DELETE FROM trcf_sales_daily_fact f
+             USING unnest(%s::date[], %s::int[]) AS k(date, config_id)
+             WHERE f.date = k.date AND f.config_id = k.config_id
+        """, [dates, config_ids])
+        cr.execute(self._get_refresh_query(
+            # Giờ cửa hàng lệch tối đa ±14h so với UTC
+            order_filter='o.date_order >= %s AND o.date_order < %s',
+            slice_filter='(date, config_id) IN (SELECT * FROM unnest(%s::date[], %s::int[]))',
+        ), [
+            DEFAULT_STORE_TZ, SALES_ORDER_STATES,
+            min(dates) - timedelta(days=1), max(dates) + timedelta(days=2),
+            dates, config_ids,
+        ])
+        self.invalidate_model()
+
+    @api.model
+    def _refresh_pending_orders(self):
+        """Callback precommit: tính lại các lát của những đơn đã đánh dấu trong transaction"""
+        order_ids = self.env.cr.precommit.data.pop('trcf.sales.daily.fact.order_ids', set())
+        slices = self.env.cr.precommit.data.pop('trcf.sales.daily.fact.slices', set())
+        self.sudo()._refresh_orders(order_ids, slices)
+
+    @api.model
+    def _mark_orders_dirty(self, order_ids, old_slices=()):
+        """
+        Ghi nhận đơn hàng cần cập nhật; gom lại và tính một lần trước khi commit.
+
+        old_slices: các lát của đơn trước khi đổi ngày / phiên, cũng được tính lại
+        """
+        if not order_ids and not old_slices:
+            return
+        data = self.env.cr.precommit.data
+        if 'trcf.sales.daily.fact.order_ids' not in data:
+            self.env.cr.precommit.add(self._refresh_pending_orders)
+        data.setdefault('trcf.sales.daily.fact.order_ids', set()).update(order_ids)
+        data.setdefault('trcf.sales.daily.fact.slices', set()).update(old_slices)
+
+    @api.model
+    def rebuild(self, date_from=None, date_to=None):
+        """
+        Tính lại toàn bộ bảng fact (hoặc một khoảng ngày) từ dữ liệu gốc.
+
+        Dùng để backfill lịch sử, ví dụ từ odoo shell:
+            env['trcf.sales.daily.fact'].rebuild()
+            env['trcf.sales.daily.fact'].rebuild(date_from='2025-01-01')
+        """
+        date_from = fields.Date.to_date(date_from)
+        date_to = fields.Date.to_date(date_to)
+        self.env.flush_all()
+        cr = self.env.cr
+
+        order_filter = ['TRUE']
+        slice_filter = ['TRUE']
+        delete_filter = ['TRUE']
+        order_params = []
+        slice_params = []
+        if date_from:
+            order_filter.append('o.date_order >= %s')
+            order_params.append(date_from - timedelta(days=1))
+            slice_filter.append('date >= %s')
+            slice_params.append(date_from)
+            delete_filter.append('date >= %s')
+        if date_to:
+            order_filter.append('o.date_order < %s')
+            order_params.append(date_to + timedelta(days=2))
+            slice_filter.append('date <= %s')
+            slice_params.append(date_to)
+            delete_filter.append('date <= %s')
+
+        # Chặn các transaction tính lại lát trong lúc dựng lại
+        cr.execute("LOCK TABLE trcf_sales_daily_fact IN SHARE ROW EXCLUSIVE MODE")
+        cr.execute(f"DELETE FROM trcf_sales_daily_fact WHERE {' AND '.join(delete_filter)}", slice_params)
+        cr.execute(self._get_refresh_query(
+            order_filter=' AND '.join(order_filter),
+            slice_filter=' AND '.join(slice_filter),
+        ), [DEFAULT_STORE_TZ, SALES_ORDER_STATES] + order_params + slice_params)
+        _logger.info("Rebuilt trcf.sales.daily.fact from %s to %s: %s rows", date_from, date_to, cr.rowcount)
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def _cron_rebuild_recent(self):
+        """Cron hằng đêm: tính lại 2 ngày gần nhất để bắt các thay đổi ngoài luồng trạng thái"""
+        today = fields.Date.context_today(self.with_context(tz=self._get_store_tz()))
+        return self.rebuild(date_from=today - timedelta(days=1), date_to=today)
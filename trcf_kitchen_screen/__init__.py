@@ -1 +1,6 @@
-from . import models
\ No newline at end of file
+from . import models
+
+
+def post_init_hook(env):
+    """Dựng bảng chiếu đơn đang mở cho màn hình bếp khi cài module"""
+    env['trcf.kitchen.active.order'].rebuild()
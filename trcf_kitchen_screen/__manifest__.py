@@ -1,6 +1,6 @@
 {
     'name': 'TRCF Display Kitchen Screen',
-    'version': '1.0',
+    'version': '1.1',
     'summary': 'Màn hình bếp cho POS - Tuấn Rang Cà Phê',
     'description': 'Quản lý màn hình bếp cho hệ thống POS, cho phép lọc danh mục món ăn và gán theo từng POS.',
     'category': 'Point of Sale',
@@ -18,6 +18,7 @@
             'trcf_kitchen_screen/static/src/css/trcf_kitchen_dashboard.css'
         ],
     },
+    'post_init_hook': 'post_init_hook',
     'installable': True,
     'application': True,
     'license': 'LGPL-3',
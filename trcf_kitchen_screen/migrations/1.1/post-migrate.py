@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Migration script: Fill the open-order projection on existing databases
+
+post_init_hook only runs on a fresh install. Databases upgraded to 1.1 get
+trcf.kitchen.active.order rebuilt here, otherwise kitchen screens lose the
+orders of the session that is currently open.
+"""
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Migration function called by Odoo during module upgrade
+    """
+    if not version:
+        return
+    _logger.info("Starting migration: rebuild trcf.kitchen.active.order")
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['trcf.kitchen.active.order'].rebuild()
+    _logger.info("Migration completed successfully")
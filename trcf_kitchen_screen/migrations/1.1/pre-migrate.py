@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Migration script: Create the kitchen queue due-time columns with SQL
+
+This migration:
+1. Adds pos_order_line.trcf_prep_minutes / trcf_due_at and fills them in one UPDATE
+2. Adds pos_order.trcf_due_at and fills it in one UPDATE
+
+Creating the columns here stops Odoo from recomputing these stored fields in Python
+for the whole POS history during the upgrade.
+"""
+import logging
+
+from odoo.addons.trcf_kitchen_screen.models.trcf_pos_order_line import DEFAULT_PREP_MINUTES
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Migration function called by Odoo during module upgrade
+    """
+    if not version:
+        return
+    _logger.info("Starting migration: fill kitchen queue due times")
+
+    # ========================================
+    # 1. pos_order_line (sản phẩm cũ chưa khai báo thời gian làm -> mặc định)
+    # ========================================
+    cr.execute("""
+        ALTER TABLE pos_order_line
+        ADD COLUMN IF NOT EXISTS trcf_prep_minutes double precision,
+        ADD COLUMN IF NOT EXISTS trcf_due_at timestamp without time zone
+    """)
+    cr.execute("""
+        UPDATE pos_order_line AS l
+        SET trcf_prep_minutes = %s,
+            trcf_due_at = o.date_order + make_interval(mins => %s)
+        FROM pos_order AS o
+        WHERE o.id = l.order_id
+        AND l.trcf_prep_minutes IS NULL
+    """, [DEFAULT_PREP_MINUTES, DEFAULT_PREP_MINUTES])
+    _logger.info("Filled %s pos_order_line rows", cr.rowcount)
+
+    # ========================================
+    # 2. pos_order: hạn sớm nhất của các món, đơn không có món thì lấy date_order
+    # ========================================
+    cr.execute("""
+        ALTER TABLE pos_order
+        ADD COLUMN IF NOT EXISTS trcf_due_at timestamp without time zone
+    """)
+    cr.execute("""
+        UPDATE pos_order AS o
+        SET trcf_due_at = COALESCE(
+            (SELECT MIN(l.trcf_due_at) FROM pos_order_line AS l WHERE l.order_id = o.id),
+            o.date_order
+        )
+        WHERE o.trcf_due_at IS NULL
+    """)
+    _logger.info("Filled %s pos_order rows", cr.rowcount)
+
+    _logger.info("Migration completed successfully")
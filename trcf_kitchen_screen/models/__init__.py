@@ -1,3 +1,9 @@
 from . import trcf_kitchen_screen
 from . import trcf_pos_order
 from . import trcf_pos_order_line
+from . import trcf_kitchen_status_log
+from . import trcf_kitchen_queue
+from . import trcf_pos_config
+from . import trcf_product_template
+from . import trcf_kitchen_active_order
+from . import trcf_pos_session
@@ -0,0 +1,113 @@
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class TrcfKitchenActiveOrder(models.Model):
+    """
+    Bảng chiếu gọn các đơn của phiên POS đang mở, dùng cho màn hình bếp.
+
+    Màn hình bếp tra đơn theo index (config_id, date_order) của bảng này thay vì
+    join pos_order với pos_session trên toàn bộ lịch sử đơn hàng.
+    Bảng được cập nhật khi tạo / đổi trạng thái đơn và được dọn khi đóng phiên.
+    """
+    _name = 'trcf.kitchen.active.order'
+    _description = 'Đơn đang mở của màn hình bếp'
+    _order = 'date_order, order_id'
+    _log_access = False
+
+    order_id = fields.Many2one('pos.order', string='Đơn hàng', required=True, readonly=True, ondelete='cascade')
+    config_id = fields.Many2one('pos.config', string='Điểm bán hàng', required=True, readonly=True)
+    session_id = fields.Many2one('pos.session', string='Phiên', required=True, readonly=True, index=True)
+    trcf_order_status = fields.Char(string='Trạng thái', readonly=True)
+    date_order = fields.Datetime(string='Ngày đặt', readonly=True)
+
+    _order_id_uniq = models.UniqueIndex('(order_id)')
+    _config_date_idx = models.Index('(config_id, date_order)')
+
+    @api.model
+    def _sync_orders(self, order_ids):
+        """Cập nhật bảng chiếu cho các đơn: thêm / sửa đơn của phiên đang mở, xoá đơn còn lại"""
+        if not order_ids:
+            return
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute("""
+            INSERT INTO trcf_kitchen_active_order (order_id, config_id, session_id, trcf_order_status, date_order)
+            SELECT o.id, s.config_id, o.session_id, o.trcf_order_status, o.date_order
+              FROM pos_order o
+              JOIN pos_session s ON s.id = o.session_id
+             WHERE o.id = ANY(%s)
+               AND s.state = 'opened'
+            ON CONFLICT (order_id) DO UPDATE
+               SET config_id = EXCLUDED.config_id,
+                   session_id = EXCLUDED.session_id,
+                   trcf_order_status = EXCLUDED.trcf_order_status,
+                   date_order = EXCLUDED.date_order
+        """, [list(order_ids)])
+        cr.execute("""
+            DELETE FROM trcf_kitchen_active_order a
+             USING pos_session s
+             WHERE a.order_id = ANY(%s)
+               AND s.id = a.session_id
+               AND s.state != 'opened'
+        """, [list(order_ids)])
+        self.invalidate_model()
+
+    @api.model
+    def _sync_pending_orders(self):
+        """Callback precommit: cập nhật các đơn đã đánh dấu trong transaction"""
+        order_ids = self.env.cr.precommit.data.pop('trcf.kitchen.active.order.order_ids', set())
+        self.sudo()._sync_orders(order_ids)
+
+    @api.model
+    def _mark_orders_dirty(self, order_ids):
+        """Ghi nhận đơn hàng cần cập nhật; gom lại và cập nhật một lần trước khi commit"""
+        if not order_ids:
+            return
+        pending = self.env.cr.precommit.data.setdefault('trcf.kitchen.active.order.order_ids', set())
+        if not pending:
+            self.env.cr.precommit.add(self._sync_pending_orders)
+        pending.update(order_ids)
+
+    @api.model
+    def _sync_sessions(self, sessions):
+        """Phiên đổi trạng thái: dọn đơn của phiên không còn mở, nạp đơn của phiên vừa mở"""
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute("""
+            DELETE FROM trcf_kitchen_active_order a
+             USING pos_session s
+             WHERE a.session_id = ANY(%s)
+               AND s.id = a.session_id
+               AND s.state != 'opened'
+        """, [sessions.ids])
+        opened = sessions.filtered(lambda session: session.state == 'opened')
+        if opened:
+            cr.execute("SELECT id FROM pos_order WHERE session_id = ANY(%s)", [opened.ids])
+            self._sync_orders([row[0] for row in cr.fetchall()])
+        self.invalidate_model()
+
+    @api.model
+    def rebuild(self):
+        """
+        Dựng lại bảng chiếu từ các phiên đang mở.
+
+        Dùng khi cài module hoặc từ odoo shell:
+            env['trcf.kitchen.active.order'].rebuild()
+        """
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute("DELETE FROM trcf_kitchen_active_order")
+        cr.execute("""
+            INSERT INTO trcf_kitchen_active_order (order_id, config_id, session_id, trcf_order_status, date_order)
+            SELECT o.id, s.config_id, o.session_id, o.trcf_order_status, o.date_order
+              FROM pos_order o
+              JOIN pos_session s ON s.id = o.session_id
+             WHERE s.state = 'opened'
+        """)
+        _logger.info("Rebuilt trcf.kitchen.active.order: %s rows", cr.rowcount)
+        self.invalidate_model()
+        return True
@@ -0,0 +1,175 @@
+from odoo import api, models
+
+# Trạng thái món còn nằm trong hàng đợi bếp
+OPEN_LINE_STATUSES = ('draft', 'waiting')
+
+
+class TrcfKitchenQueue(models.AbstractModel):
+    """
+    Bộ điều phối hàng đợi bếp: chia món cho các màn hình bếp có danh mục trùng nhau.
+
+    Chiến lược (cấu hình trên POS):
+    - all: mọi màn hình khớp danh mục đều hiện món (mặc định, như trước)
+    - round_robin: lần lượt từng màn hình
+    - least_loaded: màn hình có tổng thời gian làm món đang chờ ít nhất
+    - station: màn hình chuyên biệt nhất (ít danh mục nhất) chứa danh mục của món
+
+    Kết quả được lưu trên pos.order.line.trcf_screen_id; khi chuyển món sang màn hình khác
+    chỉ gửi phần thay đổi qua bus, màn hình không phải tải lại.
+    """
+    _name = 'trcf.kitchen.queue'
+    _description = 'Điều phối hàng đợi bếp'
+
+    @api.model
+    def _get_candidate_screens(self, lines, screens=None):
+        """
+        Các màn hình có thể nhận từng món: cùng POS và có danh mục trùng với sản phẩm.
+
+        Returns:
+            dict {line: screens}
+        """
+        if screens is None:
+            screens = self.env['trcf.kitchenscreen'].sudo().search([
+                ('is_active', '=', True),
+                ('pos_config_id', 'in', lines.order_id.config_id.ids),
+            ], order='id')
+        screens.fetch(['pos_config_id', 'pos_categ_ids'])
+        lines.product_id.product_tmpl_id.fetch(['pos_categ_ids'])
+
+        screen_categ_ids = {screen: set(screen.pos_categ_ids.ids) for screen in screens}
+        candidates = {}
+        for line in lines:
+            line_categ_ids = set(line.product_id.product_tmpl_id.pos_categ_ids.ids)
+            candidates[line] = screens.filtered(
+                lambda screen: screen.pos_config_id == line.order_id.config_id
+                and screen_categ_ids[screen] & line_categ_ids
+            )
+        return candidates
+
+    @api.model
+    def _get_screen_loads(self, screens):
+        """Tổng thời gian làm (phút) các món đang chờ của mỗi màn hình, một query gom nhóm"""
+        loads = dict.fromkeys(screens.ids, 0.0)
+        for screen, prep_minutes in self.env['pos.order.line'].sudo()._read_group(
+            [('trcf_screen_id', 'in', screens.ids), ('trcf_order_status', 'in', OPEN_LINE_STATUSES)],
+            ['trcf_screen_id'], ['trcf_prep_minutes:sum'],
+        ):
+            loads[screen.id] = prep_minutes
+        return loads
+
+    @api.model
+    def assign_lines(self, lines):
+        """
+        Chia các món cho màn hình bếp theo chiến lược của POS.
+
+        Các món của cùng một đơn có cùng nhóm màn hình được giao cho cùng một màn hình.
+        Mỗi màn hình chỉ ghi một lần cho cả lô.
+
+        Returns:
+            dict {screen: lines} các món vừa được giao
+        """
+        lines = lines.sudo()
+        candidates = self._get_candidate_screens(lines)
+        multi_screen_lines = [line for line in lines if len(candidates[line]) > 1]
+        if not multi_screen_lines:
+            return {}
+
+        all_candidates = self.env['trcf.kitchenscreen'].sudo().union(
+            *(candidates[line] for line in multi_screen_lines)
+        )
+        # Trạng thái hàng đợi trong bộ nhớ cho cả lô, ghi xuống DB một lần ở cuối
+        loads = self._get_screen_loads(all_candidates)
+        sequences = {screen.id: screen.trcf_queue_sequence for screen in all_candidates}
+        next_sequence = max(sequences.values(), default=0)
+
+        assigned = {}
+        groups = {}
+        for line in multi_screen_lines:
+            strategy = line.order_id.config_id.trcf_kitchen_queue_strategy or 'all'
+            if strategy == 'all':
+                continue
+            groups.setdefault((line.order_id, strategy, candidates[line]), []).append(line)
+
+        for (_order, strategy, screens), group_lines in groups.items():
+            if strategy == 'round_robin':
+                screen = min(screens, key=lambda s: (sequences[s.id], s.id))
+            elif strategy == 'least_loaded':
+                screen = min(screens, key=lambda s: (loads[s.id], s.id))
+            else:  # station
+                screen = min(screens, key=lambda s: (len(s.pos_categ_ids), s.id))
+
+            # Cập nhật trạng thái trong bộ nhớ để các đơn sau trong lô thấy ngay
+            next_sequence += 1
+            sequences[screen.id] = next_sequence
+            loads[screen.id] += sum(line.trcf_prep_minutes for line in group_lines)
+            assigned.setdefault(screen, []).extend(group_lines)
+
+        # Lưu kết quả: một lần ghi cho mỗi màn hình
+        result = {}
+        for screen, screen_lines in assigned.items():
+            screen_lines = self.env['pos.order.line'].sudo().union(*screen_lines)
+            screen_lines.write({'trcf_screen_id': screen.id})
+            screen.write({'trcf_queue_sequence': sequences[screen.id]})
+            result[screen] = screen_lines
+        return result
+
+    @api.model
+    def reassign_lines(self, line_ids, screen_id=False):
+        """
+        Chuyển các món sang màn hình khác (hoặc chia lại theo chiến lược nếu không chỉ định).
+
+        Màn hình cũ nhận message xoá món, màn hình mới nhận món như đơn mới.
+        """
+        lines = self.env['pos.order.line'].sudo().browse(line_ids).exists()
+        old_screen_by_line = {line.id: line.trcf_screen_id for line in lines}
+
+        if screen_id:
+            lines.write({'trcf_screen_id': screen_id})
+        else:
+            lines.write({'trcf_screen_id': False})
+            self.assign_lines(lines)
+
+        self._notify_reassigned(lines, old_screen_by_line)
+        return True
+
+    @api.model
+    def rebalance_screens(self, screens):
+        """Chia lại các món đang chờ của màn hình bị tắt / đổi danh mục"""
+        lines = self.env['pos.order.line'].sudo().search([
+            ('trcf_screen_id', 'in', screens.ids),
+            ('trcf_order_status', 'in', OPEN_LINE_STATUSES),
+        ])
+        if lines:
+            self.reassign_lines(lines.ids)
+
+    @api.model
+    def _notify_reassigned(self, lines, old_screen_by_line):
+        """Gửi phần thay đổi: xoá món ở màn hình cũ, thêm món ở màn hình mới"""
+        notifications = []
+
+        removed_by_screen = {}
+        for line in lines:
+            old_screen = old_screen_by_line[line.id]
+            if old_screen and old_screen != line.trcf_screen_id:
+                removed_by_screen.setdefault(old_screen, []).append(line.id)
+        for screen, line_ids in removed_by_screen.items():
+            notifications.append((screen._get_bus_channel(), 'notification', {
+                'message': 'pos_order_lines_removed',
+                'res_model': 'pos.order.line',
+                'line_ids': line_ids,
+                'screen_id': screen.id,
+            }))
+
+        moved_lines = lines.filtered(lambda line: line.trcf_screen_id != old_screen_by_line[line.id])
+        if moved_lines:
+            # Payload chỉ chứa món được giao cho màn hình (hoặc món hiện trên mọi màn hình),
+            # màn hình đã có món thì gộp theo id
+            screens = self.env['trcf.kitchenscreen'].sudo().search([
+                ('is_active', '=', True),
+                ('pos_config_id', 'in', moved_lines.order_id.config_id.ids),
+            ])
+            for screen, payload in moved_lines.order_id._trcf_build_kitchen_payloads(screens, moved_lines):
+                notifications.append((screen._get_bus_channel(), 'notification', payload))
+
+        if notifications:
+            self.env["bus.bus"]._sendmany(notifications)
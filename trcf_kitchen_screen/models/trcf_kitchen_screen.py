@@ -13,4 +13,21 @@ class TrcfKitchenScreen(models.Model):
     pos_categ_ids = fields.Many2many('pos.category', string='Danh mục món hiển thị', 
                                      help='Chỉ những món thuộc danh mục này sẽ hiện lên bếp')
     
-    is_active = fields.Boolean(string='Đang hoạt động', default=True)
\ No newline at end of file
+    is_active = fields.Boolean(string='Đang hoạt động', default=True)
+
+    # ✅ HÀNG ĐỢI BẾP - chiến lược dùng chung cho các màn hình cùng POS
+    queue_strategy = fields.Selection(related='pos_config_id.trcf_kitchen_queue_strategy', readonly=False)
+    trcf_queue_sequence = fields.Integer(string='Thứ tự nhận món', default=0, copy=False,
+                                         help='Lần nhận món gần nhất, dùng cho chiến lược round-robin')
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Màn hình tắt / đổi danh mục / đổi POS → chia lại các món đang chờ
+        if {'is_active', 'pos_categ_ids', 'pos_config_id'} & vals.keys():
+            self.env['trcf.kitchen.queue'].rebalance_screens(self)
+        return res
+
+    def _get_bus_channel(self):
+        """Kênh bus riêng của màn hình bếp, chỉ nhận đơn có món thuộc danh mục của màn hình"""
+        self.ensure_one()
+        return f'trcf_kitchen_screen_{self.id}'
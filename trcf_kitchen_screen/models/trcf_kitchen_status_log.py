@@ -0,0 +1,165 @@
+from odoo import api, fields, models
+
+
+class TrcfKitchenStatusLog(models.Model):
+    """
+    Nhật ký chuyển trạng thái đơn / món của màn hình bếp (chỉ ghi thêm).
+
+    Dòng được chèn bằng một câu SQL cho mỗi lần ghi trạng thái, không đi qua ORM create.
+    Dòng có line_id là chuyển trạng thái món, line_id trống là chuyển trạng thái đơn.
+    """
+    _name = 'trcf.kitchen.status.log'
+    _description = 'Nhật ký trạng thái bếp'
+    _order = 'changed_at desc, id desc'
+    _log_access = False
+
+    order_id = fields.Many2one('pos.order', string='Đơn hàng', readonly=True, index=True, ondelete='cascade')
+    line_id = fields.Many2one('pos.order.line', string='Món', readonly=True, index=True, ondelete='cascade')
+    product_id = fields.Many2one('product.product', string='Sản phẩm', readonly=True)
+    config_id = fields.Many2one('pos.config', string='Điểm bán hàng', readonly=True)
+    old_status = fields.Char(string='Trạng thái cũ', readonly=True)
+    new_status = fields.Char(string='Trạng thái mới', readonly=True)
+    changed_at = fields.Datetime(string='Thời điểm', readonly=True, index=True)
+
+    @api.model
+    def _record_line_transitions(self, old_status_by_line, new_status):
+        """Ghi chuyển trạng thái của các món: {line_id: old_status} -> new_status"""
+        changed = {line_id: old for line_id, old in old_status_by_line.items() if old != new_status}
+        if not changed:
+            return
+        self.env.cr.execute("""
+            INSERT INTO trcf_kitchen_status_log
+                   (order_id, line_id, product_id, config_id, old_status, new_status, changed_at)
+            SELECT l.order_id, l.id, l.product_id, s.config_id, k.old_status, %s, now() AT TIME ZONE 'UTC'
+              FROM unnest(%s::int[], %s::varchar[]) AS k(line_id, old_status)
+              JOIN pos_order_line l ON l.id = k.line_id
+              JOIN pos_order o ON o.id = l.order_id
+              JOIN pos_session s ON s.id = o.session_id
+        """, [new_status, list(changed), list(changed.values())])
+
+    @api.model
+    def _record_order_transitions(self, old_status_by_order, new_status):
+        """Ghi chuyển trạng thái của các đơn: {order_id: old_status} -> new_status"""
+        changed = {order_id: old for order_id, old in old_status_by_order.items() if old != new_status}
+        if not changed:
+            return
+        self.env.cr.execute("""
+            INSERT INTO trcf_kitchen_status_log
+                   (order_id, config_id, old_status, new_status, changed_at)
+            SELECT o.id, s.config_id, k.old_status, %s, now() AT TIME ZONE 'UTC'
+              FROM unnest(%s::int[], %s::varchar[]) AS k(order_id, old_status)
+              JOIN pos_order o ON o.id = k.order_id
+              JOIN pos_session s ON s.id = o.session_id
+        """, [new_status, list(changed), list(changed.values())])
+
+    def _get_prep_time_query(self):
+        """
+        CTE thời gian làm món: từ lúc món được tạo (vào hàng đợi) tới lần đầu chuyển 'ready'.
+        Món đã giao màn hình (trcf_screen_id) chỉ tính cho màn hình đó; món chưa giao được tính
+        một dòng cho mỗi màn hình bếp có danh mục trùng với sản phẩm.
+        """
+        screen_categ = self.env['trcf.kitchenscreen']._fields['pos_categ_ids']
+        product_categ = self.env['product.template']._fields['pos_categ_ids']
+        return f"""
+            WITH ready AS (
+                SELECT log.line_id, log.order_id, log.product_id, log.config_id,
+                       MIN(log.changed_at) AS ready_at
+                  FROM trcf_kitchen_status_log log
+                 WHERE log.line_id IS NOT NULL
+                   AND log.new_status = 'ready'
+                   AND log.changed_at >= %(date_from)s AND log.changed_at < %(date_to)s
+              GROUP BY log.line_id, log.order_id, log.product_id, log.config_id
+            ),
+            prep AS (
+                SELECT DISTINCT ON (r.line_id, COALESCE(l.trcf_screen_id, ks.id))
+                       r.line_id, r.order_id, r.product_id, COALESCE(l.trcf_screen_id, ks.id) AS screen_id,
+                       l.create_date AS queued_at, r.ready_at,
+                       EXTRACT(EPOCH FROM r.ready_at - l.create_date) / 60.0 AS prep_minutes,
+                       date_trunc('hour', r.ready_at AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s) AS hour
+                  FROM ready r
+                  JOIN pos_order_line l ON l.id = r.line_id
+                  -- Chỉ món chưa giao màn hình mới tra theo danh mục
+             LEFT JOIN product_product pp ON pp.id = r.product_id AND l.trcf_screen_id IS NULL
+             LEFT JOIN {product_categ.relation} pc ON pc.{product_categ.column1} = pp.product_tmpl_id
+             LEFT JOIN {screen_categ.relation} sc ON sc.{screen_categ.column2} = pc.{product_categ.column2}
+             LEFT JOIN trcf_kitchenscreen ks ON ks.id = sc.{screen_categ.column1}
+                                            AND ks.pos_config_id = r.config_id
+                 WHERE COALESCE(l.trcf_screen_id, ks.id) IS NOT NULL
+            )
+        """
+
+    @api.model
+    def get_throughput_report(self, date_from, date_to, tz=None):
+        """
+        Báo cáo năng suất bếp trong khoảng [date_from, date_to) (UTC).
+
+        Returns:
+            dict {
+                'by_screen': [{screen_id, line_count, order_count, p50_minutes, p95_minutes, orders_per_hour}],
+                'by_product': [{product_id, line_count, p50_minutes, p95_minutes}],
+                'by_hour': [{screen_id, hour, line_count, order_count, p50_minutes, p95_minutes, queue_depth}],
+            }
+            queue_depth: số món đã vào hàng đợi mà chưa xong tại một thời điểm trong giờ đó.
+        """
+        self.env.flush_all()
+        cr = self.env.cr
+        params = {
+            'date_from': fields.Datetime.to_datetime(date_from),
+            'date_to': fields.Datetime.to_datetime(date_to),
+            'tz': tz or self.env.user.tz or 'UTC',
+        }
+        prep = self._get_prep_time_query()
+
+        # 1. Theo màn hình bếp
+        cr.execute(prep + """
+            SELECT screen_id,
+                   COUNT(*) AS line_count,
+                   COUNT(DISTINCT order_id) AS order_count,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY prep_minutes)::float AS p50_minutes,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY prep_minutes)::float AS p95_minutes,
+                   (COUNT(DISTINCT order_id)::float / COUNT(DISTINCT hour)) AS orders_per_hour
+              FROM prep
+          GROUP BY screen_id
+          ORDER BY screen_id
+        """, params)
+        by_screen = cr.dictfetchall()
+
+        # 2. Theo sản phẩm (mỗi món chỉ tính một lần dù hiện trên nhiều màn hình)
+        cr.execute(prep + """
+            SELECT product_id,
+                   COUNT(*) AS line_count,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY prep_minutes)::float AS p50_minutes,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY prep_minutes)::float AS p95_minutes
+              FROM (SELECT DISTINCT ON (line_id) line_id, product_id, prep_minutes FROM prep) AS lines
+          GROUP BY product_id
+          ORDER BY p95_minutes DESC
+        """, params)
+        by_product = cr.dictfetchall()
+
+        # 3. Theo màn hình và giờ, kèm độ sâu hàng đợi
+        cr.execute(prep + """,
+            hourly AS (
+                SELECT screen_id, hour,
+                       COUNT(*) AS line_count,
+                       COUNT(DISTINCT order_id) AS order_count,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY prep_minutes)::float AS p50_minutes,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY prep_minutes)::float AS p95_minutes
+                  FROM prep
+              GROUP BY screen_id, hour
+            )
+            SELECT h.*,
+                   (SELECT COUNT(*)
+                      FROM prep p
+                     WHERE p.screen_id = h.screen_id
+                       AND p.queued_at AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s < h.hour + interval '1 hour'
+                       AND p.ready_at AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s >= h.hour) AS queue_depth
+              FROM hourly h
+          ORDER BY h.screen_id, h.hour
+        """, params)
+        by_hour = cr.dictfetchall()
+
+        return {
+            'by_screen': by_screen,
+            'by_product': by_product,
+            'by_hour': by_hour,
+        }
@@ -0,0 +1,13 @@
+from odoo import fields, models
+
+
+class PosConfig(models.Model):
+    _inherit = 'pos.config'
+
+    trcf_kitchen_queue_strategy = fields.Selection([
+        ('all', 'Hiện trên tất cả màn hình'),
+        ('round_robin', 'Lần lượt (round-robin)'),
+        ('least_loaded', 'Màn hình ít việc nhất'),
+        ('station', 'Theo trạm chuyên biệt'),
+    ], string='Chia món cho màn hình bếp', default='all', required=True,
+        help='Cách chia món khi nhiều màn hình bếp cùng POS có danh mục trùng nhau')
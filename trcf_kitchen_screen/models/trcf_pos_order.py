@@ -1,9 +1,13 @@
 from odoo import api, fields, models
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import pprint
 import logging
 
+# Khoảng lùi cursor khi đồng bộ tăng dần màn hình bếp (giây)
+KITCHEN_SYNC_OVERLAP_SECONDS = 30
+
+
 class TrcfPosOrder(models.Model):
     _inherit = "pos.order"
 
@@ -14,9 +18,17 @@ class TrcfPosOrder(models.Model):
                                                ("cancel", "Huỷ")],
                                     default='draft',
                                     help='Trạng thái của đơn hàng')
+    trcf_due_at = fields.Datetime(string='Hạn hoàn thành', compute='_compute_trcf_due_at', store=True, index=True,
+                                  help='Hạn sớm nhất của các món, dùng để sắp xếp hàng đợi bếp')
 
     _logger = logging.getLogger(__name__)
 
+    @api.depends('lines.trcf_due_at')
+    def _compute_trcf_due_at(self):
+        for order in self:
+            due_dates = [due_at for due_at in order.lines.mapped('trcf_due_at') if due_at]
+            order.trcf_due_at = min(due_dates) if due_dates else order.date_order
+
     @api.model_create_multi
     def create(self, vals_list):
 
@@ -26,54 +38,127 @@ class TrcfPosOrder(models.Model):
 
         orders = super().create(vals_list)
 
+        # ✅ CHIA MÓN CHO CÁC MÀN HÌNH BẾP THEO CHIẾN LƯỢC CỦA POS
+        self.env['trcf.kitchen.queue'].assign_lines(orders.lines)
+        self.env['trcf.kitchen.active.order']._mark_orders_dirty(orders.ids)
+
         # ✅ GỬI FULL DATA TRONG BUS MESSAGE - TRÁNH FETCH LẠI
-        for order in orders:
-            # Lấy order lines data
-            order_lines_data = []
-            for line in order.lines:
-                line_data = {
-                    'id': line.id,
-                    'product_id': [line.product_id.id, line.product_id.name],
-                    'product_id_pos_categ_ids': line.product_id.product_tmpl_id.pos_categ_ids.ids,  # ✅ Category IDs để filter
-                    'qty': line.qty,
-                    'note': line.note or '',
-                    'trcf_order_status': line.trcf_order_status,  # ✅ Đúng field name
-                    'public_description': line.product_id.product_tmpl_id.public_description or '',
-                    'order_id': [order.id, order.name]
-                }
-                order_lines_data.append(line_data)
-            
-            # Gửi bus message với full data
-            channel_name = 'pos_order_created'
-            bus_type = 'notification'
-            payload_data = {
-                'message': 'pos_order_created',
-                'res_model': 'pos.order',
-                'config_id': order.config_id.id,
-                # ✅ THÊM FULL ORDER DATA
-                'order_data': {
-                    'id': order.id,
-                    'name': order.name,
-                    'pos_reference': order.pos_reference,
-                    'date_order': order.date_order.isoformat() if order.date_order else None,
-                    'trcf_order_status': order.trcf_order_status,
-                    'amount_total': order.amount_total,
-                    'partner_id': [order.partner_id.id, order.partner_id.name] if order.partner_id else False,
-                },
-                'order_lines': order_lines_data,
-                'timestamp': datetime.now().isoformat(),  # ✅ Thêm timestamp để tracking
-            }
-            self.env["bus.bus"]._sendone(channel_name, bus_type, payload_data)
+        orders._trcf_notify_kitchen_screens()
 
         return orders
+
+    def write(self, vals):
+        if {'trcf_order_status', 'date_order', 'session_id'} & vals.keys():
+            self.env['trcf.kitchen.active.order']._mark_orders_dirty(self.ids)
+        old_status_by_order = {order.id: order.trcf_order_status for order in self} if vals.get('trcf_order_status') else None
+        old_line_ids = set(self.lines.ids) if 'lines' in vals else None
+
+        res = super().write(vals)
+
+        # Ghi nhật ký chuyển trạng thái bếp (một câu SQL cho cả lô)
+        if old_status_by_order is not None:
+            self.env['trcf.kitchen.status.log']._record_order_transitions(old_status_by_order, vals['trcf_order_status'])
+        # ✅ Món thêm vào đơn đã có cũng được chia màn hình bếp như đơn mới
+        if old_line_ids is not None:
+            new_lines = self.lines.filtered(lambda line: line.id not in old_line_ids)
+            if new_lines:
+                self.env['trcf.kitchen.queue'].assign_lines(new_lines)
+        return res
+
+    def _trcf_notify_kitchen_screens(self):
+        """Gửi đơn mới tới từng màn hình bếp, mỗi màn hình chỉ nhận các món thuộc danh mục của nó"""
+        screens = self.env['trcf.kitchenscreen'].sudo().search([
+            ('is_active', '=', True),
+            ('pos_config_id', 'in', self.config_id.ids),
+        ])
+        if not screens:
+            return
+
+        notifications = [
+            (screen._get_bus_channel(), 'notification', payload)
+            for screen, payload in self._trcf_build_kitchen_payloads(screens)
+        ]
+        if notifications:
+            self.env["bus.bus"]._sendmany(notifications)
+
+    def _trcf_build_kitchen_payloads(self, screens, lines=None):
+        """
+        Dựng bus payload cho các đơn hàng, lọc món theo từng màn hình bếp.
+
+        Dữ liệu món / sản phẩm được đọc một lần cho cả lô đơn hàng,
+        sau đó mỗi màn hình chỉ nhận các món có danh mục trùng với danh mục của màn hình
+        và chưa được giao cho màn hình khác. lines: chỉ gửi các món này (mặc định tất cả món).
+
+        Returns:
+            list [(screen, payload_data)]
+        """
+        # Đọc trước toàn bộ dữ liệu cần thiết: mỗi model một query
+        lines = self.lines if lines is None else lines
+        lines.fetch(['order_id', 'product_id', 'qty', 'note', 'trcf_order_status', 'trcf_screen_id', 'trcf_due_at'])
+        lines.product_id.fetch(['product_tmpl_id'])
+        lines.product_id.product_tmpl_id.fetch(['name', 'pos_categ_ids', 'public_description'])
+        screens.fetch(['pos_config_id', 'pos_categ_ids'])
+
+        # Dữ liệu món dựng một lần, dùng chung cho mọi màn hình
+        lines_by_order = {}
+        for line in lines:
+            template = line.product_id.product_tmpl_id
+            lines_by_order.setdefault(line.order_id.id, []).append({
+                'id': line.id,
+                'product_id': [line.product_id.id, template.name],
+                'product_id_pos_categ_ids': template.pos_categ_ids.ids,  # ✅ Category IDs để filter
+                'qty': line.qty,
+                'note': line.note or '',
+                'trcf_order_status': line.trcf_order_status,  # ✅ Đúng field name
+                'public_description': template.public_description or '',
+                'order_id': [line.order_id.id, line.order_id.name],
+                'trcf_screen_id': line.trcf_screen_id.id,
+                'trcf_due_at': fields.Datetime.to_string(line.trcf_due_at),
+            })
+
+        payloads = []
+        timestamp = datetime.now().isoformat()  # ✅ Thêm timestamp để tracking
+        for order in self:
+            order_data = {
+                'id': order.id,
+                'name': order.name,
+                'pos_reference': order.pos_reference,
+                'date_order': order.date_order.isoformat() if order.date_order else None,
+                'trcf_order_status': order.trcf_order_status,
+                'amount_total': order.amount_total,
+                'partner_id': [order.partner_id.id, order.partner_id.name] if order.partner_id else False,
+                'trcf_due_at': fields.Datetime.to_string(order.trcf_due_at),
+            }
+            order_lines_data = lines_by_order.get(order.id, [])
+
+            for screen in screens.filtered(lambda s: s.pos_config_id == order.config_id):
+                # Màn hình không có danh mục thì không hiện món nào
+                screen_category_ids = set(screen.pos_categ_ids.ids)
+                screen_lines = [
+                    line_data for line_data in order_lines_data
+                    if screen_category_ids.intersection(line_data['product_id_pos_categ_ids'])
+                    and line_data['trcf_screen_id'] in (False, screen.id)
+                ]
+                if not screen_lines:
+                    continue
+
+                payloads.append((screen, {
+                    'message': 'pos_order_created',
+                    'res_model': 'pos.order',
+                    'config_id': order.config_id.id,
+                    'screen_id': screen.id,
+                    'order_data': order_data,
+                    'order_lines': screen_lines,
+                    'timestamp': timestamp,
+                }))
+
+        return payloads
     
     @api.model
     def get_orders_by_config_id(self, config_id):
 
-        pos = self.env["pos.order"].search([
-                ("config_id", "=", config_id),
-                ("session_id.state", "=", "opened")
-        ], order="date_order asc")
+        # ✅ Tra bảng chiếu đơn đang mở (index config_id, date_order) thay vì join pos_session
+        pos = self.env['trcf.kitchen.active.order'].search([("config_id", "=", config_id)]).order_id
 
         pos_lines = pos.lines
         
@@ -86,61 +171,92 @@ class TrcfPosOrder(models.Model):
 
     @api.model 
     def get_orders_by_screen_id(self, screen_id): 
-        """Lấy danh sách đơn hàng theo màn hình kitchen"""
-        
-        # ✅ Import logging ở đầu function
-        import logging
-        _logger = logging.getLogger(__name__)
-        
+        """Lấy danh sách đơn hàng theo màn hình kitchen (tải đầy đủ, kèm cursor cho lần đồng bộ sau)"""
+        return self.get_kitchen_screen_changes(screen_id)
+
+    def _trcf_get_kitchen_order_fields(self):
+        """Các field đơn hàng màn hình bếp cần hiển thị"""
+        order_fields = ['name', 'pos_reference', 'date_order', 'trcf_order_status', 'partner_id', 'trcf_due_at', 'write_date']
+        if 'table_id' in self._fields:
+            order_fields.append('table_id')
+        return order_fields
+
+    @api.model
+    def get_kitchen_screen_changes(self, screen_id, cursor=None):
+        """
+        Đồng bộ tăng dần cho màn hình bếp.
+
+        Không có cursor: trả về toàn bộ đơn của phiên đang mở (tải lần đầu).
+        Có cursor (write_date lớn nhất đã nhận): chỉ trả về đơn / món thay đổi từ đó,
+        client gộp kết quả vào state theo id.
+
+        Returns:
+            dict {orders, order_lines, screen_info, cursor}
+        """
         screen = self.env['trcf.kitchenscreen'].browse(screen_id)
-        
+
         if not screen.exists() or not screen.pos_config_id:
-            return {'orders': [], 'order_lines': [], 'screen_info': {}}
-        
-        config_id = screen.pos_config_id.id  # ✅ Lấy ID trước
-        
-        # ✅ Dùng config_id (số nguyên) trong search
-        pos_orders = self.env["pos.order"].search([
-            ("config_id", "=", config_id),
-            ("session_id.state", "=", "opened")
-        ], order="date_order asc")
+            return {'orders': [], 'order_lines': [], 'screen_info': {}, 'cursor': cursor}
 
-        # ✅ LỌC ORDER LINES THEO CATEGORY
-        
-        if screen.pos_categ_ids:
-            # ✅ CÓ CATEGORY → LỌC THEO CATEGORY
-            screen_category_ids = screen.pos_categ_ids.ids
-            
-            filtered_lines = self.env["pos.order.line"].search([
-                ("order_id", "in", pos_orders.ids),
-                ("product_id.pos_categ_ids", "in", screen_category_ids)
-            ])
-            
-        else: 
-            # ✅ KHÔNG CÓ CATEGORY → KHÔNG HIỆN GÌ
-            # Screen phải chọn ít nhất 1 category mới hiện món
-            filtered_lines = self.env["pos.order.line"]  # Empty recordset
-        
-        # ✅ THÊM public_description (công thức) vào order_lines
-        order_lines_data = []
-        for line in filtered_lines:
-            line_data = line.read()[0]  # Lấy data mặc định
-            # Thêm public_description từ product template
-            line_data['public_description'] = line.product_id.product_tmpl_id.public_description or ''
-            order_lines_data.append(line_data)
-        
-        values = {
-            "orders": pos_orders.read(), 
-            "order_lines": order_lines_data,
-            "screen_info": {
-                "screen_id": screen_id,
-                "screen_name": screen.screen_name,
-                "categories": screen.pos_categ_ids.ids,  # ✅ Trả về IDs thay vì names
-                "config_id": config_id
-            }
+        config_id = screen.pos_config_id.id
+        screen_info = {
+            "screen_id": screen_id,
+            "screen_name": screen.screen_name,
+            "categories": screen.pos_categ_ids.ids,  # ✅ Trả về IDs thay vì names
+            "config_id": config_id
         }
 
-        return values
+        # Screen phải chọn ít nhất 1 category mới hiện món
+        if not screen.pos_categ_ids:
+            return {'orders': [], 'order_lines': [], 'screen_info': screen_info, 'cursor': cursor}
+
+        # 1. Tìm món thuộc danh mục của màn hình trong các phiên đang mở
+        #    Đơn đang mở lấy từ bảng chiếu (index config_id, date_order) thay vì join pos_session
+        active_order_ids = self.env['trcf.kitchen.active.order'].search([("config_id", "=", config_id)]).order_id.ids
+        order_domain = [("id", "in", active_order_ids)]
+        line_domain = [
+            ("order_id", "in", active_order_ids),
+            ("product_id.pos_categ_ids", "in", screen.pos_categ_ids.ids),
+            # Món chưa giao (hiện trên mọi màn hình) hoặc được giao cho màn hình này
+            ("trcf_screen_id", "in", [False, screen.id]),
+        ]
+        if cursor:
+            # Lùi cursor một khoảng để không sót bản ghi của transaction commit muộn hơn write_date của nó
+            since = fields.Datetime.to_datetime(cursor) - timedelta(seconds=KITCHEN_SYNC_OVERLAP_SECONDS)
+            changed_orders = self.search(order_domain + [("write_date", ">=", since)])
+            lines = self.env["pos.order.line"].search(line_domain + [
+                '|', ("write_date", ">=", since), ("order_id", "in", changed_orders.ids),
+            ])
+        else:
+            lines = self.env["pos.order.line"].search(line_domain)
+
+        # 2. Đơn hàng chỉ gửi khi có món hiển thị trên màn hình, sắp theo hạn hoàn thành
+        orders = lines.order_id.sorted(lambda order: (order.trcf_due_at or order.date_order, order.id))
+        orders_data = orders.read(self._trcf_get_kitchen_order_fields())
+
+        # 3. Dữ liệu món: chỉ các field màn hình bếp dùng, công thức lấy từ product template
+        #    Món làm lâu xếp trước để bắt đầu sớm
+        lines = lines.sorted(lambda line: (-line.trcf_prep_minutes, line.id))
+        lines_data = lines.read(['order_id', 'product_id', 'qty', 'note', 'trcf_order_status',
+                                 'trcf_screen_id', 'trcf_due_at', 'write_date'])
+        lines.product_id.product_tmpl_id.fetch(['public_description'])
+        description_by_line = {line.id: line.product_id.product_tmpl_id.public_description or '' for line in lines}
+        for line_data in lines_data:
+            line_data['public_description'] = description_by_line[line_data['id']]
+
+        # 4. Cursor mới = write_date lớn nhất đã gửi
+        write_dates = [data['write_date'] for data in orders_data + lines_data]
+        if write_dates:
+            cursor = fields.Datetime.to_string(max(write_dates))
+        for data in orders_data + lines_data:
+            del data['write_date']
+
+        return {
+            "orders": orders_data,
+            "order_lines": lines_data,
+            "screen_info": screen_info,
+            "cursor": cursor,
+        }
     
     # ✅ THÊM CÁC METHOD MỚI ĐỂ CẬP NHẬT TRẠNG THÁI
     @api.model
@@ -1,4 +1,12 @@
 from odoo import api, fields, models
+from datetime import datetime, timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Thời gian làm món mặc định khi sản phẩm chưa khai báo (phút)
+DEFAULT_PREP_MINUTES = 5
+
 
 class PosOrderLine(models.Model):
     _inherit = "pos.order.line"
@@ -7,72 +15,133 @@ class PosOrderLine(models.Model):
         selection=[('draft', 'Draft'), ('waiting', 'Cooking'),
                    ('ready', 'Ready'), ('cancel', 'Cancel')], default='draft',
         help='Trạng thái hoàn thành của sản phẩm')
+
+    # ✅ HÀNG ĐỢI BẾP
+    trcf_screen_id = fields.Many2one('trcf.kitchenscreen', string='Màn hình bếp', index=True, copy=False,
+                                     help='Màn hình được giao làm món; trống = hiện trên mọi màn hình khớp danh mục')
+    trcf_prep_minutes = fields.Float(string='Thời gian làm (phút)', compute='_compute_trcf_prep_minutes', store=True)
+    trcf_due_at = fields.Datetime(string='Hạn hoàn thành', compute='_compute_trcf_due_at', store=True)
+
+    @api.depends('product_id')
+    def _compute_trcf_prep_minutes(self):
+        for line in self:
+            line.trcf_prep_minutes = line.product_id.product_tmpl_id.trcf_prep_minutes or DEFAULT_PREP_MINUTES
+
+    @api.depends('order_id.date_order', 'trcf_prep_minutes')
+    def _compute_trcf_due_at(self):
+        for line in self:
+            date_order = line.order_id.date_order
+            line.trcf_due_at = date_order and date_order + timedelta(minutes=line.trcf_prep_minutes)
+
+    def write(self, vals):
+        # Ghi nhật ký chuyển trạng thái bếp (một câu SQL cho cả lô)
+        if vals.get('trcf_order_status'):
+            old_status_by_line = {line.id: line.trcf_order_status for line in self}
+            res = super().write(vals)
+            self.env['trcf.kitchen.status.log']._record_line_transitions(old_status_by_line, vals['trcf_order_status'])
+            return res
+        return super().write(vals)
     
     @api.model
     def update_order_line_status(self, order_line_id, new_status): 
         """Cập nhật trạng thái sản phẩm và gửi thông báo tới tất cả màn hình"""
-        
-        import logging
-        from datetime import datetime
-        _logger = logging.getLogger(__name__)
-            
+        return self.update_order_lines_status([(order_line_id, new_status)])
+
+    @api.model
+    def update_order_lines_status(self, updates):
+        """
+        Cập nhật trạng thái nhiều món trong một lần gọi.
+
+        Args:
+            updates: list [(line_id, new_status)]
+
+        Mỗi nhóm trạng thái chỉ ghi một lần, trạng thái hoàn thành của đơn được tính lại
+        bằng một query đếm gom nhóm, và mỗi đơn chỉ gửi một bus message gộp.
+        """
         try:
-            order_line = self.env["pos.order.line"].browse(order_line_id)
-            
-            if not order_line.exists():
+            valid_statuses = dict(self._fields['trcf_order_status'].selection)
+            line_ids_by_status = {}
+            for line_id, new_status in updates:
+                if new_status not in valid_statuses:
+                    return {'success': False, 'error': f'Trạng thái không hợp lệ: {new_status}'}
+                line_ids_by_status.setdefault(new_status, set()).add(line_id)
+
+            lines = self.browse([line_id for line_id, _new_status in updates]).exists()
+            if not lines:
                 return {'success': False, 'error': 'Order line không tồn tại'}
-            
-            # Lưu trạng thái cũ
-            old_status = order_line.trcf_order_status
 
-            # Cập nhật trạng thái mới
-            order_line.write({'trcf_order_status': new_status})
+            # 1. Lưu trạng thái cũ
+            old_status_by_line = {line.id: line.trcf_order_status for line in lines}
 
-            # ✅ KIỂM TRA VÀ CẬP NHẬT ORDER STATUS
-            self.check_order_done(order_line.order_id.id)
-            
-            # ✅ GỬI THÔNG BÁO BUS ĐỂN TẤT CẢ MÀN HÌNH
-            channel_name = 'pos_order_line_status_updated'
-            bus_type = 'notification'
-            payload_data = {
-                'message': 'pos_order_line_status_updated',
-                'res_model': 'pos.order.line',
-                'line_id': order_line_id,  # ✅ THÊM line_id
-                'old_status': old_status,   # ✅ THÊM old_status
-                'new_status': new_status,   # ✅ THÊM new_status
-                'order_id': order_line.order_id.id,  # ✅ THÊM order_id
-                'timestamp': datetime.now().isoformat(),  # ✅ THÊM timestamp
-            }
-            
-            self.env["bus.bus"]._sendone(channel_name, bus_type, payload_data)
+            # 2. Một lần ghi cho mỗi nhóm trạng thái
+            for new_status, line_ids in line_ids_by_status.items():
+                lines.filtered(lambda line: line.id in line_ids).write({'trcf_order_status': new_status})
+
+            # 3. Tính lại trạng thái hoàn thành của các đơn liên quan
+            order_status_changes = self._trcf_complete_ready_orders(lines.order_id)
+
+            # 4. Một bus message gộp cho mỗi đơn
+            timestamp = datetime.now().isoformat()
+            notifications = []
+            for order, order_lines in lines.grouped('order_id').items():
+                payload_data = {
+                    'message': 'pos_order_lines_status_updated',
+                    'res_model': 'pos.order.line',
+                    'order_id': order.id,
+                    'config_id': order.config_id.id,
+                    'lines': [{
+                        'line_id': line.id,
+                        'old_status': old_status_by_line[line.id],
+                        'new_status': line.trcf_order_status,
+                    } for line in order_lines],
+                    # ✅ Đơn tự hoàn thành khi tất cả món đã xong
+                    'order_status': order_status_changes.get(order.id, False),
+                    'timestamp': timestamp,
+                }
+                notifications.append(('pos_order_line_status_updated', 'notification', payload_data))
+            self.env["bus.bus"]._sendmany(notifications)
 
             return {'success': True}
 
         except Exception as e:
-            _logger.error(f"❌ Lỗi cập nhật trạng thái order line {order_line_id}: {str(e)}")
+            _logger.error(f"❌ Lỗi cập nhật trạng thái order line {updates}: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    @api.model
+    def _trcf_complete_ready_orders(self, orders):
+        """
+        Chuyển sang 'done' các đơn có tất cả món đã ready.
+
+        Returns:
+            dict {order_id: {'old_status', 'new_status'}} cho các đơn vừa hoàn thành
+        """
+        not_ready_order_ids = {
+            order.id for order, _count in self._read_group(
+                [('order_id', 'in', orders.ids), ('trcf_order_status', '!=', 'ready')],
+                ['order_id'], ['__count'],
+            )
+        }
+        done_orders = orders.filtered(
+            lambda order: order.id not in not_ready_order_ids and order.trcf_order_status != 'done'
+        )
+        changes = {
+            order.id: {'old_status': order.trcf_order_status, 'new_status': 'done'}
+            for order in done_orders
+        }
+        done_orders.write({'trcf_order_status': 'done'})
+        return changes
 
     @api.model
     def check_order_done(self, order_id):
         """Kiểm tra và cập nhật trạng thái đơn hàng thành done nếu tất cả order lines đều ready"""
         
-        import logging
-        from datetime import datetime
-        _logger = logging.getLogger(__name__)
-        
         try:
             order = self.env['pos.order'].browse(order_id)
             
             if order and order.lines:
-                # Đếm số line không phải 'ready'
-                not_ready_count = len(order.lines.filtered(lambda line: line.trcf_order_status != 'ready'))
+                changes = self._trcf_complete_ready_orders(order)
                 
-                if not_ready_count == 0:
-                    # ✅ TẤT CẢ MÓN ĐÃ XONG → AUTO COMPLETE ĐƠN
-                    old_status = order.trcf_order_status
-                    order.write({'trcf_order_status': 'done'})
-                    
+                if order.id in changes:
                     # ✅ GỬI BUS MESSAGE ĐỂ UPDATE UI
                     channel_name = 'pos_order_status_updated'
                     bus_type = 'notification'
@@ -80,7 +149,7 @@ class PosOrderLine(models.Model):
                         'message': 'pos_order_status_updated',
                         'res_model': 'pos.order',
                         'order_id': order_id,
-                        'old_status': old_status,
+                        'old_status': changes[order.id]['old_status'],
                         'new_status': 'done',
                         'config_id': order.config_id.id,
                         'order_name': order.display_name,
@@ -95,4 +164,4 @@ class PosOrderLine(models.Model):
             
         except Exception as e:
             _logger.error(f"❌ Lỗi kiểm tra order {order_id}: {str(e)}")
-            return False
\ No newline at end of file
+            return False
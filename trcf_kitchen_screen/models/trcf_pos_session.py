@@ -0,0 +1,12 @@
+from odoo import models
+
+
+class PosSession(models.Model):
+    _inherit = 'pos.session'
+
+    def write(self, vals):
+        res = super().write(vals)
+        # ✅ Đóng / mở phiên → dọn / nạp đơn trong bảng chiếu của màn hình bếp
+        if 'state' in vals:
+            self.env['trcf.kitchen.active.order'].sudo()._sync_sessions(self)
+        return res
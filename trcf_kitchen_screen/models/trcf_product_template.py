@@ -0,0 +1,8 @@
+from odoo import fields, models
+
+
+class ProductTemplate(models.Model):
+    _inherit = 'product.template'
+
+    trcf_prep_minutes = fields.Float(string='Thời gian làm (phút)',
+                                     help='Ước tính thời gian pha chế / chế biến, dùng để sắp xếp hàng đợi bếp')
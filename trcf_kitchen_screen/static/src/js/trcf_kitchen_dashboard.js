@@ -18,15 +18,25 @@ export class TrcfKitchenDashboard extends Component {
         this.updateTimer = null;
         this.DEBOUNCE_DELAY = 300; // 300ms
 
-        // THÊM CHANNEL
-        this.busService.addChannel("pos_order_created");
+        // ✅ GOM CÁC LẦN BẤM MÓN THÀNH MỘT RPC
+        this.pendingLineStatusRequests = new Map();  // line_id -> new_status
+        this.lineStatusTimer = null;
+        this.LINE_STATUS_BATCH_DELAY = 150; // 150ms
+
+        // THÊM CHANNEL - đơn mới được gửi riêng cho từng màn hình (đã lọc theo danh mục)
+        this.busService.addChannel(`trcf_kitchen_screen_${this.screen_id}`);
         this.busService.addChannel("pos_order_status_updated");
         this.busService.addChannel("pos_order_line_status_updated");
 
         this._onBusMessage = this.onBusMessage.bind(this);
 
+        // ✅ CURSOR ĐỒNG BỘ TĂNG DẦN - write_date lớn nhất đã nhận từ server
+        this.syncCursor = null;
+
         onWillStart(() => {
             this.busService.subscribe('notification', this._onBusMessage);
+            // Mất kết nối rồi kết nối lại → chỉ lấy phần thay đổi, không tải lại toàn bộ
+            this.busService.addEventListener('reconnect', () => this.syncOrderChanges());
         })
 
         this.orm = useService("orm");
@@ -52,7 +62,6 @@ export class TrcfKitchenDashboard extends Component {
         self.setupAudio();
 
         self.loadOrderData();
-        self.loadOrderData_test();
     }
 
     // SETUP AUDIO VỚI FILE
@@ -137,6 +146,17 @@ export class TrcfKitchenDashboard extends Component {
         }
 
 
+        // ✅ MÓN ĐƯỢC CHUYỂN SANG MÀN HÌNH KHÁC - XOÁ KHỎI MÀN HÌNH NÀY
+        if (message.message === "pos_order_lines_removed" &&
+            message.res_model === "pos.order.line") {
+
+            const removedIds = new Set(message.line_ids || []);
+            self.state.order_lines = self.state.order_lines.filter(l => !removedIds.has(l.id));
+            self.updateCounters();
+
+            return;
+        }
+
         // ✅ XỬ LÝ CẬP NHẬT TRẠNG THÁI ĐƠN - DEBOUNCED
         if (message.message === "pos_order_status_updated" &&
             message.res_model === "pos.order" &&
@@ -155,6 +175,31 @@ export class TrcfKitchenDashboard extends Component {
             return;
         }
 
+        // ✅ XỬ LÝ CẬP NHẬT TRẠNG THÁI NHIỀU MÓN - MỘT MESSAGE GỘP CHO MỖI ĐƠN
+        if (message.message === "pos_order_lines_status_updated" &&
+            message.res_model === "pos.order.line") {
+
+            (message.lines || []).forEach(line => {
+                self.pendingLineUpdates.add({
+                    line_id: line.line_id,
+                    new_status: line.new_status
+                });
+            });
+
+            // Đơn tự hoàn thành khi tất cả món đã xong
+            if (message.order_status) {
+                self.pendingOrderUpdates.add({
+                    order_id: message.order_id,
+                    new_status: message.order_status.new_status,
+                    old_status: message.order_status.old_status
+                });
+            }
+
+            self.scheduleUpdate();
+
+            return;
+        }
+
         // ✅ XỬ LÝ CẬP NHẬT TRẠNG THÁI MÓN - DEBOUNCED
         if (message.message === "pos_order_line_status_updated" &&
             message.res_model === "pos.order.line") {
@@ -170,16 +215,6 @@ export class TrcfKitchenDashboard extends Component {
         }
     }
 
-    async loadOrderData_test() {
-        var self = this;
-        try {
-            const result = await self.orm.call("pos.order", "get_orders_by_screen_id", [this.screen_id]);
-
-        } catch (error) {
-            console.error('Error loading order data:', error);
-        }
-    }
-
     async loadOrderData() {
         var self = this;
         try {
@@ -197,6 +232,7 @@ export class TrcfKitchenDashboard extends Component {
             // ✅ CẬP NHẬT STATE
             self.state.order_details = result['orders'] || [];
             self.state.order_lines = result['order_lines'] || [];
+            self.syncCursor = result['cursor'] || null;
 
             // ✅ CẬP NHẬT COUNTERS
             self.updateCounters();
@@ -206,6 +242,50 @@ export class TrcfKitchenDashboard extends Component {
         }
     }
 
+    /**
+     * ĐỒNG BỘ TĂNG DẦN - CHỈ LẤY ĐƠN / MÓN THAY ĐỔI TỪ CURSOR
+     */
+    async syncOrderChanges() {
+        var self = this;
+
+        // Chưa tải lần đầu thì tải đầy đủ
+        if (!self.syncCursor) {
+            return self.loadOrderData();
+        }
+
+        try {
+            const result = await self.orm.call(
+                "pos.order",
+                "get_kitchen_screen_changes",
+                [this.screen_id, self.syncCursor]
+            );
+
+            // ✅ GỘP THEO ID - ĐÈ BẢN GHI CŨ HOẶC THÊM MỚI
+            (result['orders'] || []).forEach(order => {
+                const index = self.state.order_details.findIndex(o => o.id === order.id);
+                if (index !== -1) {
+                    Object.assign(self.state.order_details[index], order);
+                } else {
+                    self.state.order_details.push(order);
+                }
+            });
+            (result['order_lines'] || []).forEach(line => {
+                const index = self.state.order_lines.findIndex(l => l.id === line.id);
+                if (index !== -1) {
+                    Object.assign(self.state.order_lines[index], line);
+                } else {
+                    self.state.order_lines.push(line);
+                }
+            });
+            self.syncCursor = result['cursor'] || self.syncCursor;
+
+            self.updateCounters();
+
+        } catch (error) {
+            console.error('Error syncing order changes:', error);
+        }
+    }
+
     // ✅ =============  CÁC METHOD CẬP NHẬT TRẠNG THÁI =============
     async updateOrderStatus(orderId, newStatus, actionName = 'Cập nhật') {
         var self = this;
@@ -243,18 +323,51 @@ export class TrcfKitchenDashboard extends Component {
         }
     }
 
-    async updateOrderLineStatus(orderLineId, newStatus) {
+    updateOrderLineStatus(orderLineId, newStatus) {
+        var self = this;
+
+        // ✅ GOM CÁC LẦN BẤM TRONG LINE_STATUS_BATCH_DELAY → MỘT RPC
+        self.pendingLineStatusRequests.set(orderLineId, newStatus);
+        if (!self.lineStatusTimer) {
+            self.lineStatusTimer = setTimeout(() => {
+                self.lineStatusTimer = null;
+                self.flushLineStatusRequests();
+            }, self.LINE_STATUS_BATCH_DELAY);
+        }
+    }
+
+    async flushLineStatusRequests() {
+        var self = this;
+
+        const updates = Array.from(self.pendingLineStatusRequests.entries());
+        self.pendingLineStatusRequests.clear();
+        if (!updates.length) {
+            return;
+        }
+
+        const clearLoading = () => {
+            updates.forEach(([lineId]) => {
+                const index = self.state.loadingOrderLines.indexOf(lineId);
+                if (index > -1) {
+                    self.state.loadingOrderLines.splice(index, 1);
+                }
+            });
+        };
+
         try {
             const result = await this.orm.call(
                 "pos.order.line",
-                "update_order_line_status",
-                [orderLineId, newStatus]
+                "update_order_lines_status",
+                [updates]
             );
 
             if (!result.success) {
-                console.error('Lỗi cập nhật:', result.message);
+                // ❌ Lỗi - xóa loading ngay
+                clearLoading();
+                console.error('Lỗi cập nhật:', result.error);
             }
         } catch (error) {
+            clearLoading();
             console.error('Lỗi cập nhật:', error);
         }
     }
@@ -272,8 +385,8 @@ export class TrcfKitchenDashboard extends Component {
             self.state.loadingOrderLines.push(orderLineId);
         }
 
-        // ✅ Gọi API - loading state sẽ được xóa khi nhận bus message
-        await this.updateOrderLineStatus(orderLineId, 'ready');
+        // ✅ Gọi API (gom theo lô) - loading state sẽ được xóa khi nhận bus message
+        this.updateOrderLineStatus(orderLineId, 'ready');
         // Note: Loading state được xóa trong processPendingUpdates() khi nhận bus message
     }
 
@@ -305,38 +418,38 @@ export class TrcfKitchenDashboard extends Component {
             o => o.id === orderData.id
         );
 
+        // ✅ CHƯA TỒN TẠI → THÊM MỚI; ĐÃ CÓ → CHỈ GỘP THÊM MÓN (món được chuyển từ màn hình khác)
         if (existingIndex === -1) {
-            // ✅ CHƯA TỒN TẠI → THÊM MỚI
             self.state.order_details.push(orderData);
+        }
 
-            // ✅ FILTER ORDER LINES THEO SCREEN CATEGORY
-            const filteredLines = orderLinesData.filter(line => {
-                // Nếu screen không có category, không hiện món nào
-                if (!self.state.screen_category_ids || self.state.screen_category_ids.length === 0) {
-                    return false;
-                }
+        // ✅ FILTER ORDER LINES THEO SCREEN CATEGORY
+        const filteredLines = orderLinesData.filter(line => {
+            // Nếu screen không có category, không hiện món nào
+            if (!self.state.screen_category_ids || self.state.screen_category_ids.length === 0) {
+                return false;
+            }
 
-                // Check nếu product có category nào match với screen
-                // product_id.pos_categ_ids là array of category IDs
-                const productCategories = line.product_id_pos_categ_ids || [];
-                return productCategories.some(catId =>
-                    self.state.screen_category_ids.includes(catId)
-                );
-            });
+            // Check nếu product có category nào match với screen
+            // product_id.pos_categ_ids là array of category IDs
+            const productCategories = line.product_id_pos_categ_ids || [];
+            return productCategories.some(catId =>
+                self.state.screen_category_ids.includes(catId)
+            );
+        });
 
-            // ✅ THÊM CHỈ NHỮNG LINES ĐÃ FILTER
-            filteredLines.forEach(line => {
-                const lineExists = self.state.order_lines.some(
-                    l => l.id === line.id
-                );
-                if (!lineExists) {
-                    self.state.order_lines.push(line);
-                }
-            });
+        // ✅ THÊM CHỈ NHỮNG LINES ĐÃ FILTER
+        filteredLines.forEach(line => {
+            const lineExists = self.state.order_lines.some(
+                l => l.id === line.id
+            );
+            if (!lineExists) {
+                self.state.order_lines.push(line);
+            }
+        });
 
-            // ✅ CẬP NHẬT COUNTERS
-            self.updateCounters();
-        }
+        // ✅ CẬP NHẬT COUNTERS
+        self.updateCounters();
     }
 
     /**
@@ -427,10 +540,12 @@ export class TrcfKitchenDashboard extends Component {
 
     // =============  HELPER METHODS =============
     // Lấy orders theo trạng thái - KHÔNG CẦN FILTER config_id vì server đã filter theo screen
+    // ✅ Sắp theo hạn hoàn thành (trcf_due_at), đơn cũ chưa có hạn thì theo thời gian đặt
     getOrdersByStatus(status) {
-        return this.state.order_details.filter(order =>
-            order.trcf_order_status === status
-        );
+        const dueKey = order => order.trcf_due_at || order.date_order || '';
+        return this.state.order_details
+            .filter(order => order.trcf_order_status === status)
+            .sort((a, b) => dueKey(a).localeCompare(dueKey(b)) || a.id - b.id);
     }
 
     // Lấy order lines của một đơn hàng
@@ -8,6 +8,7 @@
     'depends': ['point_of_sale', 'website'],
     'data': [
         'security/ir.model.access.csv',
+        'data/trcf_minvoice_cron.xml',
         'views/minvoice_res_config_settings_views.xml',
         'views/trcf_order_pending_vat_views.xml',
         'views/trcf_order_pos_info.xml',
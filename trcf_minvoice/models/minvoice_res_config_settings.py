@@ -48,6 +48,13 @@ class TrcfMInvoiceResConfigSettings(models.TransientModel):
         help='Tên đăng ký kinh doanh của cửa hàng'
     )
 
+    minvoice_batch_size = fields.Integer(
+        string='Số hoá đơn mỗi lần gửi',
+        config_parameter='trcf_minvoice.batch_size',
+        default=1,
+        help='Số hoá đơn gửi trong một lần gọi InvoiceApi78/Save khi phát hành hàng loạt'
+    )
+
     def _compute_minvoice_api_token_display(self):
         for record in self:
             if record.minvoice_api_token and len(record.minvoice_api_token) > 15:
@@ -1,14 +1,83 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 import requests
-import json
+from urllib3.exceptions import NewConnectionError
 
 import logging
-import pprint
 
 # KHAI BÁO LOGGER Ở ĐÂY
 _logger = logging.getLogger(__name__)
 
+# Số đơn xử lý tối đa trong một lần chạy cron phát hành
+ISSUE_BATCH_SIZE = 200
+# Số yêu cầu gửi MInvoice song song
+MAX_WORKERS = 4
+# Số lần thử tối đa trước khi đánh dấu lỗi
+MAX_ATTEMPTS = 5
+# Thời gian chờ thử lại: 30s, 60s, 120s... tối đa 30 phút
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 1800
+# Đơn đang gửi quá thời gian này (cron bị ngắt) thì chuyển sang lỗi để kiểm tra tay
+SENDING_LEASE_SECONDS = 300
+# Timeout (kết nối, đọc) khi gọi MInvoice
+MINVOICE_TIMEOUT = (5, 30)
+
+
+def _is_connect_error(error):
+    """Lỗi xảy ra trước khi yêu cầu tới được MInvoice (không kết nối được)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+def _post_minvoice_invoices(api_url, api_token, invoices):
+    """
+    Gửi một lô hoá đơn tới InvoiceApi78/Save (chạy trong thread, không dùng ORM).
+
+    Chỉ lỗi chắc chắn chưa phát hành được đánh dấu thử lại: không kết nối được, hoặc API trả
+    ok=false. Các lỗi còn lại (hết giờ đọc, phản hồi lạ...) có thể MInvoice đã lưu hoá đơn,
+    gửi lại sẽ phát hành trùng.
+
+    Returns:
+        list [(sobaomat, error, retryable)] theo thứ tự hoá đơn
+    """
+    try:
+        response = requests.post(
+            api_url,
+            json={"editmode": 1, "data": invoices},
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {api_token}'
+            },
+            timeout=MINVOICE_TIMEOUT
+        )
+        response.raise_for_status()
+        result = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return [(None, str(e), _is_connect_error(e))] * len(invoices)
+
+    if not isinstance(result, dict):
+        return [(None, f"Phản hồi MInvoice không hợp lệ: {str(result)[:200]}", False)] * len(invoices)
+
+    if not (result.get('ok') and result.get('code') == '00'):
+        error = result.get('message') or result.get('Message') or f"code {result.get('code')}"
+        return [(None, error, result.get('ok') is False)] * len(invoices)
+
+    # Một hoá đơn: data là dict; nhiều hoá đơn: data là list theo thứ tự gửi
+    data = result.get('data') or {}
+    items = data if isinstance(data, list) else [data]
+    results = []
+    for index in range(len(invoices)):
+        item = items[index] if index < len(items) and isinstance(items[index], dict) else {}
+        sobaomat = item.get('sobaomat')
+        results.append((sobaomat, None, False) if sobaomat else (None, item.get('message') or 'Không có sobaomat', False))
+    return results
+
+
 class TrcfMinvoicePosOrder(models.Model):
     _inherit = 'pos.order'
     
@@ -25,21 +94,42 @@ class TrcfMinvoicePosOrder(models.Model):
         help='Đơn hàng chưa có mã đối chiếu VAT'
     )
     
+    # ✅ HÀNG ĐỢI PHÁT HÀNH VAT
+    trcf_vat_state = fields.Selection([
+        ('queued', 'Chờ phát hành'),
+        ('sending', 'Đang gửi'),
+        ('done', 'Đã phát hành'),
+        ('failed', 'Lỗi'),
+    ], string='Trạng thái phát hành VAT', copy=False, index=True, readonly=True)
+    trcf_vat_attempt_count = fields.Integer(string='Số lần gửi VAT', copy=False, readonly=True)
+    trcf_vat_next_attempt_at = fields.Datetime(string='Gửi VAT lúc', copy=False, readonly=True)
+    trcf_vat_error = fields.Text(string='Lỗi phát hành VAT', copy=False, readonly=True)
+
     @api.depends('trcf_reference_tax_code')
     def _compute_trcf_is_vat_sent(self):
         for order in self:
             order.trcf_is_vat_sent = bool(order.trcf_reference_tax_code)
 
 
-    def action_send_vat_minvoice_api(self):
-
-        minvoice_tax_code = self.env['ir.config_parameter'].sudo().get_param('trcf_minvoice.tax_code')
-        minvoice_invoice_series = self.env['ir.config_parameter'].sudo().get_param('trcf_minvoice.invoice_series')
-        minvoice_api_token = self.env['ir.config_parameter'].sudo().get_param('trcf_minvoice.api_token')
-        minvoice_company_name = self.env['ir.config_parameter'].sudo().get_param('trcf_minvoice.company_name')
+    @api.model
+    def _get_minvoice_settings(self):
+        """Cấu hình MInvoice, None nếu chưa đủ thông tin"""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        settings = {
+            'tax_code': get_param('trcf_minvoice.tax_code'),
+            'invoice_series': get_param('trcf_minvoice.invoice_series'),
+            'api_token': get_param('trcf_minvoice.api_token'),
+            'company_name': get_param('trcf_minvoice.company_name'),
+            # Số hoá đơn trong một lần gọi API (payload data là list)
+            'batch_size': max(int(get_param('trcf_minvoice.batch_size', 1) or 1), 1),
+        }
+        if not settings['tax_code'] or not settings['invoice_series'] or not settings['api_token']:
+            return None
+        return settings
 
-        # URL API
-        if not minvoice_tax_code or not minvoice_invoice_series or not minvoice_api_token:
+    def action_send_vat_minvoice_api(self):
+        """Đưa các đơn đã chọn vào hàng đợi phát hành, cron gửi MInvoice ở nền"""
+        if not self._get_minvoice_settings():
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
@@ -50,168 +140,237 @@ class TrcfMinvoicePosOrder(models.Model):
                     'sticky': False,
                 }
             }
-        
-        API_URL = f"https://{minvoice_tax_code}.minvoice.app/api/InvoiceApi78/Save"
-                
-        for order in self:
-            # pprint.pprint(order.read())
-            # pprint.pprint(order.lines.read())
-            if order.vat_type == "company":
-                inv_buyerEmail = order.vat_email
-                inv_buyerTaxCode = order.vat_tax_id
-                inv_buyerDisplayName = order.vat_customer_name
-                inv_buyerLegalName =  order.vat_company_name
-                inv_buyerAddressLine = order.vat_address
-                #phone
-                cccdan = order.vat_citizen_id
-                #note
-                inv_buyerBankAccount = order.vat_account_number
-                inv_buyerBankName = order.vat_bank_name
-                mdvqhnsach_nmua = order.vat_estimated_unit_code
-                so_hchieu = order.vat_passport_number
-
-            elif order.vat_type == "individual": 
-                inv_buyerDisplayName = order.vat_customer_name
-                inv_buyerLegalName =  "."
-                inv_buyerTaxCode = ""
-                inv_buyerAddressLine = order.vat_address
-                inv_buyerEmail = order.vat_email
-                #phone
-                cccdan = order.vat_citizen_id
-                #note
-                inv_buyerBankAccount = order.vat_account_number
-                inv_buyerBankName = order.vat_bank_name
-                mdvqhnsach_nmua = order.vat_estimated_unit_code
-                so_hchieu = order.vat_passport_number
-                
-            else:
-                inv_buyerDisplayName = "khách không lấy hoá đơn"
-                inv_buyerLegalName = "khách không lấy hoá đơn"
-                inv_buyerTaxCode = ""
-                inv_buyerAddressLine = "."
-                inv_buyerEmail = ""
-                inv_buyerBankAccount = "."
-                inv_buyerBankName = "."
-                cccdan = ""
-                mdvqhnsach_nmua = ""
-                so_hchieu = ""
-
-            # --- Bắt đầu phần code mới để tạo dữ liệu chi tiết sản phẩm ---
-            invoice_details = []
-            stt = 1
-            for line in order.lines:
-                # Lấy thông tin từ order line
-                invoice_details.append({
-                    "tchat": 1,
-                    "stt_rec0": stt,
-                    "inv_itemCode": line.product_id.default_code or '',
-                    "inv_itemName": line.full_product_name,
-                    "inv_unitCode": line.product_uom_id.name,
-                    "inv_quantity": line.qty,
-                    "inv_unitPrice": line.price_unit,
-                    "inv_discountPercentage": line.discount,
-                    "inv_discountAmount": (line.price_unit * line.qty) * (line.discount / 100.0),
-                    "inv_TotalAmountWithoutVat": line.price_subtotal,
-                    "ma_thue": 8,
-                    "inv_vatAmount": line.price_subtotal_incl - line.price_subtotal,
-                    "inv_TotalAmount": line.price_subtotal_incl
-                })
-                stt += 1
-            
-            payload = {
-                "editmode": 1,
-                "data": [
-                    {
-                        "inv_invoiceSeries": minvoice_invoice_series,
-                        "inv_invoiceIssuedDate": order.date_order.strftime('%Y-%m-%d'),
-                        "inv_currencyCode": "VND",
-                        "inv_exchangeRate": 1,
-                        "so_benh_an": order.pos_reference,
-                        "inv_buyerDisplayName": inv_buyerDisplayName or "",
-                        "inv_buyerLegalName": inv_buyerLegalName or "",
-                        "inv_buyerTaxCode": inv_buyerTaxCode,
-                        "inv_buyerAddressLine": inv_buyerAddressLine or "", 
-                        "inv_buyerEmail": inv_buyerEmail or "",
-                        "inv_buyerBankAccount": inv_buyerBankAccount or "",
-                        "inv_buyerBankName": inv_buyerBankName or "",
-                        "inv_paymentMethodName": "TM/CK",
-                        "inv_discountAmount": 0,
-                        "inv_TotalAmountWithoutVat": order.amount_total - order.amount_tax,
-                        "inv_vatAmount": order.amount_tax,
-                        "inv_TotalAmount": order.amount_total,
-                        "key_api": order.pos_reference,
-                        "cccdan": cccdan or "",
-                        "so_hchieu": so_hchieu or "",
-                        "mdvqhnsach_nmua": mdvqhnsach_nmua ,
-                        "ma_ch": "",
-                        "ten_ch": minvoice_company_name or "",
-                        "details": [
-                            {
-                                "data" : invoice_details
-                            }
-                        ]
-                    }
-                ]
-            }
 
-            try:
-                # Headers
-                headers = {
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {minvoice_api_token}'
-                }
-                
-                response = requests.post(
-                    API_URL,
-                    json=payload,
-                    headers=headers,
-                    timeout=30
-                )
-                
-                # Kiểm tra status code
-                response.raise_for_status()
-
-                # Parse JSON response
-                result = response.json()
-
-                if result.get('ok') and result.get('code') == '00':
-                    # Lấy sobaomat từ data
-                    data = result.get('data', {})
-                    sobaomat = data.get('sobaomat')
-                    order.write({
-                        'trcf_reference_tax_code': sobaomat,
-                        'trcf_is_vat_sent': True,
-                    })
-
-                # Parse response JSON
-                try:
-                    _logger.info(f"📥 Parsed JSON Response:")
-                    _logger.info(json.dumps(result, indent=2, ensure_ascii=False))
-                except:
-                    _logger.warning("⚠️  Response không phải JSON")
-                    result = None
-                
-            except requests.exceptions.HTTPError as e:
-                _logger.error(f"❌ HTTP Error: {e}")
-                _logger.error(f"Response: {response.text if 'response' in locals() else 'N/A'}")
-                
-            except requests.exceptions.ConnectionError as e:
-                _logger.error(f"❌ Connection Error: {e}")
-                
-            except requests.exceptions.Timeout as e:
-                _logger.error(f"❌ Timeout Error: {e}")
-                
-            except Exception as e:
-                _logger.error(f"❌ Unexpected Error: {e}")
-                _logger.exception("Chi tiết lỗi:")
-                
+        orders = self.filtered(lambda order: not order.trcf_is_vat_sent and order.trcf_vat_state not in ('queued', 'sending'))
+        orders.write({
+            'trcf_vat_state': 'queued',
+            'trcf_vat_attempt_count': 0,
+            'trcf_vat_next_attempt_at': fields.Datetime.now(),
+            'trcf_vat_error': False,
+        })
+        self.env.ref('trcf_minvoice.ir_cron_trcf_minvoice_issue').sudo()._trigger()
+
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': '✅ Thành công',
-                'message': f'Đã gửi dữ liệu lên Minvoice!\nStatus: Check terminal log để xem chi tiết response.',
+                'title': '✅ Đã đưa vào hàng đợi',
+                'message': f'{len(orders)} đơn đang được phát hành ở nền. Xem tiến trình tại "Tiến trình phát hành VAT".',
                 'type': 'success',
                 'sticky': False,
             }
-        }
\ No newline at end of file
+        }
+
+    def action_retry_vat_minvoice(self):
+        """Đưa các đơn phát hành lỗi trở lại hàng đợi"""
+        return self.filtered(lambda order: order.trcf_vat_state == 'failed').action_send_vat_minvoice_api()
+
+    def _trcf_prepare_minvoice_invoice(self, minvoice_invoice_series, minvoice_company_name):
+        """Dữ liệu một hoá đơn trong payload InvoiceApi78/Save"""
+        self.ensure_one()
+        if self.vat_type == "company":
+            inv_buyerEmail = self.vat_email
+            inv_buyerTaxCode = self.vat_tax_id
+            inv_buyerDisplayName = self.vat_customer_name
+            inv_buyerLegalName =  self.vat_company_name
+            inv_buyerAddressLine = self.vat_address
+            #phone
+            cccdan = self.vat_citizen_id
+            #note
+            inv_buyerBankAccount = self.vat_account_number
+            inv_buyerBankName = self.vat_bank_name
+            mdvqhnsach_nmua = self.vat_estimated_unit_code
+            so_hchieu = self.vat_passport_number
+
+        elif self.vat_type == "individual": 
+            inv_buyerDisplayName = self.vat_customer_name
+            inv_buyerLegalName =  "."
+            inv_buyerTaxCode = ""
+            inv_buyerAddressLine = self.vat_address
+            inv_buyerEmail = self.vat_email
+            #phone
+            cccdan = self.vat_citizen_id
+            #note
+            inv_buyerBankAccount = self.vat_account_number
+            inv_buyerBankName = self.vat_bank_name
+            mdvqhnsach_nmua = self.vat_estimated_unit_code
+            so_hchieu = self.vat_passport_number
+            
+        else:
+            inv_buyerDisplayName = "khách không lấy hoá đơn"
+            inv_buyerLegalName = "khách không lấy hoá đơn"
+            inv_buyerTaxCode = ""
+            inv_buyerAddressLine = "."
+            inv_buyerEmail = ""
+            inv_buyerBankAccount = "."
+            inv_buyerBankName = "."
+            cccdan = ""
+            mdvqhnsach_nmua = ""
+            so_hchieu = ""
+
+        # --- Bắt đầu phần code mới để tạo dữ liệu chi tiết sản phẩm ---
+        invoice_details = []
+        stt = 1
+        for line in self.lines:
+            # Lấy thông tin từ order line
+            invoice_details.append({
+                "tchat": 1,
+                "stt_rec0": stt,
+                "inv_itemCode": line.product_id.default_code or '',
+                "inv_itemName": line.full_product_name,
+                "inv_unitCode": line.product_uom_id.name,
+                "inv_quantity": line.qty,
+                "inv_unitPrice": line.price_unit,
+                "inv_discountPercentage": line.discount,
+                "inv_discountAmount": (line.price_unit * line.qty) * (line.discount / 100.0),
+                "inv_TotalAmountWithoutVat": line.price_subtotal,
+                "ma_thue": 8,
+                "inv_vatAmount": line.price_subtotal_incl - line.price_subtotal,
+                "inv_TotalAmount": line.price_subtotal_incl
+            })
+            stt += 1
+        
+        return {
+            "inv_invoiceSeries": minvoice_invoice_series,
+            "inv_invoiceIssuedDate": self.date_order.strftime('%Y-%m-%d'),
+            "inv_currencyCode": "VND",
+            "inv_exchangeRate": 1,
+            "so_benh_an": self.pos_reference,
+            "inv_buyerDisplayName": inv_buyerDisplayName or "",
+            "inv_buyerLegalName": inv_buyerLegalName or "",
+            "inv_buyerTaxCode": inv_buyerTaxCode,
+            "inv_buyerAddressLine": inv_buyerAddressLine or "", 
+            "inv_buyerEmail": inv_buyerEmail or "",
+            "inv_buyerBankAccount": inv_buyerBankAccount or "",
+            "inv_buyerBankName": inv_buyerBankName or "",
+            "inv_paymentMethodName": "TM/CK",
+            "inv_discountAmount": 0,
+            "inv_TotalAmountWithoutVat": self.amount_total - self.amount_tax,
+            "inv_vatAmount": self.amount_tax,
+            "inv_TotalAmount": self.amount_total,
+            "key_api": self.pos_reference,
+            "cccdan": cccdan or "",
+            "so_hchieu": so_hchieu or "",
+            "mdvqhnsach_nmua": mdvqhnsach_nmua ,
+            "ma_ch": "",
+            "ten_ch": minvoice_company_name or "",
+            "details": [
+                {
+                    "data" : invoice_details
+                }
+            ]
+        }
+
+    def _trcf_mark_vat_done(self, sobaomat):
+        self.ensure_one()
+        self.write({
+            'trcf_reference_tax_code': sobaomat,
+            'trcf_vat_state': 'done',
+            'trcf_vat_attempt_count': self.trcf_vat_attempt_count + 1,
+            'trcf_vat_error': False,
+        })
+
+    def _trcf_mark_vat_failed(self, error, retryable=True):
+        """
+        Tăng số lần thử và hẹn giờ gửi lại theo cấp số nhân.
+        retryable=False (có thể MInvoice đã lưu hoá đơn): chuyển sang lỗi để kiểm tra tay.
+        """
+        self.ensure_one()
+        attempt_count = self.trcf_vat_attempt_count + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempt_count - 1), RETRY_MAX_SECONDS)
+        self.write({
+            'trcf_vat_state': 'queued' if retryable and attempt_count < MAX_ATTEMPTS else 'failed',
+            'trcf_vat_attempt_count': attempt_count,
+            'trcf_vat_next_attempt_at': fields.Datetime.now() + timedelta(seconds=delay),
+            'trcf_vat_error': str(error),
+        })
+
+    @api.model
+    def _cron_issue_vat_invoices(self):
+        """
+        Phát hành hoá đơn VAT đang chờ.
+
+        1. Dựng payload các đơn đến hạn ở thread chính (ORM), gom thành lô theo batch_size
+        2. Gửi theo từng đợt MAX_WORKERS lô: chỉ đơn của đợt sắp gửi được đánh dấu 'sending' kèm
+           thời hạn và commit. Cron bị ngắt thì đơn của đợt đang gửi chuyển sang lỗi sau thời hạn
+           (không gửi lại vì có thể MInvoice đã phát hành, tính là một lần thử), đơn chưa gửi vẫn chờ
+        3. Ghi kết quả và commit theo từng lô; chỉ lỗi chắc chắn chưa tới MInvoice mới được thử lại
+        """
+        settings = self._get_minvoice_settings()
+        if not settings:
+            _logger.warning("MInvoice chưa được cấu hình, bỏ qua phát hành VAT")
+            return True
+        api_url = f"https://{settings['tax_code']}.minvoice.app/api/InvoiceApi78/Save"
+        cron = self.env.ref('trcf_minvoice.ir_cron_trcf_minvoice_issue')
+        now = fields.Datetime.now()
+
+        # 1. Dựng payload
+        orders = self.search([
+            ('trcf_vat_state', 'in', ('queued', 'sending')),
+            ('trcf_vat_next_attempt_at', '<=', now),
+        ], order='trcf_vat_next_attempt_at, id', limit=ISSUE_BATCH_SIZE)
+        if not orders:
+            return True
+        invoices = {}
+        for order in orders:
+            if order.trcf_is_vat_sent:
+                order.write({'trcf_vat_state': 'done', 'trcf_vat_error': False})
+                continue
+            if order.trcf_vat_state == 'sending':
+                _logger.warning("Phát hành VAT bị ngắt cho đơn %s, cần kiểm tra trên MInvoice", order.pos_reference)
+                order._trcf_mark_vat_failed("Gửi bị ngắt giữa chừng, kiểm tra trên MInvoice trước khi gửi lại",
+                                            retryable=False)
+                continue
+            try:
+                invoices[order] = order._trcf_prepare_minvoice_invoice(
+                    settings['invoice_series'], settings['company_name'])
+            except Exception as e:
+                _logger.exception("Lỗi dựng hoá đơn VAT cho đơn %s", order.pos_reference)
+                order._trcf_mark_vat_failed(e)
+        batch_size = settings['batch_size']
+        items = list(invoices.items())
+        batches = [items[index:index + batch_size] for index in range(0, len(items), batch_size)]
+        # Lưu các đơn bị ngắt / lỗi dựng payload trước khi gửi
+        self._commit_progress()
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='trcf_minvoice') as executor:
+            for wave_start in range(0, len(batches), MAX_WORKERS):
+                wave = batches[wave_start:wave_start + MAX_WORKERS]
+
+                # 2. Đánh dấu đang gửi đúng các đơn của đợt này
+                self.browse([order.id for batch in wave for order, _invoice in batch]).write({
+                    'trcf_vat_state': 'sending',
+                    'trcf_vat_next_attempt_at': fields.Datetime.now() + timedelta(seconds=SENDING_LEASE_SECONDS),
+                })
+                self._commit_progress()
+
+                # 3. Gửi song song, ghi kết quả theo từng lô
+                futures = {
+                    executor.submit(_post_minvoice_invoices, api_url, settings['api_token'],
+                                    [invoice for _order, invoice in batch]): batch
+                    for batch in wave
+                }
+                for future in as_completed(futures):
+                    for (order, _invoice), (sobaomat, error, retryable) in zip(futures[future], future.result()):
+                        if sobaomat:
+                            order._trcf_mark_vat_done(sobaomat)
+                        else:
+                            _logger.warning("Phát hành VAT lỗi cho đơn %s: %s", order.pos_reference, error)
+                            order._trcf_mark_vat_failed(error, retryable)
+                    self._commit_progress()
+
+        # Còn đơn đến hạn thì chạy tiếp ngay, đơn chờ thử lại sẽ chạy vào lần kích hoạt sau
+        if len(orders) == ISSUE_BATCH_SIZE:
+            cron._trigger()
+        next_retry = self.search([
+            ('trcf_vat_state', 'in', ('queued', 'sending')),
+            ('trcf_vat_next_attempt_at', '>', fields.Datetime.now()),
+        ], order='trcf_vat_next_attempt_at', limit=1)
+        if next_retry:
+            cron._trigger(next_retry.trcf_vat_next_attempt_at)
+        return True
+
+    def _commit_progress(self):
+        """Commit ngay để đơn đã phát hành không bị gửi lại khi cron bị ngắt giữa chừng"""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
@@ -8,6 +8,7 @@
     'depends': ['point_of_sale', 'bus'],
     'data': [
         'security/ir.model.access.csv',
+        'data/trcf_momo_cron.xml',
         'views/trcf_momo_payment_views.xml',
     ],
     'assets': {
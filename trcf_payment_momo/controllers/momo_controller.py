@@ -1,13 +1,8 @@
 from odoo import http
 from odoo.http import request
 import json
-import uuid
-import hashlib
-import hmac
 import logging
 
-from ..models.momo_api import MoMoAPI
-
 _logger = logging.getLogger(__name__)
 
 
@@ -17,20 +12,14 @@ class MoMoController(http.Controller):
     """
     
     @http.route('/pos/momo/create_payment', type='jsonrpc', auth='user', methods=['POST'])
-    def create_momo_payment(self, order_id, amount, order_info=None, session_id=None, config_id=None, **kwargs):
+    def create_momo_payment(self, order_id, amount, order_info=None, session_id=None, config_id=None, payment_method_id=None, **kwargs):
         """
         Create a MoMo payment and return QR code URL
         Also stores pending transaction for webhook matching
         """
         try:
-            import re
-            
-            # Clean order_id for MoMo format
-            clean_order_id = re.sub(r'[^0-9a-zA-Z\-_\.:]', '', str(order_id))
-            if not clean_order_id:
-                clean_order_id = "ORDER"
-            
-            momo_order_id = f"{clean_order_id}_{uuid.uuid4().hex[:8]}"
+            PaymentMethod = request.env['pos.payment.method'].sudo()
+            momo_order_id = PaymentMethod._prepare_momo_order_id(order_id)
             
             if not order_info:
                 order_info = f"Thanh toan don hang {order_id}"
@@ -40,20 +29,7 @@ class MoMoController(http.Controller):
             ipn_url = f"{base_url}/momo/ipn"
             
             # Get MoMo config
-            PaymentMethod = request.env['pos.payment.method'].sudo()
-            payment_method = PaymentMethod.search([
-                ('use_payment_terminal', '=', 'trcf_momo')
-            ], limit=1)
-            
-            if payment_method and payment_method.momo_partner_code:
-                momo_api = MoMoAPI(
-                    partner_code=payment_method.momo_partner_code,
-                    access_key=payment_method.momo_access_key,
-                    secret_key=payment_method.momo_secret_key,
-                    test_mode=payment_method.momo_test_mode
-                )
-            else:
-                momo_api = MoMoAPI(test_mode=True)
+            momo_api = PaymentMethod._get_momo_api(config_id=config_id, payment_method_id=payment_method_id)
             
             # Create payment
             result = momo_api.create_payment(
@@ -89,6 +65,25 @@ class MoMoController(http.Controller):
                 'result_code': -1
             }
     
+    @http.route('/pos/momo/create_payments', type='jsonrpc', auth='user', methods=['POST'])
+    def create_momo_payments(self, payments, session_id=None, config_id=None, payment_method_id=None, **kwargs):
+        """
+        Create several MoMo payments at once (split bill), requests are sent in parallel
+        """
+        try:
+            return request.env['pos.payment.method'].sudo().create_momo_payments_rpc(
+                payments, session_id=session_id, config_id=config_id, payment_method_id=payment_method_id)
+        except Exception as e:
+            _logger.error(f"Error creating MoMo payments: {str(e)}")
+            return [{
+                'success': False,
+                'qr_code_url': '',
+                'pay_url': '',
+                'deeplink': '',
+                'message': str(e),
+                'result_code': -1
+            } for _payment in payments]
+    
     @http.route('/momo/ipn', type='http', auth='public', methods=['POST'], csrf=False)
     def momo_ipn(self, **kwargs):
         """
@@ -97,83 +92,45 @@ class MoMoController(http.Controller):
         """
         try:
             # Get raw data
-            data = json.loads(request.httprequest.data or '{}')
+            try:
+                data = json.loads(request.httprequest.data or '{}')
+            except ValueError:
+                _logger.warning("MoMo IPN: Malformed JSON body, rejected")
+                return request.make_response('', status=400)
             
-            _logger.info(f"MoMo IPN received: {json.dumps(data, indent=2)}")
+            if not isinstance(data, dict) or not data.get('orderId'):
+                _logger.warning("MoMo IPN: Missing orderId, notification dropped")
+                return request.make_response('', status=204)
             
-            # Extract fields
-            partner_code = data.get('partnerCode', '')
-            order_id = data.get('orderId', '')
-            request_id = data.get('requestId', '')
-            amount = data.get('amount', 0)
-            result_code = data.get('resultCode', -1)
-            message = data.get('message', '')
-            trans_id = data.get('transId', '')
-            signature = data.get('signature', '')
+            _logger.debug("MoMo IPN received: orderId=%s resultCode=%s", data.get('orderId'), data.get('resultCode'))
             
             # Verify signature (important for security!)
-            if not self._verify_ipn_signature(data):
-                _logger.warning(f"MoMo IPN: Invalid signature for order {order_id}")
-                # Still process but log warning (for testing)
+            signature_valid = self._verify_ipn_signature(data)
+            if not signature_valid:
+                # Reject without enqueuing: a forged IPN must never reach the transaction,
+                # nor take the (orderId, transId) slot of the genuine one in the inbox
+                _logger.warning(f"MoMo IPN: Invalid signature for order {data.get('orderId')}, rejected")
+                return request.make_response('', status=400)
             
-            # Update transaction
-            Transaction = request.env['trcf.momo.transaction'].sudo()
-            transaction = Transaction.update_from_ipn(
-                momo_order_id=order_id,
-                result_code=result_code,
-                message=message,
-                trans_id=trans_id
-            )
-            
-            if transaction:
-                _logger.info(f"MoMo IPN: Successfully processed order {order_id}")
+            # Append to the inbox, a cron worker applies it to the transaction
+            request.env['trcf.momo.ipn'].sudo()._enqueue(data, signature_valid)
             
             # MoMo expects 204 No Content
             return request.make_response('', status=204)
             
         except Exception as e:
-            _logger.error(f"MoMo IPN Error: {str(e)}")
-            return request.make_response('', status=204)
+            # Not stored in the inbox (DB / serialization error): answer 5xx so MoMo retries,
+            # duplicates are dropped on insert so a retry is safe
+            _logger.exception(f"MoMo IPN Error: {str(e)}")
+            return request.make_response('', status=500)
     
     def _verify_ipn_signature(self, data):
         """
-        Verify the IPN signature from MoMo
+        Verify the IPN signature from MoMo with the credentials of the merchant (partnerCode)
         """
         try:
-            # Get secret key
-            PaymentMethod = request.env['pos.payment.method'].sudo()
-            payment_method = PaymentMethod.search([
-                ('use_payment_terminal', '=', 'trcf_momo')
-            ], limit=1)
-            
-            secret_key = payment_method.momo_secret_key if payment_method else MoMoAPI.DEFAULT_SECRET_KEY
-            
-            # Build signature raw data (alphabetical order)
-            raw_signature = (
-                f"accessKey={MoMoAPI.DEFAULT_ACCESS_KEY}"
-                f"&amount={data.get('amount', '')}"
-                f"&extraData={data.get('extraData', '')}"
-                f"&message={data.get('message', '')}"
-                f"&orderId={data.get('orderId', '')}"
-                f"&orderInfo={data.get('orderInfo', '')}"
-                f"&orderType={data.get('orderType', '')}"
-                f"&partnerCode={data.get('partnerCode', '')}"
-                f"&payType={data.get('payType', '')}"
-                f"&requestId={data.get('requestId', '')}"
-                f"&responseTime={data.get('responseTime', '')}"
-                f"&resultCode={data.get('resultCode', '')}"
-                f"&transId={data.get('transId', '')}"
-            )
-            
-            # Generate signature
-            h = hmac.new(
-                secret_key.encode('utf-8'),
-                raw_signature.encode('utf-8'),
-                hashlib.sha256
-            )
-            computed_signature = h.hexdigest()
-            
-            return computed_signature == data.get('signature', '')
+            momo_api = request.env['pos.payment.method'].sudo()._get_momo_api_by_partner(data.get('partnerCode'))
+            return momo_api.verify_ipn_signature(data)
             
         except Exception as e:
             _logger.error(f"Signature verification error: {str(e)}")
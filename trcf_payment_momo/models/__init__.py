@@ -1,2 +1,4 @@
 from . import trcf_pos_payment_method
 from . import momo_transaction
+from . import momo_ipn
+from . import trcf_pos_config
@@ -1,12 +1,55 @@
 import hashlib
 import hmac
-import json
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Timeout (kết nối, đọc) khi gọi MoMo: kết nối lỗi phải báo nhanh cho thu ngân
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+# Số kết nối giữ sẵn tới MoMo cho cả process
+POOL_MAXSIZE = 16
+# Số yêu cầu tạo thanh toán gửi song song (tách hoá đơn)
+MAX_PARALLEL_REQUESTS = 4
+# Số yêu cầu tra trạng thái gửi song song (cron đối soát, pool riêng)
+MAX_QUERY_WORKERS = 4
+
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """
+    requests.Session dùng chung cho cả process (thread-safe với connection pool của urllib3).
+
+    Giữ kết nối keep-alive tới MoMo, các lần tạo QR sau không phải bắt tay TLS lại.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            _session = session
+        return _session
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS, thread_name_prefix='trcf_momo')
+        return _executor
+
 
 class MoMoAPI:
     """
@@ -15,8 +58,13 @@ class MoMoAPI:
     """
     
     # Test environment
-    TEST_ENDPOINT = "https://test-payment.momo.vn/v2/gateway/api/create"
-    PROD_ENDPOINT = "https://payment.momo.vn/v2/gateway/api/create"
+    TEST_BASE_URL = "https://test-payment.momo.vn"
+    PROD_BASE_URL = "https://payment.momo.vn"
+    CREATE_PATH = "/v2/gateway/api/create"
+    QUERY_PATH = "/v2/gateway/api/query"
+    
+    # resultCode của giao dịch chưa kết thúc (chờ khách xác nhận / đang xử lý / đã cấp quyền)
+    PENDING_RESULT_CODES = (1000, 7000, 7002, 9000)
     
     # Default test credentials (from MoMo official documentation)
     # https://developers.momo.vn/v2/#/docs/en/aio
@@ -24,23 +72,51 @@ class MoMoAPI:
     DEFAULT_ACCESS_KEY = "F8BBA842ECF85"
     DEFAULT_SECRET_KEY = "K951B6PE1waDMi640xX08PD3vg6EkVlz"
     
-    def __init__(self, partner_code=None, access_key=None, secret_key=None, test_mode=True):
+    def __init__(self, partner_code=None, access_key=None, secret_key=None, test_mode=True, base_url=None):
+        """base_url: ghi đè địa chỉ MoMo (ví dụ stub / simulator chạy local)"""
         self.partner_code = partner_code or self.DEFAULT_PARTNER_CODE
         self.access_key = access_key or self.DEFAULT_ACCESS_KEY
         self.secret_key = secret_key or self.DEFAULT_SECRET_KEY
         self.test_mode = test_mode
-        self.endpoint = self.TEST_ENDPOINT if test_mode else self.PROD_ENDPOINT
+        self.base_url = (base_url or (self.TEST_BASE_URL if test_mode else self.PROD_BASE_URL)).rstrip('/')
+        self.endpoint = self.base_url + self.CREATE_PATH
+        # HMAC đã nạp sẵn khoá, mỗi lần ký chỉ copy trạng thái thay vì băm lại khoá
+        self._signer = hmac.new(self.secret_key.encode('utf-8'), digestmod=hashlib.sha256)
+
+    def _post(self, url, payload):
+        """Gửi JSON tới MoMo qua session dùng chung"""
+        response = get_session().post(url, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        return response.json()
     
     def _generate_signature(self, raw_data):
         """
         Generate HMAC SHA256 signature
         """
-        h = hmac.new(
-            self.secret_key.encode('utf-8'),
-            raw_data.encode('utf-8'),
-            hashlib.sha256
-        )
+        h = self._signer.copy()
+        h.update(raw_data.encode('utf-8'))
         return h.hexdigest()
+
+    def verify_ipn_signature(self, data):
+        """
+        Verify the IPN signature from MoMo
+        """
+        # Build signature raw data (alphabetical order)
+        raw_signature = (
+            f"accessKey={self.access_key}"
+            f"&amount={data.get('amount', '')}"
+            f"&extraData={data.get('extraData', '')}"
+            f"&message={data.get('message', '')}"
+            f"&orderId={data.get('orderId', '')}"
+            f"&orderInfo={data.get('orderInfo', '')}"
+            f"&orderType={data.get('orderType', '')}"
+            f"&partnerCode={data.get('partnerCode', '')}"
+            f"&payType={data.get('payType', '')}"
+            f"&requestId={data.get('requestId', '')}"
+            f"&responseTime={data.get('responseTime', '')}"
+            f"&resultCode={data.get('resultCode', '')}"
+            f"&transId={data.get('transId', '')}"
+        )
+        return hmac.compare_digest(self._generate_signature(raw_signature), str(data.get('signature', '')))
     
     def create_payment(self, order_id, amount, order_info, redirect_url=None, ipn_url=None):
         """
@@ -93,9 +169,6 @@ class MoMoAPI:
         
         signature = self._generate_signature(raw_signature)
         
-        _logger.info(f"MoMo Signature raw: {raw_signature}")
-        _logger.info(f"MoMo Signature: {signature}")
-        
         # Build request payload
         payload = {
             "partnerCode": self.partner_code,
@@ -112,18 +185,11 @@ class MoMoAPI:
             "lang": "vi"
         }
         
-        _logger.info(f"MoMo API Request: {json.dumps(payload, indent=2)}")
+        _logger.debug("MoMo API Request: orderId=%s amount=%s requestId=%s", order_id, amount, request_id)
         
         try:
-            response = requests.post(
-                self.endpoint,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
-            
-            result = response.json()
-            _logger.info(f"MoMo API Response: {json.dumps(result, indent=2)}")
+            result = self._post(self.endpoint, payload)
+            _logger.debug("MoMo API Response: orderId=%s resultCode=%s", order_id, result.get('resultCode'))
             
             if result.get('resultCode') == 0:
                 return {
@@ -146,7 +212,7 @@ class MoMoAPI:
                     'request_id': request_id
                 }
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             _logger.error(f"MoMo API Error: {str(e)}")
             return {
                 'success': False,
@@ -157,3 +223,68 @@ class MoMoAPI:
                 'result_code': -1,
                 'request_id': request_id
             }
+
+    def create_payments(self, payments, ipn_url=None):
+        """
+        Tạo nhiều thanh toán song song (tách hoá đơn).
+
+        Args:
+            payments: list [{'order_id', 'amount', 'order_info'}]
+
+        Returns:
+            list kết quả create_payment theo đúng thứ tự đầu vào
+        """
+        if len(payments) <= 1:
+            return [self.create_payment(ipn_url=ipn_url, **payment) for payment in payments]
+        futures = [
+            _get_executor().submit(self.create_payment, ipn_url=ipn_url, **payment)
+            for payment in payments
+        ]
+        return [future.result() for future in futures]
+
+    def query_status(self, order_id):
+        """
+        Tra trạng thái giao dịch trên MoMo.
+
+        Returns:
+            dict {'result_code', 'message', 'trans_id', 'amount'} hoặc None khi không gọi được MoMo
+        """
+        request_id = str(uuid.uuid4())
+        raw_signature = (
+            f"accessKey={self.access_key}"
+            f"&orderId={order_id}"
+            f"&partnerCode={self.partner_code}"
+            f"&requestId={request_id}"
+        )
+        payload = {
+            "partnerCode": self.partner_code,
+            "requestId": request_id,
+            "orderId": str(order_id),
+            "signature": self._generate_signature(raw_signature),
+            "lang": "vi"
+        }
+        try:
+            result = self._post(self.base_url + self.QUERY_PATH, payload)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            _logger.warning("MoMo query error for order %s: %s", order_id, e)
+            return None
+        return {
+            'result_code': int(result.get('resultCode', -1)),
+            'message': result.get('message', ''),
+            'trans_id': str(result.get('transId') or ''),
+            'amount': result.get('amount'),
+        }
+
+    def query_statuses(self, order_ids):
+        """
+        Tra trạng thái nhiều giao dịch, tối đa MAX_QUERY_WORKERS yêu cầu cùng lúc.
+
+        Dùng thread pool riêng, đóng khi xong: cron đối soát không chiếm pool dùng chung
+        của create_payments mà thu ngân đang chờ.
+
+        Returns:
+            dict {order_id: kết quả query_status}
+        """
+        with ThreadPoolExecutor(max_workers=max(min(len(order_ids), MAX_QUERY_WORKERS), 1),
+                                thread_name_prefix='trcf_momo_query') as executor:
+            return dict(zip(order_ids, executor.map(self.query_status, order_ids)))
@@ -0,0 +1,134 @@
+from odoo import api, fields, models
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Số IPN xử lý tối đa trong một lần chạy worker
+PROCESS_BATCH_SIZE = 500
+# Số ngày giữ IPN đã xử lý
+KEEP_DAYS = 30
+
+
+class TrcfMomoIpn(models.Model):
+    """
+    Hộp thư IPN MoMo (chỉ ghi thêm).
+
+    Webhook chỉ kiểm tra và chèn IPN vào bảng bằng một câu SQL rồi trả 204 ngay,
+    cron worker xử lý sau. IPN trùng (cùng momo_order_id + trans_id) bị bỏ qua ngay lúc chèn.
+    """
+    _name = 'trcf.momo.ipn'
+    _description = 'MoMo IPN Inbox'
+    _order = 'id desc'
+    _log_access = False
+
+    momo_order_id = fields.Char('MoMo Order ID', required=True, readonly=True)
+    trans_id = fields.Char('MoMo Transaction ID', required=True, readonly=True, default='')
+    result_code = fields.Integer('Result Code', readonly=True)
+    payload = fields.Text('Payload', readonly=True)
+    signature_valid = fields.Boolean('Signature Valid', readonly=True)
+    state = fields.Selection([
+        ('new', 'New'),
+        ('done', 'Done'),
+        ('ignored', 'Ignored'),
+    ], default='new', required=True, string='Status', readonly=True)
+    received_at = fields.Datetime('Received At', readonly=True)
+    processed_at = fields.Datetime('Processed At', readonly=True)
+    error = fields.Char('Error', readonly=True)
+
+    _order_trans_uniq = models.UniqueIndex('(momo_order_id, trans_id)')
+    _new_idx = models.Index("(id) WHERE state = 'new'")
+
+    @api.model
+    def _enqueue(self, data, signature_valid):
+        """
+        Chèn IPN vào hộp thư, bỏ qua IPN trùng.
+
+        Returns:
+            True nếu IPN mới được chèn
+        """
+        self.env.cr.execute("""
+            INSERT INTO trcf_momo_ipn
+                   (momo_order_id, trans_id, result_code, payload, signature_valid, state, received_at)
+            VALUES (%s, %s, %s, %s, %s, 'new', now() AT TIME ZONE 'UTC')
+            ON CONFLICT (momo_order_id, trans_id) DO NOTHING
+        """, [
+            str(data['orderId']),
+            str(data.get('transId') or ''),
+            int(data.get('resultCode', -1)),
+            json.dumps(data),
+            signature_valid,
+        ])
+        if not self.env.cr.rowcount:
+            return False
+        self.env.ref('trcf_payment_momo.ir_cron_trcf_momo_ipn_process').sudo()._trigger()
+        return True
+
+    @api.model
+    def _cron_process_ipn(self):
+        """
+        Xử lý IPN trong hộp thư.
+
+        Khoá các dòng bằng SKIP LOCKED để nhiều worker không xử lý trùng, đọc giao dịch
+        của cả lô trong một query và gửi thông báo POS bằng một lần gửi bus.
+        """
+        cr = self.env.cr
+        cr.execute("""
+            SELECT id FROM trcf_momo_ipn
+             WHERE state = 'new'
+             ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [PROCESS_BATCH_SIZE])
+        ipns = self.browse([row[0] for row in cr.fetchall()])
+        if ipns:
+            ipns._process()
+            self._commit_progress()
+            if len(ipns) == PROCESS_BATCH_SIZE:
+                self.env.ref('trcf_payment_momo.ir_cron_trcf_momo_ipn_process')._trigger()
+
+        # Dọn IPN đã xử lý cũ
+        cr.execute("""
+            DELETE FROM trcf_momo_ipn
+             WHERE state != 'new'
+               AND received_at < (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+        """, [KEEP_DAYS])
+        return True
+
+    def _process(self):
+        """Áp dụng các IPN lên giao dịch, theo thứ tự nhận; IPN sai chữ ký bị bỏ qua"""
+        Transaction = self.env['trcf.momo.transaction'].sudo()
+        transactions = Transaction.search([('momo_order_id', 'in', self.mapped('momo_order_id'))])
+        transaction_by_order_id = {transaction.momo_order_id: transaction for transaction in transactions}
+
+        notifications = []
+        now = fields.Datetime.now()
+        for ipn in self.sorted('id'):
+            if not ipn.signature_valid:
+                _logger.warning("MoMo IPN: Invalid signature for order %s, not applied", ipn.momo_order_id)
+                ipn.write({'state': 'ignored', 'processed_at': now, 'error': 'Invalid signature'})
+                continue
+
+            transaction = transaction_by_order_id.get(ipn.momo_order_id)
+            if not transaction:
+                _logger.warning("MoMo IPN: Transaction not found for order %s", ipn.momo_order_id)
+                ipn.write({'state': 'ignored', 'processed_at': now, 'error': 'Transaction not found'})
+                continue
+
+            data = json.loads(ipn.payload)
+            if transaction._apply_ipn(ipn.result_code, data.get('message', ''), ipn.trans_id):
+                if transaction.status == 'success':
+                    notification = transaction._prepare_payment_success_notification()
+                    if notification:
+                        notifications.append(notification)
+                ipn.write({'state': 'done', 'processed_at': now})
+            else:
+                ipn.write({'state': 'ignored', 'processed_at': now, 'error': 'Transaction already settled'})
+
+        if notifications:
+            self.env['bus.bus']._sendmany(notifications)
+
+    def _commit_progress(self):
+        """Commit ngay để IPN đã xử lý không bị xử lý lại khi cron bị ngắt giữa chừng"""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
@@ -1,8 +1,20 @@
 from odoo import api, models, fields
+from datetime import timedelta
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Giao dịch chờ quá thời gian này thì hết hạn (QR không còn thanh toán được)
+EXPIRE_AFTER_MINUTES = 120
+# Giao dịch chờ lâu hơn thời gian này mà chưa có IPN thì hỏi trạng thái trên MoMo
+QUERY_AFTER_MINUTES = 2
+# Số giao dịch tra trạng thái tối đa trong một lần chạy
+QUERY_BATCH_SIZE = 200
+# Đối soát các phiên có giao dịch MoMo trong khoảng thời gian này
+RECONCILE_WINDOW_HOURS = 24
+# Số ngày giữ giao dịch thất bại / hết hạn
+KEEP_DAYS = 90
+
 
 class TrcfMomoTransaction(models.Model):
     """
@@ -37,6 +49,10 @@ class TrcfMomoTransaction(models.Model):
     
     # Timestamps
     payment_time = fields.Datetime('Payment Time')
+    last_query_at = fields.Datetime('Last Status Query', readonly=True,
+                                    help='Lần gần nhất MoMo trả lời tra trạng thái')
+
+    _pending_idx = models.Index("(create_date) WHERE status = 'pending'")
 
     @api.model
     def create_pending_transaction(self, pos_order_ref, momo_order_id, amount, 
@@ -60,10 +76,31 @@ class TrcfMomoTransaction(models.Model):
             _logger.warning(f"MoMo IPN: Transaction not found for order {momo_order_id}")
             return False
         
+        # Send notification via bus if successful
+        if transaction._apply_ipn(result_code, message, trans_id) and transaction.status == 'success':
+            self._notify_pos_payment_success(transaction)
+        
+        return transaction
+
+    def _apply_ipn(self, result_code, message, trans_id=None):
+        """
+        Cập nhật giao dịch theo kết quả IPN, idempotent.
+
+        Giao dịch đã thành công không bị ghi đè (IPN lặp hoặc IPN lỗi đến muộn),
+        IPN lỗi lặp lại cùng trans_id cũng được bỏ qua.
+
+        Returns:
+            True nếu giao dịch được cập nhật
+        """
+        self.ensure_one()
         # Update status based on result code
         status = 'success' if result_code == 0 else 'failed'
+        if self.status == 'success' or (
+            self.status == status and (self.trans_id or '') == (trans_id or '')
+        ):
+            return False
         
-        transaction.write({
+        self.write({
             'status': status,
             'result_code': result_code,
             'message': message,
@@ -71,35 +108,175 @@ class TrcfMomoTransaction(models.Model):
             'payment_time': fields.Datetime.now(),
         })
         
-        _logger.info(f"MoMo IPN: Updated transaction {momo_order_id} to {status}")
-        
-        # Send notification via bus if successful
-        if status == 'success':
-            self._notify_pos_payment_success(transaction)
-        
-        return transaction
+        _logger.info(f"MoMo IPN: Updated transaction {self.momo_order_id} to {status}")
+        return True
 
-    def _notify_pos_payment_success(self, transaction):
-        """Send bus notification to POS about successful payment"""
-        if not transaction.pos_config_id:
+    def _prepare_payment_success_notification(self):
+        """Bus notification (channel, type, payload) báo POS thanh toán thành công"""
+        self.ensure_one()
+        if not self.pos_config_id:
             _logger.warning("MoMo: No pos_config_id to send notification")
-            return
+            return None
             
-        config = transaction.pos_config_id
+        config = self.pos_config_id
         
         # Odoo 19 POS uses access_token based channels
         # Format: access_token-NOTIFICATION_NAME
-        if config.access_token:
-            channel = config.access_token
-            notification_name = f"{config.access_token}-MOMO_PAYMENT_SUCCESS"
-            
-            self.env['bus.bus']._sendone(channel, notification_name, {
-                'pos_order_ref': transaction.pos_order_ref,
-                'momo_order_id': transaction.momo_order_id,
-                'amount': transaction.amount,
-                'trans_id': str(transaction.trans_id),
-            })
-            
-            _logger.info(f"MoMo: Sent bus notification to channel {channel} for order {transaction.pos_order_ref}")
-        else:
+        if not config.access_token:
             _logger.warning(f"MoMo: Config {config.id} has no access_token")
+            return None
+        
+        return (config.access_token, f"{config.access_token}-MOMO_PAYMENT_SUCCESS", {
+            'pos_order_ref': self.pos_order_ref,
+            'momo_order_id': self.momo_order_id,
+            'amount': self.amount,
+            'trans_id': str(self.trans_id),
+        })
+
+    def _notify_pos_payment_success(self, transaction):
+        """Send bus notification to POS about successful payment"""
+        notification = transaction._prepare_payment_success_notification()
+        if notification:
+            self.env['bus.bus']._sendmany([notification])
+            _logger.info(f"MoMo: Sent bus notification to channel {notification[0]} for order {transaction.pos_order_ref}")
+
+    @api.model
+    def _expire_stale_pending(self):
+        """
+        Chuyển các giao dịch chờ quá hạn sang expired bằng một câu UPDATE.
+
+        Chỉ hết hạn giao dịch mà MoMo vẫn trả lời đang chờ ở lần tra sau thời điểm hết hạn:
+        giao dịch chưa được tra lần cuối (tồn đọng, cron ngừng chạy) có thể đã thanh toán mà mất IPN.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE trcf_momo_transaction
+               SET status = 'expired',
+                   write_uid = %s,
+                   write_date = now() AT TIME ZONE 'UTC'
+             WHERE status = 'pending'
+               AND create_date < (now() AT TIME ZONE 'UTC') - make_interval(mins => %s)
+               AND last_query_at >= create_date + make_interval(mins => %s)
+        """, [self.env.uid, EXPIRE_AFTER_MINUTES, EXPIRE_AFTER_MINUTES])
+        expired_count = self.env.cr.rowcount
+        self.invalidate_model(['status'])
+        return expired_count
+
+    def _query_momo_status(self):
+        """
+        Hỏi trạng thái các giao dịch trên MoMo (song song theo từng merchant) và cập nhật kết quả.
+
+        Returns:
+            list bus notification của các giao dịch vừa thành công
+        """
+        notifications = []
+        now = fields.Datetime.now()
+        PaymentMethod = self.env['pos.payment.method'].sudo()
+        for config, transactions in self.grouped('pos_config_id').items():
+            momo_api = PaymentMethod._get_momo_api(config_id=config.id)
+            results = momo_api.query_statuses(transactions.mapped('momo_order_id'))
+            transactions.filtered(lambda transaction: results.get(transaction.momo_order_id)).write({
+                'last_query_at': now,
+            })
+            for transaction in transactions:
+                result = results.get(transaction.momo_order_id)
+                if not result or result['result_code'] in momo_api.PENDING_RESULT_CODES:
+                    continue
+                if transaction._apply_ipn(result['result_code'], result['message'], result['trans_id']) \
+                        and transaction.status == 'success':
+                    notification = transaction._prepare_payment_success_notification()
+                    if notification:
+                        notifications.append(notification)
+        return notifications
+
+    @api.model
+    def get_session_reconciliation(self, session_ids):
+        """
+        Đối soát MoMo theo phiên: tổng giao dịch MoMo thành công so với tổng pos.payment
+        của phương thức thanh toán MoMo.
+
+        Returns:
+            list [{session_id, session_name, momo_amount, pos_amount, difference, pending_count}]
+        """
+        sessions = self.env['pos.session'].sudo().browse(session_ids)
+        momo_amounts = dict(self.sudo()._read_group(
+            [('pos_session_id', 'in', sessions.ids), ('status', '=', 'success')],
+            ['pos_session_id'], ['amount:sum'],
+        ))
+        pending_counts = dict(self.sudo()._read_group(
+            [('pos_session_id', 'in', sessions.ids), ('status', '=', 'pending')],
+            ['pos_session_id'], ['__count'],
+        ))
+        pos_amounts = dict(self.env['pos.payment'].sudo()._read_group(
+            [('session_id', 'in', sessions.ids), ('payment_method_id.use_payment_terminal', '=', 'trcf_momo')],
+            ['session_id'], ['amount:sum'],
+        ))
+        result = []
+        for session in sessions:
+            momo_amount = momo_amounts.get(session, 0.0)
+            pos_amount = pos_amounts.get(session, 0.0)
+            result.append({
+                'session_id': session.id,
+                'session_name': session.name,
+                'momo_amount': momo_amount,
+                'pos_amount': pos_amount,
+                'difference': session.currency_id.round(momo_amount - pos_amount),
+                'pending_count': pending_counts.get(session, 0),
+            })
+        return result
+
+    @api.model
+    def _cron_reconcile(self):
+        """
+        Đối soát giao dịch MoMo định kỳ.
+
+        1. Hỏi trạng thái các giao dịch chờ trên MoMo, theo lô giới hạn (cũ nhất trước)
+        2. Hết hạn các giao dịch chờ quá lâu đã được MoMo xác nhận vẫn chờ (một câu UPDATE)
+        3. Đối soát với pos.payment theo phiên, ghi cảnh báo khi lệch
+        4. Dọn giao dịch thất bại / hết hạn cũ
+        """
+        now = fields.Datetime.now()
+
+        # 1. Tra trạng thái trên MoMo
+        transactions = self.search([
+            ('status', '=', 'pending'),
+            ('create_date', '<', now - timedelta(minutes=QUERY_AFTER_MINUTES)),
+        ], order='create_date', limit=QUERY_BATCH_SIZE)
+        notifications = transactions._query_momo_status()
+        if notifications:
+            self.env['bus.bus']._sendmany(notifications)
+
+        # 2. Hết hạn
+        expired_count = self._expire_stale_pending()
+        if expired_count:
+            _logger.info("MoMo: Expired %s pending transactions", expired_count)
+        self._commit_progress()
+
+        # 3. Đối soát theo phiên
+        sessions = self.search([
+            ('create_date', '>=', now - timedelta(hours=RECONCILE_WINDOW_HOURS)),
+            ('pos_session_id', '!=', False),
+        ]).pos_session_id
+        for line in self.get_session_reconciliation(sessions.ids):
+            if line['difference']:
+                _logger.warning(
+                    "MoMo: Session %s mismatch, MoMo %s vs POS %s (difference %s, pending %s)",
+                    line['session_name'], line['momo_amount'], line['pos_amount'],
+                    line['difference'], line['pending_count'],
+                )
+
+        # 4. Dọn giao dịch cũ
+        self.env.cr.execute("""
+            DELETE FROM trcf_momo_transaction
+             WHERE status IN ('failed', 'expired')
+               AND create_date < (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+        """, [KEEP_DAYS])
+
+        if len(transactions) == QUERY_BATCH_SIZE:
+            self.env.ref('trcf_payment_momo.ir_cron_trcf_momo_reconcile')._trigger()
+        return True
+
+    def _commit_progress(self):
+        """Commit ngay kết quả tra cứu để không hỏi lại MoMo khi cron bị ngắt giữa chừng"""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
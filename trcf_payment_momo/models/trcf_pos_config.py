@@ -0,0 +1,12 @@
+from odoo import models
+
+
+class TrcfMomoPosConfig(models.Model):
+    _inherit = 'pos.config'
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Client MoMo được cache theo POS, đổi phương thức thanh toán thì xoá cache
+        if 'payment_method_ids' in vals:
+            self.env.registry.clear_cache()
+        return res
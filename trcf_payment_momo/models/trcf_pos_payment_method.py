@@ -1,10 +1,20 @@
 from odoo import api, models, fields
 import logging
+import re
+import uuid
+
+from odoo.tools import ormcache
 
 from .momo_api import MoMoAPI
 
 _logger = logging.getLogger(__name__)
 
+# Trường cấu hình MoMo: đổi thì xoá cache client MoMo
+MOMO_CACHE_FIELDS = {
+    'use_payment_terminal', 'momo_partner_code', 'momo_access_key', 'momo_secret_key',
+    'momo_test_mode', 'config_ids', 'active',
+}
+
 
 class TrcfPosPaymentMethod(models.Model):
     _inherit = 'pos.payment.method'
@@ -46,8 +56,129 @@ class TrcfPosPaymentMethod(models.Model):
         """Add TRCF MoMo terminal to the list of available terminals"""
         return super()._get_payment_terminal_selection() + [('trcf_momo', 'TRCF MOMO QR')]
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        payment_methods = super().create(vals_list)
+        if any(vals.get('use_payment_terminal') == 'trcf_momo' for vals in vals_list):
+            self.env.registry.clear_cache()
+        return payment_methods
+
+    def write(self, vals):
+        res = super().write(vals)
+        if MOMO_CACHE_FIELDS & vals.keys():
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        momo = any(method.use_payment_terminal == 'trcf_momo' for method in self)
+        res = super().unlink()
+        if momo:
+            self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    def _get_momo_api(self, config_id=None, payment_method_id=None):
+        """
+        Client MoMo (đã dựng sẵn bộ ký) của cửa hàng, lấy từ cache.
+
+        Thứ tự chọn merchant: phương thức thanh toán được chỉ định > phương thức MoMo của POS
+        > phương thức MoMo đầu tiên > tài khoản test mặc định.
+        Tham số hệ thống trcf_payment_momo.base_url (nếu có) ghi đè địa chỉ MoMo,
+        dùng để trỏ sang stub / simulator khi kiểm thử.
+        """
+        base_url = self.env['ir.config_parameter'].sudo().get_param('trcf_payment_momo.base_url')
+        return self._get_momo_api_cached(int(config_id or 0), int(payment_method_id or 0), base_url or '')
+
+    @api.model
+    @ormcache('config_id', 'payment_method_id', 'base_url')
+    def _get_momo_api_cached(self, config_id, payment_method_id, base_url):
+        PaymentMethod = self.sudo()
+        domain = [('use_payment_terminal', '=', 'trcf_momo'), ('momo_partner_code', '!=', False)]
+        payment_method = PaymentMethod.browse()
+        if payment_method_id:
+            payment_method = PaymentMethod.search(domain + [('id', '=', payment_method_id)], limit=1)
+        if not payment_method and config_id:
+            payment_method = PaymentMethod.search(domain + [('config_ids', 'in', config_id)], limit=1)
+        if not payment_method:
+            payment_method = PaymentMethod.search([('use_payment_terminal', '=', 'trcf_momo')], limit=1)
+        return payment_method._build_momo_api(base_url)
+
+    @api.model
+    @ormcache('partner_code')
+    def _get_momo_api_by_partner(self, partner_code):
+        """Client MoMo của merchant gửi IPN (partnerCode), dùng để xác thực chữ ký"""
+        payment_method = self.sudo().search([
+            ('use_payment_terminal', '=', 'trcf_momo'),
+            ('momo_partner_code', '=', partner_code or ''),
+        ], limit=1)
+        if not payment_method:
+            payment_method = self.sudo().search([('use_payment_terminal', '=', 'trcf_momo')], limit=1)
+        return payment_method._build_momo_api()
+
+    def _build_momo_api(self, base_url=None):
+        """Dựng client MoMo từ cấu hình của phương thức thanh toán (trống: tài khoản test)"""
+        if self and self.momo_partner_code:
+            return MoMoAPI(
+                partner_code=self.momo_partner_code,
+                access_key=self.momo_access_key,
+                secret_key=self.momo_secret_key,
+                test_mode=self.momo_test_mode,
+                base_url=base_url,
+            )
+        # Use default test credentials
+        return MoMoAPI(test_mode=True, base_url=base_url)
+
+    @api.model
+    def _prepare_momo_order_id(self, order_id):
+        """Mã đơn gửi MoMo: chỉ giữ ký tự hợp lệ và thêm hậu tố ngẫu nhiên"""
+        # MoMo requires: ^[0-9a-zA-Z]+([-_.:]+[0-9a-zA-Z]+)*$
+        clean_order_id = re.sub(r'[^0-9a-zA-Z\-_\.:]', '', str(order_id))
+        if not clean_order_id:
+            clean_order_id = "ORDER"
+        return f"{clean_order_id}_{uuid.uuid4().hex[:8]}"
+
     @api.model
-    def create_momo_payment_rpc(self, order_id, amount, order_info=None, session_id=None, config_id=None):
+    def create_momo_payments_rpc(self, payments, session_id=None, config_id=None, payment_method_id=None):
+        """
+        Tạo nhiều mã QR MoMo cho một đơn tách hoá đơn, các yêu cầu tới MoMo được gửi song song.
+
+        Args:
+            payments: list [{'order_id', 'amount', 'order_info'}]
+
+        Returns:
+            list kết quả theo thứ tự đầu vào (như create_momo_payment_rpc)
+        """
+        base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
+        ipn_url = f"{base_url}/momo/ipn"
+        momo_api = self._get_momo_api(config_id=config_id, payment_method_id=payment_method_id)
+
+        requests_list = []
+        for payment in payments:
+            momo_order_id = self._prepare_momo_order_id(payment['order_id'])
+            requests_list.append({
+                'order_id': momo_order_id,
+                'amount': int(payment['amount']),
+                'order_info': payment.get('order_info') or f"Thanh toan don hang {momo_order_id}",
+            })
+
+        # Gọi MoMo song song ngoài ORM, ghi giao dịch chờ ở luồng chính
+        results = momo_api.create_payments(requests_list, ipn_url=ipn_url)
+        Transaction = self.env['trcf.momo.transaction'].sudo()
+        for payment, momo_request, result in zip(payments, requests_list, results):
+            if result.get('success'):
+                Transaction.create_pending_transaction(
+                    pos_order_ref=str(payment['order_id']),
+                    momo_order_id=momo_request['order_id'],
+                    amount=float(payment['amount']),
+                    request_id=result.get('request_id'),
+                    session_id=session_id,
+                    config_id=config_id
+                )
+        return results
+
+    @api.model
+    def create_momo_payment_rpc(self, order_id, amount, order_info=None, session_id=None, config_id=None,
+                                payment_method_id=None):
         """
         RPC method to create MoMo payment from POS
         
@@ -59,41 +190,17 @@ class TrcfPosPaymentMethod(models.Model):
         Returns:
             dict with success, qr_code_url, pay_url, deeplink, message
         """
-        import uuid
-        import re
+        # Create unique order ID
+        momo_order_id = self._prepare_momo_order_id(order_id)
         
-        # Clean order_id to only contain valid characters for MoMo
-        # MoMo requires: ^[0-9a-zA-Z]+([-_.:]+[0-9a-zA-Z]+)*$
-        clean_order_id = re.sub(r'[^0-9a-zA-Z\-_\.:]', '', str(order_id))
-        if not clean_order_id:
-            clean_order_id = "ORDER"
-        
-        # Create unique order ID with timestamp
-        momo_order_id = f"{clean_order_id}_{uuid.uuid4().hex[:8]}"
-        
-        _logger.info(f"Creating MoMo payment: order={momo_order_id}, amount={amount}")
+        _logger.debug("Creating MoMo payment: order=%s, amount=%s", momo_order_id, amount)
         
         # Get base URL for IPN webhook
         base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
         ipn_url = f"{base_url}/momo/ipn"
-        _logger.info(f"MoMo IPN URL: {ipn_url}")
-        
-        # Get MoMo config from first payment method with trcf_momo terminal
-        payment_method = self.search([
-            ('use_payment_terminal', '=', 'trcf_momo')
-        ], limit=1)
         
         # Build API instance
-        if payment_method and payment_method.momo_partner_code:
-            momo_api = MoMoAPI(
-                partner_code=payment_method.momo_partner_code,
-                access_key=payment_method.momo_access_key,
-                secret_key=payment_method.momo_secret_key,
-                test_mode=payment_method.momo_test_mode
-            )
-        else:
-            # Use default test credentials
-            momo_api = MoMoAPI(test_mode=True)
+        momo_api = self._get_momo_api(config_id=config_id, payment_method_id=payment_method_id)
         
         # Create payment
         if not order_info:
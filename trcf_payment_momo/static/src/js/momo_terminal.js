@@ -260,7 +260,8 @@ patch(PaymentScreen.prototype, {
                         amount: amount,
                         order_info: orderInfo,
                         session_id: this.pos.session?.id,
-                        config_id: this.pos.config?.id
+                        config_id: this.pos.config?.id,
+                        payment_method_id: paymentMethod.id
                     }
                 );
 
@@ -0,0 +1,366 @@
+"""
+Load test thanh toán MoMo đầu-cuối: /pos/momo/create_payment -> IPN -> bus notification.
+
+Script chạy giả lập MoMo trong cùng process, mở N "máy POS" song song gọi MoMoController
+của Odoo và lắng nghe bus (websocket) trên kênh access_token của POS để đo thời gian
+từ lúc tạo thanh toán tới lúc POS nhận thông báo thành công. Chỉ dùng thư viện chuẩn.
+
+Chuẩn bị:
+    - Odoo đang chạy với worker / cron thread như production
+    - Tham số hệ thống trcf_payment_momo.base_url trỏ tới giả lập
+      (hoặc chạy với --configure-odoo, script tự đặt và trả lại giá trị cũ khi kết thúc)
+    - IPN giả lập được ký bằng key của merchant trên POS: truyền --access-key / --secret-key,
+      hoặc với --configure-odoo script tự đọc key từ phương thức MoMo của POS
+      (không khớp thì Odoo từ chối mọi IPN với HTTP 400)
+
+Ví dụ:
+    python3 trcf_payment_momo/tools/momo_load_test.py --odoo-url http://127.0.0.1:8069 \\
+        --db trcf --login admin --password admin --config-id 1 \\
+        --terminals 20 --payments 10 --ipn-delay 1 3 --failure-rate 0.05 --duplicates 1 --configure-odoo
+"""
+import argparse
+import base64
+import http.cookiejar
+import itertools
+import json
+import os
+import socket
+import ssl
+import struct
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+from momo_simulator import DEFAULT_ACCESS_KEY, DEFAULT_SECRET_KEY, MoMoSimulator, serve
+
+NOTIFICATION_SUFFIX = '-MOMO_PAYMENT_SUCCESS'
+
+
+class OdooClient:
+    """Phiên JSON-RPC tới Odoo (cookie riêng cho mỗi máy POS)"""
+
+    def __init__(self, base_url, db, login, password):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+        self.ids = itertools.count(1)
+        self.jsonrpc('/web/session/authenticate', {'db': db, 'login': login, 'password': password})
+
+    def jsonrpc(self, path, params):
+        body = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'id': next(self.ids), 'params': params})
+        request = urllib.request.Request(
+            self.base_url + path, data=body.encode('utf-8'), headers={'Content-Type': 'application/json'}
+        )
+        with self.opener.open(request, timeout=60) as response:
+            result = json.load(response)
+        if result.get('error'):
+            raise RuntimeError(result['error'].get('data', {}).get('message') or result['error'])
+        return result['result']
+
+    def call_kw(self, model, method, args, kwargs=None):
+        return self.jsonrpc(f'/web/dataset/call_kw/{model}/{method}', {
+            'model': model, 'method': method, 'args': args, 'kwargs': kwargs or {},
+        })
+
+    @property
+    def cookie_header(self):
+        return '; '.join(f'{cookie.name}={cookie.value}' for cookie in self.cookies)
+
+
+class BusListener(threading.Thread):
+    """
+    Client websocket tối giản tới /websocket của Odoo, đăng ký kênh access_token của POS
+    và báo thời điểm nhận thông báo MoMo thành công theo pos_order_ref.
+    """
+
+    def __init__(self, base_url, cookie_header, channel):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.cookie_header = cookie_header
+        self.channel = channel
+        self.received = {}
+        self.failed = set()
+        self.condition = threading.Condition()
+        self.sock = None
+        self.connected = threading.Event()
+
+    def _connect(self):
+        parsed = urlsplit(self.base_url)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        sock = socket.create_connection((parsed.hostname, port), timeout=30)
+        if parsed.scheme == 'https':
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parsed.hostname)
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall((
+            f"GET /websocket HTTP/1.1\r\n"
+            f"Host: {parsed.netloc}\r\n"
+            f"Upgrade: websocket\r\n"
+            f"Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            f"Sec-WebSocket-Version: 13\r\n"
+            f"Origin: {self.base_url}\r\n"
+            f"Cookie: {self.cookie_header}\r\n\r\n"
+        ).encode())
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError('Websocket handshake failed')
+            response += chunk
+        if b' 101 ' not in response.split(b'\r\n', 1)[0]:
+            raise ConnectionError(response.split(b'\r\n', 1)[0].decode())
+        sock.settimeout(None)
+        self.sock = sock
+        self._buffer = response.split(b'\r\n\r\n', 1)[1]
+        self._send(1, json.dumps({
+            'event_name': 'subscribe',
+            'data': {'channels': [self.channel], 'last': 0},
+        }).encode())
+
+    def _send(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 65536:
+            header += bytes([0x80 | 126]) + struct.pack('!H', length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('!Q', length)
+        mask = os.urandom(4)
+        self.sock.sendall(header + mask + bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload)))
+
+    def _recv_exact(self, size):
+        while len(self._buffer) < size:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError('Websocket closed')
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _recv_message(self):
+        message = b''
+        while True:
+            first, second = self._recv_exact(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', self._recv_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._recv_exact(8))[0]
+            payload = self._recv_exact(length)
+            if opcode == 0x8:
+                raise ConnectionError('Websocket closed by server')
+            if opcode == 0x9:
+                self._send(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            message += payload
+            if first & 0x80:
+                return message
+
+    def run(self):
+        self._connect()
+        self.connected.set()
+        while True:
+            try:
+                notifications = json.loads(self._recv_message())
+            except (ConnectionError, OSError):
+                return
+            received_at = time.monotonic()
+            for notification in notifications if isinstance(notifications, list) else []:
+                message = notification.get('message') or {}
+                if not str(message.get('type', '')).endswith(NOTIFICATION_SUFFIX):
+                    continue
+                with self.condition:
+                    self.received.setdefault(message['payload'].get('pos_order_ref'), received_at)
+                    self.condition.notify_all()
+
+    def mark_failed(self, order_ref):
+        """Giả lập đã gửi IPN lỗi: không chờ thông báo thành công cho thanh toán này"""
+        with self.condition:
+            self.failed.add(order_ref)
+            self.condition.notify_all()
+
+    def wait_for(self, order_ref, deadline):
+        """Thời điểm nhận thông báo thành công, None nếu thanh toán lỗi hoặc quá hạn"""
+        with self.condition:
+            while order_ref not in self.received:
+                if order_ref in self.failed:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.received[order_ref]
+
+
+def percentile(values, rank):
+    """Phân vị theo nearest-rank, values đã sắp xếp"""
+    if not values:
+        return float('nan')
+    index = max(0, min(len(values) - 1, int(round(rank / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def run_terminal(terminal, args, listener, ipn_sent, results, lock):
+    """Một máy POS: tạo lần lượt các thanh toán và chờ thông báo của từng thanh toán"""
+    client = OdooClient(args.odoo_url, args.db, args.login, args.password)
+    for index in range(args.payments):
+        order_ref = f'LT{args.run_id}-{terminal}-{index}'
+        started = time.monotonic()
+        try:
+            response = client.jsonrpc('/pos/momo/create_payment', {
+                'order_id': order_ref,
+                'amount': args.amount,
+                'config_id': args.config_id,
+                'session_id': args.session_id,
+            })
+        except Exception as e:
+            with lock:
+                results.append({'status': 'create_error', 'error': str(e)})
+            continue
+        created = time.monotonic()
+        if not response.get('success'):
+            with lock:
+                results.append({'status': 'create_error', 'error': response.get('message'),
+                                'create_seconds': created - started})
+            continue
+
+        notified = listener.wait_for(order_ref, created + args.timeout)
+        ipn = ipn_sent.get(order_ref)
+        if notified is not None:
+            status = 'notified'
+        elif ipn and ipn['resultCode'] != 0:
+            status = 'failed'
+        else:
+            status = 'timeout'
+        with lock:
+            results.append({
+                'status': status,
+                'create_seconds': created - started,
+                'notify_seconds': notified - started if notified is not None else None,
+                'processing_seconds': notified - ipn['sent_at'] if notified is not None and ipn else None,
+            })
+
+
+def report(results, elapsed, simulator):
+    def describe(name, values):
+        values = sorted(value for value in values if value is not None)
+        if not values:
+            return f"  {name}: -"
+        return (f"  {name}: p50 {percentile(values, 50) * 1000:.0f} ms | "
+                f"p99 {percentile(values, 99) * 1000:.0f} ms | max {values[-1] * 1000:.0f} ms")
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    notified = counts.get('notified', 0)
+    print(f"Kết quả sau {elapsed:.1f} s: " + ', '.join(f"{status} {count}" for status, count in sorted(counts.items())))
+    print(f"  Thông lượng: {len(results) / elapsed:.2f} thanh toán/s, {notified / elapsed:.2f} thông báo/s")
+    print(describe('Tạo thanh toán', (result.get('create_seconds') for result in results)))
+    print(describe('Tạo -> thông báo POS', (result.get('notify_seconds') for result in results)))
+    print(describe('IPN -> thông báo POS', (result.get('processing_seconds') for result in results)))
+    print(f"  Giả lập: {simulator.stats}")
+    errors = [result['error'] for result in results if result.get('error')]
+    if errors:
+        print(f"  Lỗi đầu tiên: {errors[0]}")
+
+
+def read_momo_keys(admin, config_id):
+    """Key của phương thức MoMo mà POS dùng (cùng thứ tự chọn merchant với _get_momo_api), trống = tài khoản test"""
+    domain = [('use_payment_terminal', '=', 'trcf_momo'), ('momo_partner_code', '!=', False)]
+    methods = admin.call_kw('pos.payment.method', 'search_read',
+                            [domain + [('config_ids', 'in', config_id)], ['momo_access_key', 'momo_secret_key']],
+                            {'limit': 1})
+    if not methods:
+        return None, None
+    return methods[0]['momo_access_key'] or None, methods[0]['momo_secret_key'] or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test thanh toán MoMo qua giả lập')
+    parser.add_argument('--odoo-url', default='http://127.0.0.1:8069')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--login', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--config-id', type=int, required=True)
+    parser.add_argument('--session-id', type=int)
+    parser.add_argument('--terminals', type=int, default=10, help='số máy POS chạy song song')
+    parser.add_argument('--payments', type=int, default=10, help='số thanh toán mỗi máy POS')
+    parser.add_argument('--amount', type=int, default=50000)
+    parser.add_argument('--timeout', type=float, default=60, help='thời gian chờ thông báo tối đa (giây)')
+    parser.add_argument('--sim-host', default='127.0.0.1')
+    parser.add_argument('--sim-port', type=int, default=8765)
+    parser.add_argument('--ipn-delay', type=float, nargs=2, default=(1.0, 3.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--duplicates', type=int, default=0)
+    parser.add_argument('--ipn-url', help='ghi đè ipnUrl (mặc định: <odoo-url>/momo/ipn)')
+    parser.add_argument('--configure-odoo', action='store_true',
+                        help='tạm đặt trcf_payment_momo.base_url trỏ tới giả lập, đọc key MoMo của POS')
+    parser.add_argument('--access-key', help='access key của merchant trên POS')
+    parser.add_argument('--secret-key', help='secret key của merchant trên POS, dùng ký IPN')
+    args = parser.parse_args()
+    args.run_id = int(time.time())
+
+    ipn_sent = {}
+
+    def on_ipn(body, sent_at):
+        # momo_order_id = <pos_order_ref>_<hậu tố ngẫu nhiên>
+        order_ref = body['orderId'].rsplit('_', 1)[0]
+        ipn_sent[order_ref] = {'resultCode': body['resultCode'], 'sent_at': sent_at}
+        if body['resultCode'] != 0:
+            listener.mark_failed(order_ref)
+
+    admin = OdooClient(args.odoo_url, args.db, args.login, args.password)
+    access_key, secret_key = args.access_key, args.secret_key
+    if args.configure_odoo and not (access_key and secret_key):
+        access_key, secret_key = read_momo_keys(admin, args.config_id)
+
+    simulator = MoMoSimulator(
+        ipn_delay=tuple(args.ipn_delay), failure_rate=args.failure_rate, duplicates=args.duplicates,
+        ipn_url=args.ipn_url or f"{args.odoo_url.rstrip('/')}/momo/ipn", on_ipn=on_ipn,
+        access_key=access_key or DEFAULT_ACCESS_KEY, secret_key=secret_key or DEFAULT_SECRET_KEY,
+    )
+    server, _simulator = serve(args.sim_host, args.sim_port, simulator)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    previous_base_url = None
+    if args.configure_odoo:
+        previous_base_url = admin.call_kw('ir.config_parameter', 'get_param', ['trcf_payment_momo.base_url'])
+        admin.call_kw('ir.config_parameter', 'set_param',
+                      ['trcf_payment_momo.base_url', f'http://{args.sim_host}:{args.sim_port}'])
+    access_token = admin.call_kw('pos.config', 'read', [[args.config_id], ['access_token']])[0]['access_token']
+
+    listener = BusListener(args.odoo_url, admin.cookie_header, access_token)
+    listener.start()
+    if not listener.connected.wait(30):
+        raise SystemExit('Không kết nối được websocket của Odoo')
+
+    results = []
+    lock = threading.Lock()
+    started = time.monotonic()
+    try:
+        terminals = [
+            threading.Thread(target=run_terminal, args=(terminal, args, listener, ipn_sent, results, lock))
+            for terminal in range(args.terminals)
+        ]
+        for terminal in terminals:
+            terminal.start()
+        for terminal in terminals:
+            terminal.join()
+    finally:
+        elapsed = time.monotonic() - started
+        if args.configure_odoo:
+            admin.call_kw('ir.config_parameter', 'set_param',
+                          ['trcf_payment_momo.base_url', previous_base_url or False])
+        simulator.stop()
+        server.shutdown()
+
+    report(results, elapsed, simulator)
+
+
+if __name__ == '__main__':
+    main()
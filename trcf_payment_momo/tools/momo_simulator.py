@@ -0,0 +1,300 @@
+"""
+Giả lập cổng thanh toán MoMo chạy local (chỉ dùng thư viện chuẩn, không import Odoo).
+
+Chạy:
+    python3 trcf_payment_momo/tools/momo_simulator.py --port 8765 --ipn-delay 2 5 --failure-rate 0.05 --duplicates 1
+
+Rồi trỏ Odoo sang giả lập bằng tham số hệ thống:
+    trcf_payment_momo.base_url = http://127.0.0.1:8765
+
+Endpoint:
+    POST /v2/gateway/api/create   tạo giao dịch (trạng thái chờ, resultCode 1000)
+    POST /v2/gateway/api/query    trả trạng thái giao dịch
+    POST /simulator/complete      {"orderId", "resultCode"} đánh dấu giao dịch đã thanh toán / lỗi
+
+Khi bật --ipn-delay, mỗi giao dịch vừa tạo được tự thanh toán sau một khoảng ngẫu nhiên
+(giả lập khách quét QR) và IPN có chữ ký được gửi tới ipnUrl của yêu cầu tạo,
+kèm tỉ lệ giao dịch lỗi và số IPN lặp lại cấu hình được.
+"""
+import argparse
+import hashlib
+import heapq
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# resultCode MoMo: chờ khách xác nhận / đơn không tồn tại
+RESULT_PENDING = 1000
+RESULT_NOT_FOUND = 42
+# resultCode IPN lỗi: khách từ chối thanh toán
+RESULT_USER_DENIED = 1006
+
+# Tài khoản test mặc định của MoMo (giống MoMoAPI.DEFAULT_*)
+DEFAULT_ACCESS_KEY = "F8BBA842ECF85"
+DEFAULT_SECRET_KEY = "K951B6PE1waDMi640xX08PD3vg6EkVlz"
+# Khoảng cách giữa các IPN lặp lại (giây)
+DUPLICATE_SPACING_SECONDS = 0.2
+IPN_TIMEOUT_SECONDS = 10
+
+
+class IpnSender:
+    """
+    Gửi IPN theo lịch: một thread giữ hàng đợi ưu tiên theo thời điểm gửi,
+    việc POST tới Odoo chạy trên thread pool để IPN chậm không chặn các IPN khác.
+    """
+
+    def __init__(self, workers=16):
+        self.queue = []
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='momo_ipn')
+        self.sequence = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, send_at, callback):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.queue, (send_at, self.sequence, callback))
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.executor.shutdown(wait=False)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if self.stopped:
+                    return
+                _send_at, _sequence, callback = heapq.heappop(self.queue)
+            self.executor.submit(callback)
+
+
+class MoMoSimulator:
+    """
+    Trạng thái giao dịch của giả lập, dùng chung giữa các thread của HTTP server.
+
+    Args:
+        ipn_delay: (min, max) giây từ lúc tạo tới lúc khách thanh toán; None = không tự thanh toán
+        failure_rate: tỉ lệ giao dịch lỗi (IPN resultCode != 0)
+        duplicates: số IPN gửi lặp lại cho mỗi giao dịch
+        ipn_url: ghi đè ipnUrl của yêu cầu tạo
+        on_ipn: callback(order, sent_at) sau mỗi IPN đầu tiên được gửi, dùng cho load test
+    """
+
+    def __init__(self, ipn_delay=None, failure_rate=0.0, duplicates=0, ipn_url=None,
+                 access_key=DEFAULT_ACCESS_KEY, secret_key=DEFAULT_SECRET_KEY, on_ipn=None, seed=None):
+        self.orders = {}
+        self.lock = threading.Lock()
+        self.next_trans_id = int(time.time()) * 1000
+        self.ipn_delay = ipn_delay
+        self.failure_rate = failure_rate
+        self.duplicates = duplicates
+        self.ipn_url = ipn_url
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.on_ipn = on_ipn
+        self.random = random.Random(seed)
+        self.sender = IpnSender() if ipn_delay else None
+        self.stats = {'created': 0, 'ipn_sent': 0, 'ipn_errors': 0}
+
+    def create(self, data):
+        order_id = str(data.get('orderId', ''))
+        with self.lock:
+            self.orders.setdefault(order_id, {
+                'partnerCode': data.get('partnerCode', ''),
+                'requestId': data.get('requestId', ''),
+                'amount': int(data.get('amount', 0)),
+                'orderInfo': data.get('orderInfo', ''),
+                'ipnUrl': data.get('ipnUrl', ''),
+                'resultCode': RESULT_PENDING,
+                'transId': 0,
+            })
+            self.stats['created'] += 1
+            if self.sender:
+                delay = self.random.uniform(*self.ipn_delay)
+                result_code = RESULT_USER_DENIED if self.random.random() < self.failure_rate else 0
+                self.sender.schedule(time.monotonic() + delay, lambda: self.pay(order_id, result_code))
+        return {
+            'partnerCode': data.get('partnerCode', ''),
+            'requestId': data.get('requestId', ''),
+            'orderId': order_id,
+            'amount': int(data.get('amount', 0)),
+            'resultCode': 0,
+            'message': 'Thành công.',
+            'payUrl': f'https://simulator.local/pay/{order_id}',
+            'deeplink': f'momo://simulator/{order_id}',
+            'qrCodeUrl': f'2|99|simulator|{order_id}',
+            'responseTime': int(time.time() * 1000),
+        }
+
+    def complete(self, order_id, result_code=0):
+        """Kết thúc giao dịch, trả về bản sao trạng thái (None nếu không có giao dịch)"""
+        with self.lock:
+            order = self.orders.get(str(order_id))
+            if order is None:
+                return None
+            if order['resultCode'] == RESULT_PENDING:
+                self.next_trans_id += 1
+                order['resultCode'] = int(result_code)
+                order['transId'] = self.next_trans_id
+            return dict(order, orderId=str(order_id))
+
+    def pay(self, order_id, result_code=0):
+        """Khách thanh toán: kết thúc giao dịch và gửi IPN (kèm IPN lặp lại)"""
+        order = self.complete(order_id, result_code)
+        if order is None or not (self.ipn_url or order['ipnUrl']):
+            return
+        body = self.build_ipn(order)
+        self.send_ipn(body, first=True)
+        for index in range(self.duplicates):
+            self.sender.schedule(time.monotonic() + DUPLICATE_SPACING_SECONDS * (index + 1),
+                                 lambda: self.send_ipn(body))
+
+    def build_ipn(self, order):
+        """Nội dung IPN MoMo có chữ ký HMAC SHA256"""
+        body = {
+            'partnerCode': order['partnerCode'],
+            'orderId': order['orderId'],
+            'requestId': order['requestId'],
+            'amount': order['amount'],
+            'orderInfo': order['orderInfo'],
+            'orderType': 'momo_wallet',
+            'transId': order['transId'],
+            'resultCode': order['resultCode'],
+            'message': 'Thành công.' if order['resultCode'] == 0 else 'Giao dịch bị từ chối bởi người dùng.',
+            'payType': 'qr',
+            'responseTime': int(time.time() * 1000),
+            'extraData': '',
+        }
+        raw_signature = '&'.join(f"{key}={value}" for key, value in sorted(
+            dict(body, accessKey=self.access_key).items()
+        ))
+        body['signature'] = hmac.new(
+            self.secret_key.encode('utf-8'), raw_signature.encode('utf-8'), hashlib.sha256
+        ).hexdigest()
+        return body
+
+    def send_ipn(self, body, first=False):
+        url = self.ipn_url or self.orders[body['orderId']]['ipnUrl']
+        request = urllib.request.Request(
+            url, data=json.dumps(body).encode('utf-8'), headers={'Content-Type': 'application/json'}
+        )
+        sent_at = time.monotonic()
+        try:
+            urllib.request.urlopen(request, timeout=IPN_TIMEOUT_SECONDS).close()
+            with self.lock:
+                self.stats['ipn_sent'] += 1
+        except OSError:
+            with self.lock:
+                self.stats['ipn_errors'] += 1
+        if first and self.on_ipn:
+            self.on_ipn(body, sent_at)
+
+    def stop(self):
+        if self.sender:
+            self.sender.stop()
+
+    def query(self, data):
+        order_id = str(data.get('orderId', ''))
+        with self.lock:
+            order = self.orders.get(order_id)
+            order = dict(order) if order else None
+        if order is None:
+            return {'orderId': order_id, 'resultCode': RESULT_NOT_FOUND, 'message': 'Order not found'}
+        return {
+            'partnerCode': order['partnerCode'],
+            'requestId': data.get('requestId', ''),
+            'orderId': order_id,
+            'amount': order['amount'],
+            'transId': order['transId'],
+            'resultCode': order['resultCode'],
+            'message': 'Thành công.' if order['resultCode'] == 0 else 'Simulated status',
+            'responseTime': int(time.time() * 1000),
+        }
+
+
+def make_handler(simulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                data = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self._reply(400, {'message': 'Invalid JSON'})
+            if self.path == '/v2/gateway/api/create':
+                return self._reply(200, simulator.create(data))
+            if self.path == '/v2/gateway/api/query':
+                return self._reply(200, simulator.query(data))
+            if self.path == '/simulator/complete':
+                order = simulator.complete(data.get('orderId'), data.get('resultCode', 0))
+                return self._reply(200 if order else 404, order or {'message': 'Order not found'})
+            return self._reply(404, {'message': 'Not found'})
+
+        def _reply(self, status, body):
+            content = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host='127.0.0.1', port=8765, simulator=None):
+    """Tạo HTTP server giả lập (chưa chạy), trả về (server, simulator)"""
+    simulator = simulator or MoMoSimulator()
+    server = ThreadingHTTPServer((host, port), make_handler(simulator))
+    server.daemon_threads = True
+    return server, simulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Giả lập cổng thanh toán MoMo')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ipn-delay', type=float, nargs=2, metavar=('MIN', 'MAX'),
+                        help='tự thanh toán và gửi IPN sau MIN..MAX giây')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--duplicates', type=int, default=0, help='số IPN lặp lại mỗi giao dịch')
+    parser.add_argument('--ipn-url', help='ghi đè ipnUrl, ví dụ http://127.0.0.1:8069/momo/ipn')
+    parser.add_argument('--access-key', default=DEFAULT_ACCESS_KEY,
+                        help='access key của merchant cấu hình trên POS (mặc định: tài khoản test)')
+    parser.add_argument('--secret-key', default=DEFAULT_SECRET_KEY,
+                        help='secret key dùng ký IPN, phải khớp merchant trên POS (mặc định: tài khoản test)')
+    args = parser.parse_args()
+
+    simulator = MoMoSimulator(
+        ipn_delay=args.ipn_delay, failure_rate=args.failure_rate,
+        duplicates=args.duplicates, ipn_url=args.ipn_url,
+        access_key=args.access_key, secret_key=args.secret_key,
+    )
+    server, _simulator = serve(args.host, args.port, simulator)
+    print(f"MoMo simulator: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,16 @@
 from odoo import http
 from odoo.http import request
 from datetime import datetime, timedelta
+import pytz
 
 
 class TrcfPnlDashboardController(http.Controller):
     
     def _get_date_range(self, period, date_from, date_to):
         """Xác định khoảng thời gian dựa trên period"""
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        # "Hôm nay" theo giờ cửa hàng, cùng timezone với bảng trcf.sales.daily.fact
+        store_tz = pytz.timezone(request.env['trcf.sales.daily.fact']._get_store_tz())
+        today = datetime.now(store_tz).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
         
         if period == 'day':
             start_date = today
@@ -41,18 +44,18 @@ class TrcfPnlDashboardController(http.Controller):
         return start_date, end_date, period_label
     
     def _get_revenue_data(self, start_date, end_date):
-        """Lấy doanh thu từ pos.order"""
-        PosOrder = request.env['pos.order'].sudo()
-        orders = PosOrder.search([
-            ('date_order', '>=', start_date.strftime('%Y-%m-%d %H:%M:%S')),
-            ('date_order', '<', end_date.strftime('%Y-%m-%d %H:%M:%S')),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ])
-        
-        revenue = sum(order.amount_total for order in orders)
-        order_count = len(orders)
-        
-        return revenue, order_count
+        """Lấy doanh thu từ bảng tổng hợp trcf.sales.daily.fact"""
+        result = request.env['trcf.sales.daily.fact'].sudo()._read_group(
+            domain=[
+                ('date', '>=', start_date.date()),
+                ('date', '<', end_date.date()),
+                ('payment_method_id', '=', False),  # Dòng chỉ số theo đơn
+            ],
+            aggregates=['amount_total:sum', 'order_count:sum'],
+        )
+        revenue, order_count = result[0]
+        
+        return revenue or 0, order_count or 0
     
     def _get_cogs_data(self, start_date, end_date):
         """Lấy COGS từ purchase.order với breakdown paid/unpaid"""
@@ -183,13 +186,7 @@ class TrcfPnlDashboardController(http.Controller):
         prev_start = start_date - timedelta(days=period_days)
         prev_end = start_date
         
-        PosOrder = request.env['pos.order'].sudo()
-        prev_orders = PosOrder.search([
-            ('date_order', '>=', prev_start.strftime('%Y-%m-%d %H:%M:%S')),
-            ('date_order', '<', prev_end.strftime('%Y-%m-%d %H:%M:%S')),
-            ('state', 'in', ['paid', 'done', 'invoiced']),
-        ])
-        prev_revenue = sum(order.amount_total for order in prev_orders)
+        prev_revenue, _prev_order_count = self._get_revenue_data(prev_start, prev_end)
         
         if prev_revenue > 0:
             revenue_change = ((revenue - prev_revenue) / prev_revenue) * 100
@@ -10,7 +10,9 @@
     'depends': ['point_of_sale'],
     'data': [
         'security/ir.model.access.csv',
+        'data/trcf_printer_job_cron.xml',
         'views/trcf_printer_manager_views.xml',
+        'views/trcf_printer_job_views.xml',
         'views/trcf_printer_manager_menu.xml',
     ],
     'installable': True,
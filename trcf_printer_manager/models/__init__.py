@@ -1,2 +1,4 @@
 from . import trcf_printer_manager
-from . import trcf_printer_pos_order
\ No newline at end of file
+from . import trcf_printer_job
+from . import trcf_printer_pos_order
+from . import trcf_res_company
\ No newline at end of file
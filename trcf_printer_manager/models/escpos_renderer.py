@@ -0,0 +1,55 @@
+import unicodedata
+from functools import lru_cache
+
+# Lệnh ESC/POS cơ bản
+ESC = b'\x1b'
+GS = b'\x1d'
+ALIGN_CODES = {'left': 0, 'center': 1, 'right': 2}
+
+
+@lru_cache(maxsize=4096)
+def convert_vi_to_unsigned(text):
+    """
+    Chuyển đổi chuỗi tiếng Việt có dấu thành không dấu (có ghi nhớ kết quả).
+    Ví dụ: "Cà phê sữa đá" -> "Ca phe sua da"
+    """
+
+    # Bước 1: Thay thế 'Đ' và 'đ' trước khi chuẩn hóa Unicode
+    text = text.replace('Đ', 'D').replace('đ', 'd')
+
+    # Bước 2: Chuẩn hóa chuỗi Unicode (NFD - Normalization Form D)
+    # Tách các ký tự có dấu thành ký tự cơ bản và dấu thanh riêng biệt.
+    normalized_text = unicodedata.normalize('NFD', text)
+
+    # Bước 3: Lọc bỏ các ký tự dấu (combining characters)
+    return "".join([c for c in normalized_text if unicodedata.category(c) != 'Mn'])
+
+
+class EscPosBuffer:
+    """
+    Bộ đệm ESC/POS: gom toàn bộ lệnh in vào một bytearray để gửi một lần.
+    Giao diện set() / text() / cut() giống python-escpos để giữ nguyên code render.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def set(self, bold=False, width=1, height=1, align='left'):
+        self._buffer += ESC + b'a' + bytes([ALIGN_CODES.get(align, 0)])
+        self._buffer += ESC + b'E' + bytes([1 if bold else 0])
+        self._buffer += GS + b'!' + bytes([((width - 1) << 4) | (height - 1)])
+
+    def text(self, text):
+        self._buffer += text.encode('ascii', 'replace')
+
+    def raw(self, data):
+        self._buffer += data
+
+    def cut(self):
+        # Đẩy giấy 6 dòng rồi cắt toàn phần
+        self._buffer += ESC + b'd' + bytes([6])
+        self._buffer += GS + b'V' + bytes([0])
+
+    @property
+    def output(self):
+        return bytes(self._buffer)
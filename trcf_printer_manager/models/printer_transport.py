@@ -0,0 +1,150 @@
+import logging
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_logger = logging.getLogger(__name__)
+
+
+class PrinterTransport:
+    """
+    Lớp truyền dữ liệu tới máy in mạng (ESC/POS, TSPL qua cổng RAW 9100).
+
+    - Giữ kết nối TCP "nóng" cho mỗi (ip, port) và kiểm tra còn sống trước khi dùng lại,
+      tránh mở / đóng kết nối mới cho từng đơn hàng.
+    - Gửi tới nhiều máy in song song qua thread pool giới hạn; các lệnh của cùng một
+      máy in vẫn được gửi tuần tự đúng thứ tự.
+
+    Lớp này không dùng ORM nên an toàn khi chạy trong thread riêng: dữ liệu in phải
+    được render thành bytes trước khi gửi.
+    """
+
+    CONNECT_TIMEOUT = 5
+    SEND_TIMEOUT = 10
+    # Máy in thường tự đóng kết nối rảnh, bỏ kết nối đã rảnh quá lâu thay vì gửi vào kết nối chết
+    IDLE_TIMEOUT = 60
+    MAX_WORKERS = 8
+
+    def __init__(self):
+        self._connections = {}  # (ip, port) -> (socket, last_used)
+        self._locks = {}        # (ip, port) -> threading.Lock
+        self._locks_guard = threading.Lock()
+        self._executor = None
+        self._executor_guard = threading.Lock()
+
+    def _get_lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _get_executor(self):
+        with self._executor_guard:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.MAX_WORKERS,
+                    thread_name_prefix='trcf_printer',
+                )
+            return self._executor
+
+    def _is_alive(self, sock):
+        """Kết nối còn dùng được: không có dữ liệu đọc được, hoặc chỉ là byte trạng thái của máy in"""
+        try:
+            readable, _writable, errored = select.select([sock], [], [sock], 0)
+            if errored:
+                return False
+            if readable:
+                # Máy in đóng kết nối -> recv trả về rỗng; ngược lại bỏ qua byte trạng thái
+                return bool(sock.recv(1024))
+            return True
+        except OSError:
+            return False
+
+    def _connect(self, ip, port):
+        sock = socket.create_connection((ip, port), timeout=self.CONNECT_TIMEOUT)
+        sock.settimeout(self.SEND_TIMEOUT)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _close(self, key):
+        sock, _last_used = self._connections.pop(key, (None, None))
+        if sock:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _get_connection(self, key):
+        """Lấy kết nối nóng nếu còn sống, ngược lại mở kết nối mới. Gọi khi đang giữ lock của key"""
+        sock, last_used = self._connections.get(key, (None, None))
+        if sock and time.monotonic() - last_used < self.IDLE_TIMEOUT and self._is_alive(sock):
+            return sock, True
+        self._close(key)
+        sock = self._connect(*key)
+        self._connections[key] = (sock, time.monotonic())
+        return sock, False
+
+    def send(self, ip, port, data):
+        """
+        Gửi dữ liệu tới một máy in qua kết nối nóng.
+
+        Nếu kết nối tái sử dụng bị lỗi (máy in đã đóng phía bên kia), mở lại và gửi một lần nữa.
+        Lỗi trên kết nối mới được ném ra cho bên gọi.
+        """
+        key = (ip, port)
+        with self._get_lock(key):
+            sock, reused = self._get_connection(key)
+            try:
+                sock.sendall(data)
+            except OSError:
+                self._close(key)
+                if not reused:
+                    raise
+                sock, _reused = self._get_connection(key)
+                try:
+                    sock.sendall(data)
+                except OSError:
+                    self._close(key)
+                    raise
+            self._connections[key] = (sock, time.monotonic())
+
+    def _send_sequence(self, ip, port, items):
+        """Gửi tuần tự các lệnh của một máy in, dừng ở lệnh lỗi đầu tiên"""
+        sent = []
+        for item_key, data in items:
+            try:
+                if data:
+                    self.send(ip, port, data)
+            except Exception as e:
+                return sent, item_key, e
+            sent.append(item_key)
+        return sent, None, None
+
+    def send_many(self, batches):
+        """
+        Gửi song song tới nhiều máy in.
+
+        Args:
+            batches: dict {(ip, port): [(item_key, data), ...]}
+
+        Returns:
+            dict {(ip, port): (sent_item_keys, failed_item_key, error)}
+        """
+        executor = self._get_executor()
+        futures = {
+            key: executor.submit(self._send_sequence, key[0], key[1], items)
+            for key, items in batches.items()
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+    def close_all(self):
+        with self._locks_guard:
+            keys = list(self._connections)
+        for key in keys:
+            with self._get_lock(key):
+                self._close(key)
+
+
+# Một transport dùng chung cho cả process (kết nối nóng được chia sẻ giữa các lần chạy cron)
+printer_transport = PrinterTransport()
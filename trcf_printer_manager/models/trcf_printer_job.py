@@ -0,0 +1,186 @@
+from odoo import models, fields, api
+from datetime import timedelta
+import logging
+
+from .printer_transport import printer_transport
+
+_logger = logging.getLogger(__name__)
+
+# Số lần thử tối đa trước khi đánh dấu lệnh in thất bại
+MAX_ATTEMPTS = 5
+# Thời gian chờ thử lại: 10s, 20s, 40s, 80s... tối đa 5 phút
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 300
+# Số lệnh in xử lý tối đa trong một lần chạy dispatcher
+DISPATCH_BATCH_SIZE = 200
+# Số lệnh gửi tới mỗi máy in trước mỗi lần commit (cron bị ngắt chỉ in lại tối đa chừng này lệnh)
+SEND_GROUP_SIZE = 5
+# Số ngày giữ lệnh in đã xong / lỗi
+KEEP_DAYS = 7
+
+
+class TrcfPrinterJob(models.Model):
+    """
+    Hàng đợi lệnh in. sync_from_ui chỉ tạo lệnh in, việc kết nối máy in
+    được thực hiện bởi cron dispatcher sau khi transaction đã commit.
+    """
+    _name = 'trcf.printer.job'
+    _description = 'TRCF Printer Job'
+    _order = 'id desc'
+
+    printer_id = fields.Many2one('trcf.printer.manager', string='Máy in', required=True, ondelete='cascade', index=True)
+    order_id = fields.Many2one('pos.order', string='Đơn hàng', required=True, ondelete='cascade', index=True)
+    job_type = fields.Selection([
+        ('invoice', 'HOÁ ĐƠN'),
+        ('label', 'TEM DÁN'),
+        ('kitchen_order_ticket', 'PHIẾU YÊU CẦU MÓN')
+    ], string='Loại lệnh in', required=True)
+    state = fields.Selection([
+        ('pending', 'Chờ in'),
+        ('done', 'Đã in'),
+        ('failed', 'Lỗi'),
+    ], string='Trạng thái', default='pending', required=True, index=True)
+    attempt_count = fields.Integer(string='Số lần thử', default=0)
+    next_attempt_at = fields.Datetime(string='Thử lại lúc', default=fields.Datetime.now, index=True)
+    date_done = fields.Datetime(string='Thời gian in')
+    last_error = fields.Text(string='Lỗi gần nhất')
+
+    @api.model
+    def _enqueue_orders(self, orders):
+        """Tạo lệnh in cho các đơn hàng và kích hoạt dispatcher sau khi commit"""
+        vals_list = []
+        for order in orders:
+            for printer, job_type in order._trcf_get_print_targets():
+                vals_list.append({
+                    'printer_id': printer.id,
+                    'order_id': order.id,
+                    'job_type': job_type,
+                })
+        if not vals_list:
+            return self
+        jobs = self.sudo().create(vals_list)
+        self.env.ref('trcf_printer_manager.ir_cron_trcf_printer_job_dispatch').sudo()._trigger()
+        return jobs
+
+    @api.model
+    def get_order_print_status(self, order_ids):
+        """Trạng thái in của các đơn hàng, dùng cho POS kiểm tra định kỳ"""
+        jobs = self.sudo().search([('order_id', 'in', order_ids)], order='id')
+        return [{
+            'id': job.id,
+            'order_id': job.order_id.id,
+            'printer': job.printer_id.name,
+            'job_type': job.job_type,
+            'state': job.state,
+            'attempt_count': job.attempt_count,
+            'last_error': job.last_error or '',
+        } for job in jobs]
+
+    def action_retry(self):
+        """Đưa các lệnh in lỗi trở lại hàng đợi"""
+        self.write({
+            'state': 'pending',
+            'attempt_count': 0,
+            'next_attempt_at': fields.Datetime.now(),
+            'last_error': False,
+        })
+        self.env.ref('trcf_printer_manager.ir_cron_trcf_printer_job_dispatch').sudo()._trigger()
+        return True
+
+    def _mark_done(self):
+        self.ensure_one()
+        self.write({
+            'state': 'done',
+            'attempt_count': self.attempt_count + 1,
+            'date_done': fields.Datetime.now(),
+            'last_error': False,
+        })
+
+    def _mark_failed(self, error):
+        """Tăng số lần thử và hẹn giờ thử lại theo cấp số nhân, trả về thời điểm thử lại"""
+        self.ensure_one()
+        attempt_count = self.attempt_count + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempt_count - 1), RETRY_MAX_SECONDS)
+        next_attempt_at = fields.Datetime.now() + timedelta(seconds=delay)
+        self.write({
+            'state': 'failed' if attempt_count >= MAX_ATTEMPTS else 'pending',
+            'attempt_count': attempt_count,
+            'next_attempt_at': next_attempt_at,
+            'last_error': str(error),
+        })
+        return next_attempt_at
+
+    @api.model
+    def _cron_dispatch_jobs(self):
+        """
+        Gửi các lệnh in đang chờ.
+
+        Lệnh in được render thành bytes ở thread chính (ORM), sau đó transport gửi tới
+        các máy in song song qua kết nối nóng. Mỗi máy in được xử lý độc lập: khi một máy in
+        lỗi, các lệnh còn lại của máy đó được hoãn sang lần thử sau thay vì chờ timeout lần nữa.
+        Lệnh được gửi theo nhóm SEND_GROUP_SIZE mỗi máy in và trạng thái được commit sau mỗi nhóm,
+        để cron bị ngắt giữa chừng không in lại cả lô.
+        """
+        now = fields.Datetime.now()
+        jobs = self.search([
+            ('state', '=', 'pending'),
+            ('next_attempt_at', '<=', now),
+        ], order='id', limit=DISPATCH_BATCH_SIZE)
+
+        # 1. Render tất cả lệnh in, gom theo máy in
+        batches = {}
+        for job in jobs:
+            try:
+                data = job.order_id._trcf_render_print_job(job)
+            except Exception as e:
+                _logger.exception("Lỗi render lệnh in %s cho đơn %s", job.job_type, job.order_id.name)
+                job._mark_failed(e)
+                continue
+            printer_key = (job.printer_id.ip_address, job.printer_id.port)
+            batches.setdefault(printer_key, []).append((job.id, data))
+        # Lưu lỗi render trước khi gửi
+        self._commit_progress()
+
+        while batches:
+            # 2. Gửi song song tới các máy in, mỗi máy in một nhóm nhỏ
+            results = printer_transport.send_many({
+                printer_key: items[:SEND_GROUP_SIZE] for printer_key, items in batches.items()
+            })
+
+            # 3. Cập nhật trạng thái lệnh in của nhóm rồi commit ngay
+            for printer_key, (sent_job_ids, failed_job_id, error) in results.items():
+                for job in self.browse(sent_job_ids):
+                    job._mark_done()
+                items = batches.pop(printer_key)
+                if failed_job_id:
+                    failed_job = self.browse(failed_job_id)
+                    _logger.warning("Lỗi in %s cho đơn %s trên máy in %s:%s: %s",
+                                    failed_job.job_type, failed_job.order_id.name, *printer_key, error)
+                    next_attempt_at = failed_job._mark_failed(error)
+                    # Hoãn các lệnh còn lại của máy in lỗi (cả các nhóm sau) tới cùng thời điểm thử lại
+                    pending_job_ids = [job_id for job_id, _data in items if job_id > failed_job_id]
+                    self.browse(pending_job_ids).write({'next_attempt_at': next_attempt_at})
+                elif items[SEND_GROUP_SIZE:]:
+                    batches[printer_key] = items[SEND_GROUP_SIZE:]
+            self._commit_progress()
+
+        # Còn lệnh chờ thì chạy tiếp ngay, lệnh chờ thử lại sẽ chạy vào lần kích hoạt sau
+        remaining = self.search_count([('state', '=', 'pending'), ('next_attempt_at', '<=', now)])
+        if remaining:
+            self.env.ref('trcf_printer_manager.ir_cron_trcf_printer_job_dispatch')._trigger()
+        next_retry = self.search([('state', '=', 'pending'), ('next_attempt_at', '>', now)], order='next_attempt_at', limit=1)
+        if next_retry:
+            self.env.ref('trcf_printer_manager.ir_cron_trcf_printer_job_dispatch')._trigger(next_retry.next_attempt_at)
+
+        # Dọn lệnh in đã xong / lỗi cũ
+        self.env.cr.execute("""
+            DELETE FROM trcf_printer_job
+             WHERE state != 'pending'
+               AND create_date < (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+        """, [KEEP_DAYS])
+        return True
+
+    def _commit_progress(self):
+        """Commit trạng thái lệnh in ngay để không in lại khi cron bị ngắt giữa chừng"""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
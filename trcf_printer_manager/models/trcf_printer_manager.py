@@ -1,4 +1,5 @@
-from odoo import models, fields
+from odoo import models, fields, api
+from odoo.tools import ormcache
 
 class TrcfPrinterManager(models.Model):
     _name = 'trcf.printer.manager'
@@ -38,4 +39,52 @@ class TrcfPrinterManager(models.Model):
     invoice_footer_text = fields.Text(
         string='Chân trang hóa đơn',
         help="Nội dung sẽ được in ở cuối hóa đơn"
-    )
\ No newline at end of file
+    )
+
+    @api.model
+    @ormcache()
+    def _get_printer_routing(self):
+        """
+        Bảng định tuyến máy in, dựng một lần cho mỗi registry và xóa khi máy in thay đổi.
+
+        Returns:
+            dict {
+                'invoice': (printer_id, ...),
+                'label': {pos_preset_id: (printer_id, ...)},
+                'kitchen_order_ticket': {pos_category_id: (printer_id, ...)},
+            }
+        """
+        routing = {'invoice': [], 'label': {}, 'kitchen_order_ticket': {}}
+        for printer in self.sudo().search([('active', '=', True)], order='id'):
+            if printer.printer_type == 'invoice':
+                routing['invoice'].append(printer.id)
+            elif printer.printer_type == 'label':
+                for preset_id in printer.printer_label_pos_preset_ids.ids:
+                    routing['label'].setdefault(preset_id, []).append(printer.id)
+            elif printer.printer_type == 'kitchen_order_ticket':
+                for category_id in printer.printer_kot_pos_category_ids.ids:
+                    routing['kitchen_order_ticket'].setdefault(category_id, []).append(printer.id)
+
+        # Giá trị trong cache phải bất biến
+        return {
+            'invoice': tuple(routing['invoice']),
+            'label': {key: tuple(ids) for key, ids in routing['label'].items()},
+            'kitchen_order_ticket': {key: tuple(ids) for key, ids in routing['kitchen_order_ticket'].items()},
+        }
+
+    # Bảng định tuyến và phần đầu / chân hóa đơn được cache, cần xóa cache khi cấu hình máy in thay đổi
+    @api.model_create_multi
+    def create(self, vals_list):
+        printers = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return printers
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
@@ -0,0 +1,12 @@
+from odoo import models
+
+
+class TrcfPrinterResCompany(models.Model):
+    _inherit = "res.company"
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Phần đầu hóa đơn đã render sẵn chứa tên và địa chỉ công ty
+        if {'name', 'street'} & vals.keys():
+            self.env.registry.clear_cache()
+        return res
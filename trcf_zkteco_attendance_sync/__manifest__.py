@@ -30,6 +30,7 @@
     ],
     'data': [
         'security/ir.model.access.csv',
+        'data/trcf_zkteco_sync_cron.xml',
         'views/trcf_zkteco_device_views.xml',
         'views/trcf_menu_views.xml',
         'views/trcf_hr_attendance_views.xml',
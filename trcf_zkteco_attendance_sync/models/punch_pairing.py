@@ -0,0 +1,166 @@
+"""
+Ghép cặp giờ vào / ra từ log chấm công ZKTeco.
+
+Module thuần Python (không dùng ORM) để có thể kiểm thử và đo hiệu năng độc lập:
+    python3 trcf_zkteco_attendance_sync/models/punch_pairing.py
+"""
+import calendar
+import random
+import time
+from datetime import datetime, timedelta
+
+DUPLICATE_THRESHOLD_MINUTES = 15  # Ngưỡng phát hiện duplicate (phút)
+OVERNIGHT_CUTOFF_HOUR = 4  # Ca qua đêm: lần chấm trước 4h sáng hôm sau vẫn là giờ ra của ca hôm trước
+
+SECONDS_PER_DAY = 86400
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(timestamp):
+    """Giờ thiết bị (datetime không timezone) -> số giây, giữ nguyên giờ địa phương"""
+    return calendar.timegm(timestamp.timetuple())
+
+
+def from_epoch(epoch):
+    """Số giây -> datetime không timezone theo giờ thiết bị"""
+    return EPOCH + timedelta(seconds=epoch)
+
+
+def pair_punches(punches, duplicate_threshold_minutes=DUPLICATE_THRESHOLD_MINUTES,
+                 overnight_cutoff_hour=OVERNIGHT_CUTOFF_HOUR):
+    """
+    Ghép cặp vào / ra trong một lần duyệt.
+
+    Quy tắc:
+    - Lần chấm cách lần chấm trước của cùng người dưới ngưỡng duplicate thì bỏ qua
+    - Các lần chấm còn lại lần lượt là vào, ra, vào, ra...
+    - Giờ vào chưa có giờ ra được ghép với lần chấm kế tiếp nếu lần đó trước
+      overnight_cutoff_hour giờ sáng hôm sau (ca qua đêm); ngược lại tự đóng lúc 23:59:59
+      ngày vào và lần chấm kế tiếp trở thành giờ vào mới
+
+    Args:
+        punches: các cặp (user, epoch) đã sắp xếp theo (user, epoch)
+
+    Returns:
+        list [(user, check_in_epoch, check_out_epoch, auto_closed)]
+    """
+    threshold = duplicate_threshold_minutes * 60
+    cutoff = overnight_cutoff_hour * 3600
+    pairs = []
+    append = pairs.append
+
+    current_user = None
+    previous = None
+    open_in = None
+    close_before = None  # Hạn chót ghép giờ ra cho giờ vào đang mở
+
+    for user, epoch in punches:
+        if user != current_user:
+            if open_in is not None:
+                append((current_user, open_in, open_in - open_in % SECONDS_PER_DAY + SECONDS_PER_DAY - 1, True))
+            current_user = user
+            open_in = None
+        elif epoch - previous < threshold:
+            # ⏭️ DUPLICATE
+            previous = epoch
+            continue
+        previous = epoch
+
+        if open_in is None:
+            open_in = epoch
+            close_before = epoch - epoch % SECONDS_PER_DAY + SECONDS_PER_DAY + cutoff
+        elif epoch < close_before:
+            append((user, open_in, epoch, False))
+            open_in = None
+        else:
+            append((user, open_in, open_in - open_in % SECONDS_PER_DAY + SECONDS_PER_DAY - 1, True))
+            open_in = epoch
+            close_before = epoch - epoch % SECONDS_PER_DAY + SECONDS_PER_DAY + cutoff
+
+    if open_in is not None:
+        append((current_user, open_in, open_in - open_in % SECONDS_PER_DAY + SECONDS_PER_DAY - 1, True))
+    return pairs
+
+
+def pair_punches_in_window(punches, date_from, date_to, **kwargs):
+    """
+    Ghép cặp trên toàn bộ log rồi chỉ giữ các cặp có giờ vào trong [date_from, date_to].
+
+    Lần chấm trước date_from vẫn được duyệt để biết lần chấm đầu khoảng là giờ vào hay giờ ra
+    (ca qua đêm): cắt log tại một mốc giờ cố định sẽ biến giờ ra sau nửa đêm thành giờ vào.
+
+    Args:
+        punches: các cặp (user, epoch) đã sắp xếp theo (user, epoch)
+        date_from, date_to: khoảng ngày (date) của giờ vào cần lấy
+    """
+    start = to_epoch(datetime.combine(date_from, datetime.min.time()))
+    end = to_epoch(datetime.combine(date_to, datetime.min.time())) + SECONDS_PER_DAY
+    return [pair for pair in pair_punches(punches, **kwargs) if start <= pair[1] < end]
+
+
+def check_incremental_overnight():
+    """
+    Kiểm tra hồi quy: đồng bộ tăng dần không được biến giờ ra sau nửa đêm thành giờ vào.
+
+    Log 01-01 22:00, 01-02 02:00, 01-02 22:00 với mốc đã tải 01-02 02:00: khoảng xử lý lại
+    bắt đầu từ ngày trước mốc, cặp 02:00 -> 22:00 không được xuất hiện.
+    """
+    def punches_at(*timestamps):
+        return sorted(('1', to_epoch(timestamp)) for timestamp in timestamps)
+
+    watermark = datetime(2025, 1, 2, 2, 0)
+    pairs = pair_punches_in_window(
+        punches_at(datetime(2025, 1, 1, 22), datetime(2025, 1, 2, 2), datetime(2025, 1, 2, 22)),
+        watermark.date() - timedelta(days=1), watermark.date(),
+    )
+    assert pairs == [
+        ('1', to_epoch(datetime(2025, 1, 1, 22)), to_epoch(datetime(2025, 1, 2, 2)), False),
+        ('1', to_epoch(datetime(2025, 1, 2, 22)), to_epoch(datetime(2025, 1, 2, 23, 59, 59)), True),
+    ], pairs
+
+    # Nhiều ca đêm liên tiếp: lần chấm trước khoảng vẫn giữ đúng thứ tự vào / ra
+    pairs = pair_punches_in_window(
+        punches_at(datetime(2024, 12, 31, 22), datetime(2025, 1, 1, 2), datetime(2025, 1, 1, 22),
+                   datetime(2025, 1, 2, 2), datetime(2025, 1, 2, 22), datetime(2025, 1, 3, 2)),
+        watermark.date(), watermark.date(),
+    )
+    assert pairs == [
+        ('1', to_epoch(datetime(2025, 1, 2, 22)), to_epoch(datetime(2025, 1, 3, 2)), False),
+    ], pairs
+
+
+def benchmark_pair_punches(punch_count=100000, user_count=60, seed=0):
+    """Đo thời gian ghép cặp trên log giả lập (mỗi người 2 ca / ngày, kèm lần chấm lặp)"""
+    rng = random.Random(seed)
+    start = to_epoch(datetime(2025, 1, 1))
+    punches = []
+    day = 0
+    while len(punches) < punch_count:
+        for user in range(1, user_count + 1):
+            for shift_start_hour in (7, 15):
+                check_in = start + day * SECONDS_PER_DAY + shift_start_hour * 3600 + rng.randint(-900, 900)
+                punches.append((str(user), check_in))
+                if rng.random() < 0.2:
+                    punches.append((str(user), check_in + rng.randint(5, 300)))  # Chấm lặp
+                punches.append((str(user), check_in + 8 * 3600 + rng.randint(-900, 900)))
+        day += 1
+    punches = punches[:punch_count]
+
+    started = time.perf_counter()
+    punches.sort()
+    sorted_at = time.perf_counter()
+    pairs = pair_punches(punches)
+    finished = time.perf_counter()
+    return {
+        'punches': len(punches),
+        'pairs': len(pairs),
+        'sort_seconds': sorted_at - started,
+        'pair_seconds': finished - sorted_at,
+    }
+
+
+if __name__ == '__main__':
+    check_incremental_overnight()
+    result = benchmark_pair_punches()
+    print(f"{result['punches']} lần chấm -> {result['pairs']} cặp | "
+          f"sắp xếp {result['sort_seconds'] * 1000:.1f} ms | ghép cặp {result['pair_seconds'] * 1000:.1f} ms")
@@ -1,4 +1,5 @@
-from odoo import models, fields
+from odoo import api, models, fields
+from odoo.tools import ormcache
 
 class TrcfHrEmployee(models.Model):
     _inherit = 'hr.employee'
@@ -10,4 +11,32 @@ class TrcfHrEmployee(models.Model):
     )
 
     trcf_device_id_num = fields.Char(string='ZkTeco Device ID',
-                                help="Id của nhân viên trên thiết bị")
\ No newline at end of file
+                                help="Id của nhân viên trên thiết bị")
+
+    @api.model
+    @ormcache()
+    def _get_device_employee_map(self):
+        """Bảng ánh xạ ZkTeco Device ID -> employee id, đọc một query và cache đến khi employee thay đổi"""
+        employees = self.sudo().search_read(
+            [('trcf_device_id_num', '!=', False)], ['trcf_device_id_num'], order='id desc'
+        )
+        # Trùng Device ID thì lấy employee có id nhỏ nhất (ghi sau cùng)
+        return {employee['trcf_device_id_num']: employee['id'] for employee in employees}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        employees = super().create(vals_list)
+        if any(vals.get('trcf_device_id_num') for vals in vals_list):
+            self.env.registry.clear_cache()
+        return employees
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'trcf_device_id_num', 'active'} & vals.keys():
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
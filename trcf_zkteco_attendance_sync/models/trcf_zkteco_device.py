@@ -1,13 +1,122 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import logging
 import pytz
+import time as time_module
 from odoo.exceptions import UserError
 from odoo import _
 from datetime import datetime, timedelta, time
 
+from .punch_pairing import OVERNIGHT_CUTOFF_HOUR, pair_punches_in_window, to_epoch, from_epoch
+
+_logger = logging.getLogger(__name__)
+
 # Hằng số cấu hình
-DUPLICATE_THRESHOLD_MINUTES = 15  # Ngưỡng phát hiện duplicate (phút)
+MAX_SYNC_WORKERS = 8  # Số thiết bị tải song song tối đa
+DOWNLOAD_TIMEOUT_MARGIN_SECONDS = 30  # Thời gian chờ thêm ngoài timeout kết nối của thiết bị
+MAX_CLOCK_DRIFT_SECONDS = 60  # Chỉ chỉnh giờ thiết bị khi lệch quá ngưỡng này
+CONNECTION_CHECK_TIMEOUT_SECONDS = 3  # Timeout kiểm tra kết nối định kỳ
+DEFAULT_DEVICE_TZ = 'Asia/Saigon'  # Giờ thiết bị khi công ty chưa khai báo timezone
+DEVICE_LOCK_NAMESPACE = 0x2C7E0  # Khoá advisory (key1) của thiết bị: máy chỉ nhận một kết nối TCP mỗi lúc
+
+
+def _download_device_data(ip_address, port, timeout, tz_name, known_record_count=None):
+    """
+    Tải log chấm công từ một thiết bị (chạy trong thread riêng, không dùng ORM).
+
+    Giờ thiết bị chỉ được chỉnh lại khi lệch quá MAX_CLOCK_DRIFT_SECONDS,
+    dùng chung kết nối với lần tải dữ liệu.
+
+    Args:
+        known_record_count: số bản ghi trên máy lần trước; không đổi thì bỏ qua việc tải log
+
+    Returns:
+        dict {'attendances': [(device_user_id, timestamp)], 'device_info': str,
+              'record_count': int, 'latest': datetime, 'unchanged': bool}
+    """
+    from zk import ZK
+
+    zk = ZK(ip_address, port=port or 4370, timeout=timeout)
+    conn = zk.connect()
+    if not conn:
+        raise UserError(_("Cannot connect to device."))
+
+    try:
+        # Đồng bộ giờ thiết bị theo timezone của cửa hàng
+        local_now = datetime.now(pytz.timezone(tz_name)).replace(tzinfo=None)
+        device_time = conn.get_time()
+        drift_seconds = (device_time - local_now).total_seconds()
+        if abs(drift_seconds) > MAX_CLOCK_DRIFT_SECONDS:
+            conn.set_time(local_now)
+            device_info = f'Timezone: {tz_name} | Before: {device_time} | After: {local_now} | Drift: {drift_seconds:.0f}s'
+        else:
+            device_info = f'Timezone: {tz_name} | Device time: {device_time} | Drift: {drift_seconds:.0f}s'
+
+        # Số bản ghi không đổi so với lần trước → không có lần chấm công mới, không cần tải log
+        conn.read_sizes()
+        record_count = conn.records
+        if known_record_count is not None and record_count == known_record_count:
+            return {'attendances': [], 'device_info': device_info,
+                    'record_count': record_count, 'latest': None, 'unchanged': True}
+
+        attendances = []
+        latest = None
+        for att in conn.get_attendance():
+            if not att.timestamp:
+                continue
+            if latest is None or att.timestamp > latest:
+                latest = att.timestamp
+            attendances.append((str(att.user_id), att.timestamp))
+        return {'attendances': attendances, 'device_info': device_info,
+                'record_count': record_count, 'latest': latest, 'unchanged': False}
+    finally:
+        conn.disconnect()
+
+
+def _check_device_connection(ip_address, port):
+    """Kiểm tra kết nối bằng cách lấy serial number (chạy trong thread riêng)"""
+    try:
+        from zk import ZK
+
+        zk = ZK(ip_address, port=port or 4370, timeout=CONNECTION_CHECK_TIMEOUT_SECONDS)
+        conn = zk.connect()
+        if not conn:
+            return False
+        try:
+            return bool(conn.get_serialnumber())
+        finally:
+            conn.disconnect()
+    except Exception:
+        return False
+
+
+def _clear_device_log(ip_address, port, timeout, expected_record_count):
+    """
+    Xoá log chấm công trên thiết bị sau khi đã lưu vào Odoo.
+
+    Chỉ xoá khi số bản ghi trên máy vẫn bằng số bản ghi vừa tải, tránh mất lần chấm công
+    phát sinh giữa lúc tải và lúc xoá. Trả về True nếu đã xoá.
+    """
+    from zk import ZK
+
+    zk = ZK(ip_address, port=port or 4370, timeout=timeout)
+    conn = zk.connect()
+    if not conn:
+        raise UserError(_("Cannot connect to device."))
+
+    try:
+        conn.disable_device()
+        try:
+            conn.read_sizes()
+            if conn.records != expected_record_count:
+                return False
+            conn.clear_attendance()
+            return True
+        finally:
+            conn.enable_device()
+    finally:
+        conn.disconnect()
 
 class TrcfZktecoDevice(models.Model):
     _name = 'trcf.zkteco.device'
@@ -61,9 +170,14 @@ class TrcfZktecoDevice(models.Model):
     # ===== STATUS FIELDS =====
     is_connected = fields.Boolean(
         string='Trạng thái kết nối',
-        compute='_compute_connection_status',
-        store=False,
-        help='Trạng thái kết nối hiện tại với thiết bị'
+        readonly=True,
+        help='Trạng thái kết nối ở lần kiểm tra gần nhất (cron kiểm tra định kỳ, không mở kết nối khi mở form)'
+    )
+
+    last_check_date = fields.Datetime(
+        string='Lần kiểm tra cuối',
+        readonly=True,
+        help='Thời điểm kiểm tra kết nối gần nhất'
     )
     
     device_info = fields.Text(
@@ -77,6 +191,31 @@ class TrcfZktecoDevice(models.Model):
         readonly=True,
         help='Thời điểm đồng bộ dữ liệu gần nhất'
     )
+
+    sync_watermark = fields.Datetime(
+        string='Mốc chấm công đã tải',
+        readonly=True,
+        help='Thời điểm chấm công mới nhất đã tải (giờ thiết bị); đồng bộ tự động chỉ xử lý từ ngày của mốc này'
+    )
+
+    sync_record_count = fields.Integer(
+        string='Số bản ghi trên máy',
+        readonly=True,
+        help='Số bản ghi chấm công trên thiết bị ở lần đồng bộ gần nhất'
+    )
+
+    clear_device_log = fields.Boolean(
+        string='Xoá log trên máy sau khi tải',
+        default=False,
+        help='Xoá log chấm công trên thiết bị sau khi đã lưu vào Odoo. '
+             'Chỉ xoá khi thiết bị chưa có lần chấm công nào trong ngày (ví dụ lần đồng bộ ban đêm)'
+    )
+
+    last_sync_error = fields.Text(
+        string='Lỗi sync gần nhất',
+        readonly=True,
+        help='Lỗi của lần đồng bộ gần nhất (trống nếu thành công)'
+    )
     
     # ===== ADDITIONAL FIELDS =====
     active = fields.Boolean(
@@ -85,34 +224,56 @@ class TrcfZktecoDevice(models.Model):
         help='Kích hoạt/Vô hiệu hóa thiết bị'
     )
 
-    @api.depends()
-    def _compute_connection_status(self):
-        """Kiểm tra kết nối bằng cách lấy serial number"""
-        for record in self:
-            try:
-                from zk import ZK
-                
-                # Kiểm tra có IP không
-                if not record.ip_address:
-                    record.is_connected = False
-                    continue
-                
-                # Thử kết nối và lấy serial
-                zk = ZK(record.ip_address, port=record.port or 4370, timeout=3)
-                conn = zk.connect()
-                
-                if conn:
-                    try:
-                        # Lấy serial number làm test kết nối
-                        serial = conn.get_serialnumber()
-                        record.is_connected = bool(serial)
-                    finally:
-                        conn.disconnect()
-                else:
-                    record.is_connected = False
-                
-            except Exception:
-                record.is_connected = False
+    @api.model
+    def _cron_check_connections(self):
+        """
+        Cron: kiểm tra kết nối song song tất cả thiết bị, lưu kết quả vào is_connected.
+
+        Bỏ qua thiết bị đang đồng bộ (đang giữ khoá thiết bị): máy chỉ nhận một kết nối,
+        mở thêm kết nối sẽ làm hỏng lần tải hoặc báo sai là mất kết nối.
+        """
+        devices = self.search([('ip_address', '!=', False)])._try_lock_devices()
+        if not devices:
+            return True
+
+        executor = ThreadPoolExecutor(max_workers=min(len(devices), MAX_SYNC_WORKERS),
+                                      thread_name_prefix='trcf_zkteco_check')
+        try:
+            futures = {
+                device: executor.submit(_check_device_connection, device.ip_address, device.port)
+                for device in devices
+            }
+            status = {}
+            for device, future in futures.items():
+                try:
+                    status[device] = future.result(timeout=CONNECTION_CHECK_TIMEOUT_SECONDS * 2)
+                except Exception:
+                    status[device] = False
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        now = fields.Datetime.now()
+        for is_connected in (True, False):
+            devices.filtered(lambda device: status[device] == is_connected).write({
+                'is_connected': is_connected,
+                'last_check_date': now,
+            })
+        return True
+
+    def _lock_devices(self):
+        """Khoá các thiết bị tới hết transaction (chờ nếu cron kiểm tra kết nối đang giữ)"""
+        self.env.cr.execute("""
+            SELECT pg_advisory_xact_lock(%s, id) FROM unnest(%s::int[]) AS id
+        """, [DEVICE_LOCK_NAMESPACE, sorted(self.ids)])
+
+    def _try_lock_devices(self):
+        """Khoá các thiết bị tới hết transaction nếu được, trả về các thiết bị đã khoá"""
+        if not self:
+            return self
+        self.env.cr.execute("""
+            SELECT id FROM unnest(%s::int[]) AS id WHERE pg_try_advisory_xact_lock(%s, id) ORDER BY id
+        """, [self.ids, DEVICE_LOCK_NAMESPACE])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
 
     # ====== METHOD =====
     def action_check_connection(self):
@@ -133,7 +294,7 @@ class TrcfZktecoDevice(models.Model):
                 conn.disconnect()
                 
                 # Cập nhật trạng thái
-                self.is_connected = True
+                self.write({'is_connected': True, 'last_check_date': fields.Datetime.now()})
 
                 message = f'Serial: {serial_number} - {user_count} nhân viên'
                 
@@ -147,7 +308,7 @@ class TrcfZktecoDevice(models.Model):
                     }
                 }
             else:
-                self.is_connected = False
+                self.write({'is_connected': False, 'last_check_date': fields.Datetime.now()})
                 return {
                     'type': 'ir.actions.client',
                     'tag': 'display_notification',
@@ -159,7 +320,7 @@ class TrcfZktecoDevice(models.Model):
                 }
         
         except Exception as e:
-            self.is_connected = False
+            self.write({'is_connected': False, 'last_check_date': fields.Datetime.now()})
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
@@ -172,205 +333,8 @@ class TrcfZktecoDevice(models.Model):
 
     def action_sync_data(self):
         """Đồng bộ dữ liệu từ thiết bị ZKTeco"""
-
-        # SET TIMEZONE TRƯỚC KHI SYNC
-        self.action_set_timezone()
-
         try:
-            from zk import ZK
-            # Kết nối đến thiết bị
-            zk = ZK(self.ip_address, port=self.port or 4370, timeout=5)
-            conn = zk.connect()
-            
-            if not conn:
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'display_notification',
-                    'params': {
-                        'title': '❌ Lỗi kết nối',
-                        'message': 'Không thể kết nối đến thiết bị',
-                        'type': 'danger',
-                    }
-                }
-            
-            try:
-                # Lấy danh sách users => users_data
-                users = conn.get_users()
-                users_data = []
-                for user in users:
-                    user_info = {
-                        'uid': user.uid,
-                        'name': user.name,
-                        'privilege': user.privilege,
-                        'password': user.password,
-                        'group_id': user.group_id,
-                        'user_id': user.user_id,
-                    }
-                    users_data.append(user_info)
-                    print(f"ID: {user.uid} | Name: {user.name} | Privilege: {user.privilege} | Group: {user.group_id}")
-
-                # Lấy dữ liệu chấm công
-                attendances = conn.get_attendance()
-                print("=== DỮ LIỆU CHẤM CÔNG THÁNG===")
-                attendance_data = []
-
-                # ===== FILTER THEO KHOẢNG THỜI GIAN =====
-                sync_from = self.env.context.get('sync_from') or self.sync_date_from
-                sync_to = self.env.context.get('sync_to') or self.sync_date_to
-
-                # Convert về datetime.date - cách Odoo chuẩn
-                if sync_from:
-                    sync_from = fields.Date.from_string(sync_from) if isinstance(sync_from, str) else sync_from
-                if sync_to:
-                    sync_to = fields.Date.from_string(sync_to) if isinstance(sync_to, str) else sync_to
-
-                for att in attendances:
-                    att_date = att.timestamp.date()
-                    # Kiểm tra trong khoảng thời gian
-                    if sync_from <= att_date <= sync_to:
-                        attendance_info = {
-                            'uid': att.uid,
-                            'user_id': att.user_id,
-                            'timestamp': att.timestamp.strftime('%Y-%m-%d %H:%M:%S') if att.timestamp else None,
-                            'status': att.status,
-                            'punch': att.punch,
-                            'date': att.timestamp.date() if att.timestamp else None,
-                            'time': att.timestamp.time() if att.timestamp else None,
-                        }
-                        attendance_data.append(attendance_info)
-                        print(f"User ID: {att.user_id} | Time: {att.timestamp}")
-                
-                # Sắp xếp lại thứ tự theo thời gian
-                attendance_data.sort(key=lambda x: datetime.strptime(x['timestamp'], '%Y-%m-%d %H:%M:%S'))
-                print(f"\nTổng số bản ghi chấm công {sync_from} - {sync_to}: {len(attendance_data)}")
-
-                attendance_group = defaultdict(lambda: defaultdict(list))
-                
-                for record in attendance_data:
-                    user_id_tamp = str(record['user_id'])
-                    date_tamp = str(record['date'])
-                    attendance_group[user_id_tamp][date_tamp].append(record)
-
-                #Danh sách hr_attendance_list sẵn sàn đưa vào dữ liệu
-                hr_attendance_list = []
-                
-                for user_id, dates_dict in attendance_group.items(): 
-                    print(f"\n=== Xử lý User ID: {user_id} ===")
-
-                    # Chuyển user_id trên máy thành employee_id
-                    employee_find  = self._find_employee_by_device_id(user_id)
-                    if not employee_find:
-                        print(f"❌ Không tìm thấy employee với device_user_id: {user_id}")
-                        continue
-                    
-                    # Sắp xếp các ngày theo thứ tự thời gian
-                    sorted_dates = sorted(dates_dict.keys())
-                    
-                    for date_str in sorted_dates:
-                        attendance_list = dates_dict[date_str]
-                        print(f"  📅 Ngày: {date_str}")
-                        
-                        # Sắp xếp theo thời gian trong ngày
-                        attendance_list.sort(key=lambda record: datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S'))
-                        
-                        check_count = 0;
-                        for current_record in attendance_list: 
-                            if(check_count == 0):
-                                print(f"    ✅ CHECKIN: {current_record['timestamp']}")
-                                checkin_str = current_record['timestamp']
-
-                                hr_attendance_record = {}
-                                hr_attendance_record['employee_id'] = employee_find.id
-                                hr_attendance_record['check_in'] = current_record['timestamp']
-
-                                check_count = 1
-                                previous_time = datetime.strptime(current_record['timestamp'], '%Y-%m-%d %H:%M:%S')
-                            else: 
-                                is_duplicate_record = False
-                                
-                                # Lấy thời gian record hiện tại 
-                                current_time = datetime.strptime(current_record['timestamp'], '%Y-%m-%d %H:%M:%S')
-
-                                #so sánh 2 giá trị gần nhau quá 15 phút là sẽ là duplitcate
-                                time_difference_minutes = abs((current_time - previous_time).total_seconds() / 60)
-
-                                #Lấy lại thời gian record trước
-                                previous_time = datetime.strptime(current_record['timestamp'], '%Y-%m-%d %H:%M:%S')
-
-                                if(time_difference_minutes < DUPLICATE_THRESHOLD_MINUTES): 
-                                    is_duplicate_record = True
-
-                                if(is_duplicate_record == True):
-                                    time_gap = round(time_difference_minutes, 1)
-                                    print(f"    ⏭️  DUPLICATE: {current_record['timestamp']} (cách {time_gap} phút)")
-                                else:
-                                    check_count +=1
-                                    if(check_count % 2 == 1):
-                                        print(f"    ✅ CHECKIN: {current_record['timestamp']}")
-                                        checkin_str = current_record['timestamp']
-                                        hr_attendance_record = {}
-                                        hr_attendance_record['employee_id'] = employee_find.id
-                                        hr_attendance_record['check_in'] = current_record['timestamp']
-                                    else: 
-                                        print(f"    🚪 CHECKOUT: {current_record['timestamp']}")
-                                        hr_attendance_record['check_out'] = current_record['timestamp']
-                                        hr_attendance_list.append(hr_attendance_record)
-                                        # print(f" record: {hr_attendance_record}")
-
-                        if check_count % 2 == 1: 
-                            checkin = datetime.strptime(checkin_str, "%Y-%m-%d %H:%M:%S")
-                            hr_attendance_record['check_out'] = datetime.combine(checkin.date(), time(23, 59, 59)).strftime("%Y-%m-%d %H:%M:%S")
-                            hr_attendance_list.append(hr_attendance_record)
-                            # print(f" record: {hr_attendance_record}")
-
-                # Tạo message tóm tắt
-                message = f"Số lượng nhân viên: chưa tính | Lần chấm công: chưa tính"
-                
-                for hr_record in hr_attendance_list: 
-                    # Tạo record mới trong hr.attendance
-                    
-                    # Lấy timezone user
-                    user_timezone = pytz.timezone(self.env.user.tz or 'UTC')
-                    offset_hours = datetime.now(user_timezone).utcoffset().total_seconds() / 3600
-
-                    # Chuyển thời gian thiết bị về UTC
-                    check_in_record = datetime.strptime(hr_record['check_in'], '%Y-%m-%d %H:%M:%S')
-                    check_out_record = datetime.strptime(hr_record['check_out'], '%Y-%m-%d %H:%M:%S')
-
-                    check_in = check_in_record - timedelta(hours=offset_hours)
-                    check_out = check_out_record - timedelta(hours=offset_hours)
-
-                    # 🔍 KIỂM TRA DUPLICATE: Đã có dữ liệu chấm công trong ngày này chưa?
-                    existing_attendance = self.env['hr.attendance'].search([
-                        ('employee_id', '=', hr_record['employee_id']),
-                        ('check_in', '=', check_in), 
-                    ], limit=1)
-
-                    if existing_attendance :
-                        print(f"❌ Đã có thông tin chấm công user_id {hr_record['employee_id']} : {check_in_record}")
-                        continue; 
-
-                    attendance_record = self.env['hr.attendance'].create({
-                        'employee_id': int(hr_record['employee_id']),
-                        'check_in': check_in,
-                        'check_out': check_out,
-                    })
-                    print(f"✅ đã cập nhật chấm công user_id {hr_record['employee_id']} : {check_in_record} - {check_out_record}")
-
-                return {
-                    'type': 'ir.actions.client',
-                    'tag': 'display_notification',
-                    'params': {
-                        'title': '✅ Đồng bộ thành công',
-                        'message': message,
-                        'type': 'success',
-                        'sticky': True,
-                    }
-                }
-                
-            finally:
-                conn.disconnect()
-                
+            import zk  # noqa: F401
         except ImportError:
             return {
                 'type': 'ir.actions.client',
@@ -381,20 +345,252 @@ class TrcfZktecoDevice(models.Model):
                     'type': 'warning',
                 }
             }
-            
-        except Exception as e:
-            print(f"Lỗi đồng bộ: {str(e)}")
+
+        # ===== KHOẢNG THỜI GIAN ĐỒNG BỘ =====
+        sync_from = self.env.context.get('sync_from') or self.sync_date_from
+        sync_to = self.env.context.get('sync_to') or self.sync_date_to
+
+        errors = self._sync_devices(sync_from, sync_to)
+        if errors:
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
                     'title': '❌ Lỗi đồng bộ',
-                    'message': f'Chi tiết: {str(e)}',
+                    'message': ' | '.join(f'{device.name}: {error}' for device, error in errors.items()),
                     'type': 'danger',
                     'sticky': True,
                 }
             }
-    
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': '✅ Đồng bộ thành công',
+                'message': f"Số lượng nhân viên: chưa tính | Lần chấm công: chưa tính",
+                'type': 'success',
+                'sticky': True,
+            }
+        }
+
+    @api.model
+    def _cron_sync_devices(self):
+        """Cron: đồng bộ song song tất cả thiết bị đang hoạt động"""
+        self.search([])._sync_devices(commit=True)
+        return True
+
+    @api.model
+    def _get_device_tz(self):
+        """
+        Timezone của giờ thiết bị: timezone công ty, mặc định DEFAULT_DEVICE_TZ.
+        Dùng chung cho việc chỉnh giờ máy và đổi giờ chấm công sang UTC, không phụ thuộc
+        người chạy (cron chạy bằng user của cron).
+        """
+        return self.env.company.partner_id.tz or DEFAULT_DEVICE_TZ
+
+    def _get_auto_sync_window(self):
+        """Khoảng đồng bộ tự động: từ ngày trước ngày của mốc đã tải tới hôm nay"""
+        self.ensure_one()
+        today = fields.Date.context_today(self.with_context(tz=self._get_device_tz()))
+        if not self.sync_watermark:
+            return today.replace(day=1), today
+        # Ca qua đêm vào từ ngày trước mốc vẫn có thể nhận giờ ra mới (trước OVERNIGHT_CUTOFF_HOUR)
+        return self.sync_watermark.date() - timedelta(days=1), today
+
+    def _sync_devices(self, sync_from=None, sync_to=None, commit=False):
+        """
+        Tải dữ liệu song song từ các thiết bị rồi ghi kết quả từng thiết bị.
+        Không truyền khoảng thời gian thì mỗi thiết bị dùng _get_auto_sync_window() và mốc đã tải
+        (sync_watermark): chỉ các cặp có giờ vào từ ngày trước ngày của mốc được ghi, và nếu số bản ghi
+        trên máy không đổi thì không tải log.
+
+        Việc tải (pyzk, mạng) chạy trong thread pool với timeout riêng cho mỗi thiết bị;
+        việc ghi (ORM) chạy ở thread chính, mỗi thiết bị trong một savepoint riêng để lỗi
+        của một thiết bị không ảnh hưởng thiết bị khác. commit=True (cron): commit sau mỗi thiết bị.
+
+        Returns:
+            dict {device: error} các thiết bị bị lỗi
+        """
+        if isinstance(sync_from, str):
+            sync_from = fields.Date.from_string(sync_from)
+        if isinstance(sync_to, str):
+            sync_to = fields.Date.from_string(sync_to)
+        tz_name = self._get_device_tz()
+        # Giữ khoá thiết bị trong lúc tải (tới lần commit đầu) để cron kiểm tra kết nối không mở kết nối chen vào
+        self._lock_devices()
+
+        # 1. Tải song song, không giữ cursor / ORM trong thread
+        results = {}
+        executor = ThreadPoolExecutor(max_workers=max(min(len(self), MAX_SYNC_WORKERS), 1),
+                                      thread_name_prefix='trcf_zkteco')
+        try:
+            started = time_module.monotonic()
+            futures = {}
+            for device in self:
+                known_record_count = None
+                if not sync_from and device.sync_watermark:
+                    known_record_count = device.sync_record_count
+                futures[device] = executor.submit(_download_device_data, device.ip_address, device.port,
+                                                  device.timeout or 30, tz_name, known_record_count)
+            for device, future in futures.items():
+                deadline = started + (device.timeout or 30) + DOWNLOAD_TIMEOUT_MARGIN_SECONDS
+                try:
+                    results[device] = (future.result(timeout=max(deadline - time_module.monotonic(), 0)), None)
+                except FutureTimeoutError:
+                    results[device] = (None, UserError(_("Hết thời gian chờ thiết bị %s", device.ip_address)))
+                except Exception as e:
+                    results[device] = (None, e)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # 2. Ghi kết quả, mỗi thiết bị một transaction
+        errors = {}
+        for device, (data, error) in results.items():
+            try:
+                if error:
+                    raise error
+                with self.env.cr.savepoint():
+                    vals = {
+                        'last_sync_date': fields.Datetime.now(),
+                        'last_sync_error': False,
+                        'is_connected': True,
+                        'device_info': data['device_info'],
+                    }
+                    if sync_from:
+                        device._import_attendances(data['attendances'], sync_from, sync_to)
+                    elif not data['unchanged']:
+                        device._import_attendances(data['attendances'], *device._get_auto_sync_window())
+                        # Mốc chỉ tiến khi đồng bộ tự động (đồng bộ tay có thể chỉ lấy một khoảng cũ)
+                        vals['sync_record_count'] = data['record_count']
+                        if data['latest'] and (not device.sync_watermark or data['latest'] > device.sync_watermark):
+                            vals['sync_watermark'] = data['latest']
+                    device.write(vals)
+            except Exception as e:
+                _logger.warning("Lỗi đồng bộ thiết bị ZKTeco %s (%s): %s", device.name, device.ip_address, e)
+                device.write({'last_sync_error': str(e)})
+                errors[device] = e
+            if commit and not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+                if device not in errors and device.clear_device_log:
+                    device._rotate_device_log(tz_name)
+        return errors
+
+    def _rotate_device_log(self, tz_name):
+        """
+        Xoá log trên thiết bị sau khi dữ liệu đã commit.
+
+        Chỉ xoá khi không còn giờ vào nào có thể đang chờ giờ ra: mọi lần chấm trên máy đều
+        không muộn hơn mốc, nên khi đã qua OVERNIGHT_CUTOFF_HOUR giờ sáng hôm sau ngày của mốc
+        thì mọi ca đều đã đóng. Xoá sớm hơn sẽ mất giờ vào của ca qua đêm.
+        """
+        self.ensure_one()
+        if not self.sync_record_count or not self.sync_watermark:
+            return
+        device_now = datetime.now(pytz.timezone(tz_name)).replace(tzinfo=None)
+        all_closed_at = datetime.combine(self.sync_watermark.date() + timedelta(days=1), time(OVERNIGHT_CUTOFF_HOUR))
+        if device_now < all_closed_at:
+            return
+        # Khoá đã nhả khi commit: cron kiểm tra kết nối đang giữ máy thì để lần sau
+        if not self._try_lock_devices():
+            return
+        try:
+            if _clear_device_log(self.ip_address, self.port, self.timeout or 30, self.sync_record_count):
+                self.write({'sync_record_count': 0})
+                self.env.cr.commit()
+                _logger.info("Đã xoá log chấm công trên thiết bị ZKTeco %s", self.name)
+        except Exception as e:
+            _logger.warning("Không xoá được log thiết bị ZKTeco %s (%s): %s", self.name, self.ip_address, e)
+
+    def _import_attendances(self, attendances, sync_from, sync_to):
+        """
+        Ghép cặp vào / ra và tạo hr.attendance từ log chấm công của thiết bị.
+
+        Ghép cặp trên toàn bộ log rồi chỉ ghi các cặp có giờ vào trong [sync_from, sync_to],
+        để giờ ra sau nửa đêm của ca trước khoảng không bị coi là giờ vào.
+
+        Args:
+            attendances: list [(device_user_id, timestamp)] theo giờ thiết bị
+        """
+        self.ensure_one()
+        # Đổi sang (user, epoch) và sắp xếp một lần
+        punches = sorted((device_user_id, to_epoch(timestamp)) for device_user_id, timestamp in attendances)
+        pairs = pair_punches_in_window(punches, sync_from, sync_to)
+
+        # Chuyển user_id trên máy thành employee_id (một lần cho cả lô)
+        employee_ids = self._find_employee_ids_by_device_ids({pair[0] for pair in pairs})
+
+        #Danh sách hr_attendance_list sẵn sàn đưa vào dữ liệu
+        hr_attendance_list = []
+        for device_user_id, check_in, check_out, _auto_closed in pairs:
+            employee_id = employee_ids.get(device_user_id)
+            if not employee_id:
+                continue
+            hr_attendance_list.append({
+                'employee_id': employee_id,
+                'check_in': from_epoch(check_in),
+                'check_out': from_epoch(check_out),
+            })
+
+        return self._upsert_attendances(hr_attendance_list)
+
+    @api.model
+    def _upsert_attendances(self, hr_attendance_list):
+        """
+        Ghi các cặp vào / ra vào hr.attendance theo lô.
+
+        Khóa (employee_id, check_in) đã có trong khoảng thời gian được đọc bằng một query;
+        cặp mới được tạo bằng một lần create(vals_list). Bản ghi đã có mà đang bị tự đóng lúc
+        nửa đêm (ca chưa chấm ra ở lần sync trước) được cập nhật giờ ra thực tế.
+
+        Args:
+            hr_attendance_list: list [{'employee_id', 'check_in', 'check_out'}] theo giờ thiết bị
+
+        Returns:
+            tuple (số bản ghi tạo mới, số bản ghi cập nhật)
+        """
+        if not hr_attendance_list:
+            return 0, 0
+
+        # Lấy timezone thiết bị một lần cho cả lô, chuyển thời gian thiết bị về UTC
+        device_timezone = pytz.timezone(self._get_device_tz())
+        offset = datetime.now(device_timezone).utcoffset()
+
+        vals_by_key = {}
+        for hr_record in hr_attendance_list:
+            check_in = hr_record['check_in'] - offset
+            check_out = hr_record['check_out'] - offset
+            vals_by_key[(int(hr_record['employee_id']), check_in)] = {
+                'employee_id': int(hr_record['employee_id']),
+                'check_in': check_in,
+                'check_out': check_out,
+            }
+
+        # 🔍 KIỂM TRA DUPLICATE: một query cho toàn bộ khoảng thời gian
+        check_ins = [check_in for _employee_id, check_in in vals_by_key]
+        existing = self.env['hr.attendance'].search_fetch([
+            ('employee_id', 'in', list({employee_id for employee_id, _check_in in vals_by_key})),
+            ('check_in', '>=', min(check_ins)),
+            ('check_in', '<=', max(check_ins)),
+        ], ['employee_id', 'check_in', 'check_out'])
+        existing_by_key = {(attendance.employee_id.id, attendance.check_in): attendance for attendance in existing}
+
+        # Tạo mới phần chênh lệch
+        new_keys = vals_by_key.keys() - existing_by_key.keys()
+        self.env['hr.attendance'].create([vals_by_key[key] for key in sorted(new_keys)])
+
+        # Cập nhật giờ ra cho bản ghi bị tự đóng lúc nửa đêm
+        updated = 0
+        for key in vals_by_key.keys() & existing_by_key.keys():
+            attendance = existing_by_key[key]
+            check_out = vals_by_key[key]['check_out']
+            auto_closed = attendance.check_out and (attendance.check_out + offset).time() == time(23, 59, 59)
+            if auto_closed and attendance.check_out != check_out:
+                attendance.write({'check_out': check_out})
+                updated += 1
+
+        _logger.info("ZKTeco: tạo %s, cập nhật %s bản ghi chấm công", len(new_keys), updated)
+        return len(new_keys), updated
+
     # ===== THÊM CÁC METHOD HỖ TRỢ =====
     def action_set_timezone(self):
         """Set timezone với thời gian chính xác"""
@@ -413,7 +609,7 @@ class TrcfZktecoDevice(models.Model):
                 print(f"⏰ Device time BEFORE: {device_time_before}")
                 
                 # ✅ SỬA: Lấy đúng thời gian theo timezone
-                user_tz = self.env.context.get('tz') or self.env.user.tz or 'Asia/Saigon'
+                user_tz = self._get_device_tz()
                 target_timezone = pytz.timezone(user_tz)
                 
                 # ✅ ĐÚNG: Lấy thời gian hiện tại theo timezone
@@ -462,20 +658,36 @@ class TrcfZktecoDevice(models.Model):
         except Exception as e:
             raise UserError(_(f"Error: {str(e)}"))
 
+    def _find_employee_ids_by_device_ids(self, device_user_ids):
+        """
+        Tìm employee cho nhiều device_user_id.
+
+        Returns:
+            dict {device_user_id: employee_id} (chỉ các user tìm thấy)
+        """
+        # Phương pháp 1: Tìm theo trcf_device_id_num (bảng ánh xạ đã cache)
+        device_map = self.env['hr.employee']._get_device_employee_map()
+        result = {
+            device_user_id: device_map[device_user_id]
+            for device_user_id in device_user_ids
+            if device_user_id in device_map
+        }
+
+        # Phương pháp 2: Tìm theo ID trực tiếp (một query cho các user còn lại)
+        remaining = {
+            int(device_user_id): device_user_id
+            for device_user_id in device_user_ids
+            if device_user_id not in result and str(device_user_id).isdigit()
+        }
+        for employee in self.env['hr.employee'].browse(remaining).exists():
+            result[remaining[employee.id]] = employee.id
+
+        missing = set(device_user_ids) - result.keys()
+        if missing:
+            _logger.info("ZKTeco: không tìm thấy employee với device_user_id %s", sorted(missing))
+        return result
+
     def _find_employee_by_device_id(self, device_user_id):
         """Tìm employee dựa trên device_user_id """
-        
-        # Phương pháp 1: Tìm theo trcf_device_id_num
-        employee = self.env['hr.employee'].search([
-            ('trcf_device_id_num', '=', str(device_user_id))
-        ], limit=1)
-        if employee.exists():
-            return employee
-        
-        # Phương pháp 2: Tìm theo ID trực tiếp
-        employee = self.env['hr.employee'].browse(device_user_id)
-        if employee.exists():
-            return employee
-        
-        # Không tìm thấy
-        return False
+        employee_id = self._find_employee_ids_by_device_ids({str(device_user_id)}).get(str(device_user_id))
+        return self.env['hr.employee'].browse(employee_id) if employee_id else False